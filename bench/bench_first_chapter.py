@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[bench_first_chapter.py]
+  Description:	Time to the first completed chapter of small -B batches.
+  				Each batch runs the script in a fresh copy of the repo
+  				config, against a local stand-in for Syosetu serving
+  				generated WeakMage chapters, so no page, memo or index
+  				cache carries over between runs. The time of every
+  				"complete!" line is taken from the script's own output.
+  				The src/ of a git revision is run the same way as the
+  				"before" of each batch size, the working tree as "after"
+
+  Usage:		python bench_first_chapter.py [--baseline REV]
+  				[--batches 2 4 8] [--runs N]
+"""
+from timeit import default_timer as clock
+from html import escape
+import http.server 		# Stand-in host
+import socketserver 	# Threaded server
+import subprocess 		# Script runs
+import threading 		# Server thread
+import argparse 		# Command line
+import tempfile 		# Repo copies
+import shutil 			# Repo copies
+import json 			# Config rewrite
+import sys 				# Interpreter path
+import os 				# File paths
+import re 				# Request paths
+
+import benchutils
+
+SCRIPT_PATH = os.path.join(benchutils.SRC_PATH, "wn_downtrans.py")
+SERIES = "WeakMage"
+
+# Lines of a generated chapter, about a typical Syosetu chapter
+CHAPTER_LINES = 300
+
+PAGE = ('<html><head><meta charset="utf-8"></head><body>'
+	+ '<p class="novel_subtitle">第%d話</p>'
+	+ '<div id="novel_p" class="novel_view"><p id="Lp1">前書きです</p></div>'
+	+ '<div id="novel_honbun" class="novel_view">\n%s</div>'
+	+ '<div id="novel_a" class="novel_view"><p id="La1">あとがきです</p></div>'
+	+ '</body></html>')
+
+class StandInServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+	daemon_threads = True
+
+def makeHandler(raws):
+	"""-------------------------------------------------------------------
+		Function:		[makeHandler]
+		Description:	Creates a handler serving a distinct generated
+						chapter for every /<code>/<ch> path
+		Input:
+		  [raws]		Dictionary raws spliced into the chapter lines
+		Return:			The handler class
+		------------------------------------------------------------------
+	"""
+	lines = benchutils.fixtureLines()
+	pages = {}
+	lock = threading.Lock()
+
+	def page(ch):
+		with lock:
+			if ch not in pages:
+				chapter = benchutils.makeChapter(lines, CHAPTER_LINES, raws, 2, ch)
+				body = "\n".join('<p id="L%d">%s</p>' % (i, escape(line))
+					for (i, (ltype, line)) in enumerate(chapter[1:], 1))
+				pages[ch] = (PAGE % (ch, body)).encode('utf8')
+			return pages[ch]
+
+	class ChapterHandler(http.server.BaseHTTPRequestHandler):
+		protocol_version = "HTTP/1.1"
+
+		def log_message(self, *args):
+			pass
+
+		def do_GET(self):
+			match = re.search(r"/(\d+)/?$", self.path)
+			body = page(int(match.group(1)) if match is not None else 0)
+			self.send_response(200)
+			self.send_header("Content-Type", "text/html; charset=utf-8")
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+	return ChapterHandler
+
+def makeRepo(base_url, rev=None):
+	"""-------------------------------------------------------------------
+		Function:		[makeRepo]
+		Description:	Copies the config, dictionaries and resources into a
+						temporary repo whose Syosetu host is the stand-in
+		Input:
+		  [base_url]	Base url of the stand-in server
+		  [rev]			Git revision whose src/ is extracted into the repo,
+		  				None to leave src/ empty and run the working tree
+		Return:			Path of the temporary repo
+		------------------------------------------------------------------
+	"""
+	root = tempfile.mkdtemp(prefix="bench_repo_")
+	shutil.copy(os.path.join(benchutils.REPO_PATH, "honorifics.json"), root)
+	for name in ("dicts", "resources"):
+		shutil.copytree(os.path.join(benchutils.REPO_PATH, name),
+			os.path.join(root, name), ignore=shutil.ignore_patterns(".compiled"))
+	if rev is None:
+		os.mkdir(os.path.join(root, "src"))
+	else:
+		archive = subprocess.run(["git", "archive", rev, "src"],
+			cwd=benchutils.REPO_PATH, stdout=subprocess.PIPE, check=True).stdout
+		subprocess.run(["tar", "-x", "-C", root], input=archive, check=True)
+
+	with open(os.path.join(benchutils.REPO_PATH, "user_config.json"), 'r',
+		encoding='utf8') as config_file:
+		config = json.load(config_file)
+	config['write_raw'] = False
+	for host in config['hosts']:
+		if host['host_name'] == "Syosetu":
+			host['base_url'] = base_url
+			host['rate'] = None
+	with open(os.path.join(root, "user_config.json"), 'w',
+		encoding='utf8') as config_file:
+		json.dump(config, config_file, ensure_ascii=False, indent=2)
+	return root
+
+def runBatch(base_url, batch, rev=None):
+	"""-------------------------------------------------------------------
+		Function:		[runBatch]
+		Description:	Runs one -B batch in a fresh repo copy
+		Input:
+		  [base_url]	Base url of the stand-in server
+		  [batch]		Number of chapters in the batch
+		  [rev]			Git revision to run, None for the working tree
+		Return:			List of seconds from script start to each completed
+						chapter, followed by the seconds to exit
+		------------------------------------------------------------------
+	"""
+	root = makeRepo(base_url, rev)
+	script = SCRIPT_PATH if rev is None else \
+		os.path.join(root, "src", "wn_downtrans.py")
+	try:
+		start = clock()
+		proc = subprocess.Popen([sys.executable, "-u", script, "-B",
+			SERIES, "1", str(batch)], cwd=os.path.join(root, "src"),
+			stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+			universal_newlines=True)
+		marks = []
+		for line in proc.stdout:
+			if "] complete!" in line:
+				marks.append(clock() - start)
+		proc.wait()
+		marks.append(clock() - start)
+		if proc.returncode != 0 or len(marks) != batch + 1:
+			print("[Error] Batch of %d failed with code %d" % (batch,
+				proc.returncode))
+			sys.exit(1)
+		return marks
+	finally:
+		shutil.rmtree(root, ignore_errors=True)
+
+def main():
+	parser = argparse.ArgumentParser(description="Time to first chapter benchmark")
+	parser.add_argument('--baseline', default="HEAD",
+		help="Git revision to compare the working tree against")
+	parser.add_argument('--batches', type=int, nargs='+', default=[2, 4, 8],
+		help="Batch sizes to run, at least 2 as -B needs end > start")
+	parser.add_argument('--runs', type=int, default=3,
+		help="Runs per batch size, the fastest first chapter counts")
+	args = parser.parse_args()
+	if min(args.batches) < 2:
+		parser.error("Batch sizes must be at least 2")
+
+	(dictionary, series_lang) = benchutils.loadDictionary(SERIES)
+	raws = [raw for layer in dictionary.getLayers() for raw in layer.entries]
+	server = StandInServer(("127.0.0.1", 0), makeHandler(raws))
+	threading.Thread(target=server.serve_forever, args=(0.05,),
+		daemon=True).start()
+	base_url = "http://127.0.0.1:%d/" % server.server_address[1]
+
+	print("before: %s, after: working tree\n" % args.baseline)
+	print("%6s %-7s %12s %14s %12s" % ("batch", "", "first", "per chapter",
+		"exit"))
+	for batch in args.batches:
+		for (label, rev) in (("before", args.baseline), ("after", None)):
+			marks = min((runBatch(base_url, batch, rev) for i in range(args.runs)),
+				key=lambda marks: marks[0])
+			# Steady state: the average gap between later completions
+			steady = (marks[-2] - marks[0]) / (batch - 1)
+			print("%6d %-7s %9.0f ms %11.0f ms %9.0f ms" % (batch, label,
+				marks[0] * 1000, steady * 1000, marks[-1] * 1000))
+	server.shutdown()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[bench_matcher.py]
+  Description:	Dictionary matching of a line with the compiled trie of
+  				DictMatcher against the loop HtmlWriter used before it,
+  				which ran "entry in line" and line.replace() for every
+  				entry of the expanded dictionary, longest entries first.
+  				Uses weakmage.dict with common.dict and the honorifics
+
+  Usage:		python bench_matcher.py [--lines N] [--runs N]
+"""
+import argparse 	# Command line
+
+import benchutils
+import dictmatcher
+
+# Spans the old loop put around every replaced entry
+ENTRY_SPAN = "<span class=\"notranslate word_mem\" id=w%d>%s</span>"
+PLACEHOLDER_SPAN = "<span class=\"placeholder\" id=%d>placeholder</span>"
+
+def loopReplace(items, line):
+	"""-------------------------------------------------------------------
+		Function:		[loopReplace]
+		Description:	Replaces dictionary entries the way the old
+						HtmlWriter.insertLine did
+		Input:
+		  [items]		List of (raw, translation), longest raws first
+		  [line]		The raw line
+		Return:			(line with spans, number of entries replaced)
+		------------------------------------------------------------------
+	"""
+	p_id = 0
+	for (entry, trans) in items:
+		if entry in line:
+			p_id += 1
+			line = line.replace(entry, ENTRY_SPAN % (p_id, trans)
+				+ PLACEHOLDER_SPAN % p_id)
+	return (line, p_id)
+
+def trieReplace(dictionary, line):
+	"""-------------------------------------------------------------------
+		Function:		[trieReplace]
+		Description:	Replaces dictionary entries in one pass over the raw
+						line with DictMatcher.match
+		Input:
+		  [dictionary]	The DictMatcher
+		  [line]		The raw line
+		Return:			(line with spans, number of entries replaced)
+		------------------------------------------------------------------
+	"""
+	parts = []
+	ids = {}
+	prev = 0
+	for (start, end, trans) in dictionary.match(line):
+		entry = line[start:end]
+		if entry not in ids:
+			ids[entry] = len(ids) + 1
+		parts.append(line[prev:start])
+		parts.append(ENTRY_SPAN % (ids[entry], trans)
+			+ PLACEHOLDER_SPAN % ids[entry])
+		prev = end
+	parts.append(line[prev:])
+	return ("".join(parts), len(ids))
+
+def main():
+	parser = argparse.ArgumentParser(description="Dictionary matcher benchmark")
+	parser.add_argument('--lines', type=int, default=1000,
+		help="Number of lines to match")
+	parser.add_argument('--runs', type=int, default=3,
+		help="Runs of each matcher, the fastest counts")
+	args = parser.parse_args()
+
+	(dictionary, series_lang) = benchutils.loadDictionary("WeakMage")
+	layers = dictionary.getLayers()
+	elapsed = benchutils.bestOf(args.runs, lambda: dictmatcher.DictMatcher(
+		[dictmatcher.DictLayer(layer.entries.items(), layer.names.items(),
+		layer.suffixes.items()) for layer in layers]))
+	print("Trie compile of %d layers: %.1f ms" % (len(layers), elapsed * 1000))
+
+	# The old series dict: every entry and name + honorific, longest first
+	items = sorted(dictionary.items(), key=lambda item: len(item[0]),
+		reverse=True)
+	raws = [raw for layer in dictionary.getLayers() for raw in layer.entries]
+	lines = [line for (ltype, line) in benchutils.makeChapter(
+		benchutils.fixtureLines(), args.lines, raws, 3)]
+	print("%d expanded entries, %d lines\n" % (len(items), len(lines)))
+
+	results = {}
+	for (name, replace) in (("loop", lambda line: loopReplace(items, line)),
+		("trie", lambda line: trieReplace(dictionary, line))):
+		elapsed = benchutils.bestOf(args.runs,
+			lambda: [replace(line) for line in lines])
+		replaced = sum(replace(line)[1] for line in lines)
+		results[name] = elapsed
+		print("%-5s %9.1f ms %9.1f us/line %7d entries replaced" % (name,
+			elapsed * 1000, elapsed / len(lines) * 10**6, replaced))
+
+	print("\nTrie is %.0fx faster than the loop" % (results['loop']
+		/ results['trie']))
+
+if __name__ == '__main__':
+	main()
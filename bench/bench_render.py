@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[bench_render.py]
+  Description:	Rendering time of HtmlWriter as chapters grow from 100 to
+  				10,000 lines. The time per line should stay flat: a
+  				renderer that rewrites the page for every line shows up as
+  				a per-line time growing with the chapter
+
+  Usage:		python bench_render.py [--lang JP|CN] [--runs N]
+"""
+import argparse 	# Command line
+import io 			# In-memory trans file
+
+import benchutils
+import htmlwriter
+
+SIZES = [100, 1000, 10000]
+SKELETON_PATH = "../resources/skeleton.html"
+
+def render(dictionary, chapter, lang):
+	"""-------------------------------------------------------------------
+		Function:		[render]
+		Description:	Renders a chapter as writeTrans does
+		Input:
+		  [dictionary]	Series DictMatcher
+		  [chapter]		List of (LType, line)
+		  [lang]		Series language
+		Return:			None
+		------------------------------------------------------------------
+	"""
+	writer = htmlwriter.HtmlWriter(dictionary, io.StringIO(), SKELETON_PATH)
+	writer.setPageTitle("WeakMage", 1)
+	writer.setChapterTitle("Bench")
+	writer.setSeriesLink("http://localhost/")
+	writer.setChapterLink("http://localhost/1")
+	writer.setChapterNumber("1")
+	for line in chapter:
+		writer.insertLine(line, lang)
+	writer.writeTo(io.StringIO())
+
+def main():
+	parser = argparse.ArgumentParser(description="HtmlWriter scaling benchmark")
+	parser.add_argument('--lang', default="CN", choices=["CN", "JP"],
+		help="Render as CN (raw lines) or JP (romanized lines)")
+	parser.add_argument('--runs', type=int, default=3,
+		help="Runs per size, the fastest counts")
+	args = parser.parse_args()
+
+	(dictionary, series_lang) = benchutils.loadDictionary("WeakMage")
+	raws = [raw for layer in dictionary.getLayers() for raw in layer.entries]
+	lines = benchutils.fixtureLines()
+	if args.lang == "JP":
+		# Build the kakasi converter outside of the timed runs
+		htmlwriter.getConverter()
+
+	print("%8s %10s %12s" % ("lines", "total", "per line"))
+	per_line = {}
+	for size in SIZES:
+		chapter = benchutils.makeChapter(lines, size, raws, 2)
+		def run():
+			# Every line romanized afresh, as on the first render of a chapter
+			htmlwriter.romanize.cache_clear()
+			render(dictionary, chapter, args.lang)
+		elapsed = benchutils.bestOf(args.runs, run)
+		per_line[size] = elapsed / size
+		print("%8d %8.1f ms %9.1f us" % (size, elapsed * 1000,
+			per_line[size] * 10**6))
+
+	print("\nPer-line time at %d lines is %.2fx that at %d lines (1.0 is linear)"
+		% (SIZES[-1], per_line[SIZES[-1]] / per_line[SIZES[0]], SIZES[0]))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[benchutils.py]
+  Description:	Shared setup of the benchmarks. Puts src/ on the import path
+  				and builds chapters and dictionaries out of the saved test
+  				pages and the dictionaries checked into dicts/
+"""
+from timeit import default_timer as clock
+import random 		# Reproducible chapters
+import json 		# Fixture pages
+import sys 			# Import path
+import os 			# File paths
+
+BENCH_PATH = os.path.dirname(os.path.abspath(__file__))
+REPO_PATH = os.path.abspath(os.path.join(BENCH_PATH, ".."))
+SRC_PATH = os.path.join(REPO_PATH, "src")
+FIXTURES_PATH = os.path.join(REPO_PATH, "tests", "fixtures")
+sys.path.insert(0, SRC_PATH)
+
+# The script resolves dicts/, resources/ and the config relative to src/
+os.chdir(SRC_PATH)
+
+from htmlparser import LType
+import dictmatcher
+
+def bestOf(runs, func):
+	"""-------------------------------------------------------------------
+		Function:		[bestOf]
+		Description:	Times a function, keeping the fastest run
+		Input:
+		  [runs]		Number of runs
+		  [func]		Function taking no arguments
+		Return:			Fastest run in seconds
+		------------------------------------------------------------------
+	"""
+	best = float('inf')
+	for i in range(runs):
+		start = clock()
+		func()
+		best = min(best, clock() - start)
+	return best
+
+def fixtureLines(name="syosetu_utf8"):
+	"""-------------------------------------------------------------------
+		Function:		[fixtureLines]
+		Description:	Reads the non-blank parsed lines of a saved page
+		Input:
+		  [name]		Fixture name under tests/fixtures/
+		Return:			List of (LType, line)
+		------------------------------------------------------------------
+	"""
+	with open(os.path.join(FIXTURES_PATH, name + ".json"), 'r',
+		encoding='utf8') as fixture_file:
+		content = json.load(fixture_file)['content']
+	return [(LType[ltype], line) for (ltype, line) in content
+		if not line.isspace()]
+
+def makeChapter(lines, num_lines, raws=(), per_line=0, seed=0):
+	"""-------------------------------------------------------------------
+		Function:		[makeChapter]
+		Description:	Builds a chapter of a given length by cycling through
+						the body lines of a page, splicing dictionary raws
+						into each line so they have something to match
+		Input:
+		  [lines]		List of (LType, line) to cycle through
+		  [num_lines]	Number of lines of the chapter
+		  [raws]		Dictionary raws to splice in
+		  [per_line]	Raws spliced into each line
+		  [seed]		Seed of the random splicing
+		Return:			List of (LType, line), starting with the title
+		------------------------------------------------------------------
+	"""
+	rand = random.Random(seed)
+	raws = list(raws)
+	body = [line for line in lines if line[0] == LType.REG]
+	chapter = [(LType.TITLE, "第%d話" % num_lines)]
+	for i in range(num_lines):
+		(ltype, line) = body[i % len(body)]
+		for j in range(per_line if len(raws) > 0 else 0):
+			pos = rand.randint(0, len(line))
+			line = line[:pos] + rand.choice(raws) + line[pos:]
+		chapter.append((ltype, line))
+	return chapter
+
+def loadDictionary(series, common_opt=True):
+	"""-------------------------------------------------------------------
+		Function:		[loadDictionary]
+		Description:	Compiles the dictionary of a series as initDict does,
+						without touching the compiled dictionary cache
+		Input:
+		  [series]		Series abbreviation, named after its .dict file
+		  [common_opt]	Include common.dict?
+		Return:			(DictMatcher, series language)
+		------------------------------------------------------------------
+	"""
+	import wn_downtrans as wd
+	wd.initConfig()
+	lang = wd.config_data.getSeriesLang(series)
+	suffixes = [(entry['h_raw'], entry['h_trans'])
+		for entry in wd.loadHonorifics(lang)]
+	layers = [dictmatcher.DictLayer([(entry['h_raw'], entry['h_trans'])
+		for entry in wd.loadHonorifics(lang) if entry['standalone']])]
+	paths = [wd.COMMON_DICT_PATH] if common_opt else []
+	paths.append(os.path.join(wd.DICT_PATH, series.lower() + ".dict"))
+	for path in paths:
+		(entries, names) = wd.processDictFile(lang, path)
+		layers.append(dictmatcher.DictLayer(entries, names, suffixes))
+	return (dictmatcher.DictMatcher(layers), lang)
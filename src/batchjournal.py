@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[batchjournal.py]
+  Description:	This module keeps an append-only journal of how far every
+  				chapter of a batch got (fetched, rendered, written) along
+  				with a hash of what each stage produced, so an interrupted
+  				batch can be resumed without redoing finished chapters
+"""
+from timeit import default_timer as clock 	# Sync interval timer
+import threading 							# Journal locking
+import os 									# File operations
+
+# The batch journal location
+JOURNAL_PATH = os.path.join("../cache/journal/")
+
+# Chapter statuses in the order a chapter reaches them
+FETCHED = "fetched"
+RENDERED = "rendered"
+WRITTEN = "written"
+FAILED = "failed"
+
+# Records are handed to the OS as they are made so they survive the process
+# dying, but are only forced to disk once this many have accumulated or this
+# many seconds have passed. Losing the tail to a power cut just redoes it
+SYNC_RECORDS = 64
+SYNC_SECONDS = 2.0
+
+def hashData(data):
+	"""-------------------------------------------------------------------
+		Function:		[hashData]
+		Description:	Hashes the output of a stage
+		Input:
+		  [data]		Bytes or text, text is hashed as UTF-8
+		Return:			Hex digest of data
+		------------------------------------------------------------------
+	"""
+	import hashlib 		# Stage output hashing
+	if isinstance(data, str):
+		data = data.encode('utf8')
+	return hashlib.sha1(data).hexdigest()
+
+class BatchJournal:
+	#--------------------------------------------------------------------------
+	#  ctor
+	#--------------------------------------------------------------------------
+	def __init__(self, series, resume=False):
+		"""-------------------------------------------------------------------
+			Function:		[CONSTRUCTOR]
+			Description:	Opens the batch journal of a series
+			Input:
+			  [series]		The series the journal belongs to
+			  [resume]		Keep the records of earlier batches? A new batch
+			  				starts from an empty journal otherwise
+			------------------------------------------------------------------
+		"""
+		if not os.path.exists(JOURNAL_PATH):	os.makedirs(JOURNAL_PATH)
+		self.__path = os.path.join(JOURNAL_PATH, "%s.journal" % series.lower())
+		self.__lock = threading.Lock()
+		self.__unsynced = 0
+		self.__synced_at = clock()
+
+		# ch -> (latest status, hash of what that stage produced)
+		self.__chapters = {}
+		if resume:
+			self.__load()
+		flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+		if not resume:
+			flags |= os.O_TRUNC
+		self.__fd = os.open(self.__path, flags, 0o644)
+
+	def __load(self):
+		try:
+			with open(self.__path, 'r', encoding='utf8') as journal_file:
+				for line in journal_file:
+					# A record cut short by a crash is the last line, skip it
+					fields = line.rstrip('\n').split('\t')
+					if not line.endswith('\n') or len(fields) != 3:
+						continue
+					try:
+						self.__chapters[int(fields[0])] = (fields[1], fields[2])
+					except ValueError:
+						continue
+		except OSError:
+			pass
+
+	#--------------------------------------------------------------------------
+	#  Recording functions
+	#--------------------------------------------------------------------------
+	def record(self, ch, status, digest=""):
+		"""-------------------------------------------------------------------
+			Function:		[record]
+			Description:	Appends the status of a chapter to the journal.
+							Safe to call from several threads
+			Input:
+			  [ch]			The chapter number
+			  [status]		FETCHED, RENDERED, WRITTEN or FAILED
+			  [digest]		Hash of what the stage produced
+			Return:			None
+			------------------------------------------------------------------
+		"""
+		entry = ("%d\t%s\t%s\n" % (ch, status, digest)).encode('utf8')
+		with self.__lock:
+			self.__chapters[ch] = (status, digest)
+			os.write(self.__fd, entry)
+			self.__unsynced += 1
+			if self.__unsynced >= SYNC_RECORDS or \
+				clock() - self.__synced_at >= SYNC_SECONDS:
+				self.__sync()
+
+	def __sync(self):
+		os.fsync(self.__fd)
+		self.__unsynced = 0
+		self.__synced_at = clock()
+
+	def close(self):
+		with self.__lock:
+			if self.__fd is None:
+				return
+			if self.__unsynced > 0:
+				self.__sync()
+			os.close(self.__fd)
+			self.__fd = None
+
+	#--------------------------------------------------------------------------
+	#  Query functions
+	#--------------------------------------------------------------------------
+	def getStatus(self, ch):
+		record = self.__chapters.get(ch)
+		return record[0] if record is not None else None
+
+	def getHash(self, ch):
+		record = self.__chapters.get(ch)
+		return record[1] if record is not None else None
+
+	def completedChapters(self, chapters):
+		"""-------------------------------------------------------------------
+			Function:		[completedChapters]
+			Description:	Finds the chapters a previous batch finished
+			Input:
+			  [chapters]	Iterable of chapter numbers to check
+			Return:			Set of the chapters whose latest status is WRITTEN
+			------------------------------------------------------------------
+		"""
+		return set(ch for ch in chapters if self.getStatus(ch) == WRITTEN)
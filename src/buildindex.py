@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[buildindex.py]
+  Description:	This module records what every rendered chapter of a series
+  				was built from: the dictionary version and the dictionary
+  				entries it matched along with their translations. An
+  				inverted index from entries to chapters, together with the
+  				raw index of the series, lets a dictionary edit re-render
+  				only the chapters it affects
+"""
+import os 			# File operations
+
+import dictmatcher 	# Layers of recorded dictionaries
+
+# The build index location
+BUILD_INDEX_PATH = os.path.join("../cache/builds/")
+
+# Most added entries looked up through the raw index one by one. Past this
+# the raw text of each chapter is scanned for all of them instead
+MAX_ADDED_QUERIES = 64
+
+def hashOutput(text):
+	"""-------------------------------------------------------------------
+		Function:		[hashOutput]
+		Description:	Hashes a rendered output
+		Input:
+		  [text]		The rendered text
+		Return:			Hex digest of the UTF-8 bytes of text
+		------------------------------------------------------------------
+	"""
+	import hashlib 		# Output hashing
+	return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+def snapshotLayers(dictionary):
+	"""-------------------------------------------------------------------
+		Function:		[snapshotLayers]
+		Description:	Copies the source tables of the compiled layers of a
+						dictionary, without their tries or the name +
+						honorific variants they expand to
+		Input:
+		  [dictionary]	A DictMatcher
+		Return:			List of (entries, names, suffixes) dicts, lowest
+						precedence first
+		------------------------------------------------------------------
+	"""
+	return [(dict(layer.entries), dict(layer.names), dict(layer.suffixes))
+		for layer in dictionary.getLayers()]
+
+def inLayers(layers, raw):
+	"""-------------------------------------------------------------------
+		Function:		[inLayers]
+		Description:	Determines if a layer snapshot holds an entry, as an
+						entry or as a name followed by a honorific suffix
+		Input:
+		  [layers]		List returned by snapshotLayers
+		  [raw]			The raw to look up
+		Return:			True if raw is in one of the layers
+		------------------------------------------------------------------
+	"""
+	for (entries, names, suffixes) in layers:
+		if raw in entries:
+			return True
+		if len(names) > 0 and any(raw[:-len(suffix)] in names
+			for suffix in suffixes if 0 < len(suffix) < len(raw) and
+			raw.endswith(suffix)):
+			return True
+	return False
+
+def addedEntries(old_layers, new_layers):
+	"""-------------------------------------------------------------------
+		Function:		[addedEntries]
+		Description:	Finds the entries of a dictionary that an older one
+						did not have by comparing their layers. Names and
+						suffixes are only expanded where they were added
+		Input:
+		  [old_layers]	Layer snapshot of the older dictionary
+		  [new_layers]	Layer snapshot of the newer dictionary
+		Return:			Set of added raw entries
+		------------------------------------------------------------------
+	"""
+	candidates = set()
+	for (i, (entries, names, suffixes)) in enumerate(new_layers):
+		(old_entries, old_names, old_suffixes) = old_layers[i] \
+			if i < len(old_layers) else ({}, {}, {})
+		candidates.update(raw for raw in entries if raw not in old_entries)
+		for name in names:
+			new_suffixes = suffixes if name not in old_names else \
+				[suffix for suffix in suffixes if suffix not in old_suffixes]
+			candidates.update(name + suffix for suffix in new_suffixes)
+	return set(raw for raw in candidates if not inLayers(old_layers, raw))
+
+class BuildIndex:
+	#--------------------------------------------------------------------------
+	#  ctor
+	#--------------------------------------------------------------------------
+	def __init__(self, series):
+		"""-------------------------------------------------------------------
+			Function:		[CONSTRUCTOR]
+			Description:	Opens or creates the build index of a series
+			Input:
+			  [series]		The series the index belongs to
+			------------------------------------------------------------------
+		"""
+		import sqlite3 		# Index storage
+		if not os.path.exists(BUILD_INDEX_PATH):	os.makedirs(BUILD_INDEX_PATH)
+		db_path = os.path.join(BUILD_INDEX_PATH, "%s.db" % series.lower())
+		self.__db = sqlite3.connect(db_path)
+		self.__db.executescript("""
+			CREATE TABLE IF NOT EXISTS chapters (
+				ch 		INTEGER PRIMARY KEY,
+				version TEXT NOT NULL,
+				output 	TEXT NOT NULL
+			);
+			CREATE TABLE IF NOT EXISTS terms (
+				term 	TEXT NOT NULL,
+				ch 		INTEGER NOT NULL,
+				trans 	TEXT NOT NULL,
+				PRIMARY KEY (term, ch)
+			) WITHOUT ROWID;
+			CREATE INDEX IF NOT EXISTS terms_ch ON terms (ch);
+			CREATE TABLE IF NOT EXISTS dicts (
+				version TEXT PRIMARY KEY,
+				layers 	BLOB NOT NULL
+			) WITHOUT ROWID;
+		""")
+
+	#--------------------------------------------------------------------------
+	#  Recording functions
+	#--------------------------------------------------------------------------
+	def record(self, ch, dictionary, terms, output_hash):
+		"""-------------------------------------------------------------------
+			Function:		[record]
+			Description:	Records the build of a chapter. Changes are only
+							persisted by save()
+			Input:
+			  [ch]			The chapter number
+			  [dictionary]	The DictMatcher the chapter was rendered with
+			  [terms]		Dictionary entries matched while rendering
+			  [output_hash]	Hash of the rendered translation
+			Return:			None
+			------------------------------------------------------------------
+		"""
+		import pickle 		# Layer snapshots
+		version = dictionary.version()
+		if self.__db.execute("SELECT 1 FROM dicts WHERE version = ?",
+			(version,)).fetchone() is None:
+			self.__db.execute("INSERT INTO dicts VALUES (?, ?)", (version,
+				pickle.dumps(snapshotLayers(dictionary), pickle.HIGHEST_PROTOCOL)))
+
+		self.__db.execute("INSERT OR REPLACE INTO chapters VALUES (?, ?, ?)",
+			(ch, version, output_hash))
+		self.__db.execute("DELETE FROM terms WHERE ch = ?", (ch,))
+		self.__db.executemany("INSERT INTO terms VALUES (?, ?, ?)",
+			((term, ch, dictionary[term]) for term in terms))
+
+	def getOutputHash(self, ch):
+		row = self.__db.execute("SELECT output FROM chapters WHERE ch = ?",
+			(ch,)).fetchone()
+		return row[0] if row is not None else None
+
+	#--------------------------------------------------------------------------
+	#  Query functions
+	#--------------------------------------------------------------------------
+	def affectedChapters(self, dictionary, raw_index):
+		"""-------------------------------------------------------------------
+			Function:		[affectedChapters]
+			Description:	Finds the chapters whose translation may change
+							when re-rendered with the given dictionary
+			Input:
+			  [dictionary]	The current DictMatcher
+			  [raw_index]	The RawIndex of the series
+			Return:			Sorted list of chapter numbers
+			------------------------------------------------------------------
+		"""
+		import pickle 		# Layer snapshots
+		current = dictionary.version()
+		current_layers = None
+		affected = set()
+		for (version, layers) in self.__db.execute("SELECT version, layers "
+			+ "FROM dicts WHERE version != ?", (current,)).fetchall():
+			chapters = set(ch for (ch,) in self.__db.execute("SELECT ch FROM "
+				+ "chapters WHERE version = ?", (version,)))
+			if len(chapters) == 0:
+				continue
+
+			# Removed or changed entries only matter where they matched. An
+			# entry that never won a match cannot change the output
+			matched = {}
+			for (term, ch, trans) in self.__db.execute("SELECT t.term, t.ch, "
+				+ "t.trans FROM terms t JOIN chapters c ON c.ch = t.ch WHERE "
+				+ "c.version = ?", (version,)):
+				if ch not in affected and (term not in dictionary or
+					dictionary[term] != trans):
+					affected.add(ch)
+				matched.setdefault(ch, []).append(term)
+
+			# Entries are numbered by rank, so reordered entries matter where
+			# they matched together
+			old_layers = pickle.loads(layers)
+			old_dictionary = dictmatcher.DictMatcher([dictmatcher.DictLayer(
+				entries.items(), names.items(), suffixes.items())
+				for (entries, names, suffixes) in old_layers])
+			for (ch, terms) in matched.items():
+				if ch not in affected and sorted(terms, key=old_dictionary.rank) \
+					!= sorted(terms, key=dictionary.rank):
+					affected.add(ch)
+
+			# Added entries matter wherever they appear in the raw text
+			if current_layers is None:
+				current_layers = snapshotLayers(dictionary)
+			added = addedEntries(old_layers, current_layers)
+			chapters -= affected
+			if len(added) > MAX_ADDED_QUERIES:
+				for ch in chapters:
+					text = raw_index.getText(ch)
+					if any(raw in text for raw in added):
+						affected.add(ch)
+			else:
+				for raw in added:
+					affected.update(ch for (ch, line_num, line) in
+						raw_index.query(raw) if ch in chapters)
+
+		return sorted(affected)
+
+	def getNumChapters(self):
+		return self.__db.execute("SELECT COUNT(*) FROM chapters").fetchone()[0]
+
+	#--------------------------------------------------------------------------
+	#  Storage functions
+	#--------------------------------------------------------------------------
+	def save(self):
+		"""-------------------------------------------------------------------
+			Function:		[save]
+			Description:	Commits the chapters recorded since the last save,
+							dropping dictionary snapshots no chapter uses
+			Input:			None
+			Return:			None
+			------------------------------------------------------------------
+		"""
+		self.__db.execute("DELETE FROM dicts WHERE version NOT IN "
+			+ "(SELECT DISTINCT version FROM chapters)")
+		self.__db.commit()
+
+	def close(self):
+		self.save()
+		self.__db.close()
@@ -3,61 +3,369 @@
   Author:		Tahmid Khan
   File:			[cacheutils.py]
   Description:	This module provides reading, interpreting
-  				and writing of cache data
+  				and writing of cache data. Series progress and page tables
+  				are kept in a transactional SQLite catalog
 """
+import time
 import re
 import os
+import io
+import glob
 
-# The cache file location
-CACHE_PATH = os.path.join("../cmd_cache.txt")
+# The catalog location. Holds per-series chapter progress and page tables
+CATALOG_PATH = os.path.join("../cache/catalog.db")
+# Seconds a run waits on another run's catalog transaction before failing
+CATALOG_TIMEOUT = 30
 
-def readCacheData():
+# Legacy cache locations, imported into the catalog when it opens if they
+# are new or changed since they were last imported
+LEGACY_CACHE_PATH = os.path.join("../cmd_cache.txt")
+LEGACY_TABLES_PATH = os.path.join("../tables/")
+
+# Compiled artifact location. Bump COMPILED_VERSION whenever the layout of
+# anything pickled there changes so stale artifacts stop matching
+COMPILED_PATH = os.path.join("../dicts/.compiled/")
+COMPILED_VERSION = 2
+
+def openCatalog():
 	"""-------------------------------------------------------------------
-		Function:		[readCacheData]
-		Description:	Writes/updates a series' recent ch cache data
+		Function:		[openCatalog]
+		Description:	Opens the catalog, creating it and importing the
+						legacy cmd_cache.txt and .table files that changed
+						since they were last imported
 		Input:			None
-		Return:			A dict mapping series to their most recent chapter
+		Return:			An open sqlite3 connection to the catalog
 		------------------------------------------------------------------
 	"""
-	cache_data = {}
+	import sqlite3
+	catalog_dir = os.path.dirname(CATALOG_PATH)
+	if not os.path.exists(catalog_dir):	os.makedirs(catalog_dir)
+	db = sqlite3.connect(CATALOG_PATH, timeout=CATALOG_TIMEOUT, 
+		isolation_level=None)
+	db.executescript("""
+		CREATE TABLE IF NOT EXISTS series (
+			abbr 	TEXT PRIMARY KEY,
+			ch_curr INTEGER NOT NULL DEFAULT 0,
+			ch_max 	INTEGER NOT NULL DEFAULT 0,
+			checked REAL
+		) WITHOUT ROWID;
+		CREATE TABLE IF NOT EXISTS page_tables (
+			series 	TEXT NOT NULL,
+			idx 	INTEGER NOT NULL,
+			code 	TEXT NOT NULL,
+			PRIMARY KEY (series, idx)
+		) WITHOUT ROWID;
+		CREATE TABLE IF NOT EXISTS meta (
+			key 	TEXT PRIMARY KEY,
+			value 	TEXT
+		) WITHOUT ROWID;
+	""")
 
-	# Read valid cache data into the data dict
-	pattern = re.compile(r"(.*):CURR=(\d*):MAX=(\d*)\n")
-	with open(CACHE_PATH, 'r') as cache_file:
-		for line in cache_file.readlines():
-			match = pattern.fullmatch(line)
-			if match:
-				series_data = match.group(1)
-				ch_curr = match.group(2)
-				ch_max = match.group(3)
+	# Import each changed legacy file once, even with several runs starting
+	# at the same time
+	stamps = legacyStamps()
+	if len(staleLegacy(db, stamps)) > 0:
+		db.execute("BEGIN IMMEDIATE")
+		try:
+			stale = staleLegacy(db, stamps)
+			importLegacy(db, stale)
+			db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+				((legacyKey(path), stamps[path]) for path in stale))
+			db.execute("COMMIT")
+		except Exception:
+			db.execute("ROLLBACK")
+			raise
+	return db
+
+def legacyStamps():
+	"""-------------------------------------------------------------------
+		Function:		[legacyStamps]
+		Description:	Identifies the current version of every legacy file
+		Input:			None
+		Return:			Dict of legacy file path to its modification time
+						and size
+		------------------------------------------------------------------
+	"""
+	stamps = {}
+	paths = [LEGACY_CACHE_PATH] + sorted(glob.glob(
+		os.path.join(LEGACY_TABLES_PATH, "*.table")))
+	for path in paths:
+		try:
+			stat = os.stat(path)
+		except OSError:
+			continue
+		stamps[path] = "%d:%d" % (stat.st_mtime_ns, stat.st_size)
+	return stamps
+
+def legacyKey(path):
+	return "legacy:" + os.path.basename(path)
+
+def staleLegacy(db, stamps):
+	"""-------------------------------------------------------------------
+		Function:		[staleLegacy]
+		Description:	Finds the legacy files the catalog has not imported
+						in their current version
+		Input:
+			[db]		Connection to the catalog
+			[stamps]	Dict returned by legacyStamps()
+		Return:			List of legacy file paths to import
+		------------------------------------------------------------------
+	"""
+	imported = dict(db.execute("SELECT key, value FROM meta"))
+	# Catalogs from before files were stamped imported every file once
+	if 'imported' in imported and not any(key.startswith("legacy:") 
+		for key in imported):
+		db.executemany("INSERT OR IGNORE INTO meta VALUES (?, ?)",
+			((legacyKey(path), stamp) for (path, stamp) in stamps.items()))
+		return []
+	return [path for (path, stamp) in stamps.items()
+		if imported.get(legacyKey(path)) != stamp]
 
-				# Skip repeat entries
-				if series_data in cache_data:
-					continue
+def importLegacy(db, paths):
+	"""-------------------------------------------------------------------
+		Function:		[importLegacy]
+		Description:	Copies cmd_cache.txt and tables/*.table into the
+						catalog. Chapters never move backwards, and an
+						imported table replaces the stored one. Must run
+						inside a transaction
+		Input:
+			[db]		Connection to the catalog
+			[paths]		The legacy files to import
+		Return:			None
+		------------------------------------------------------------------
+	"""
+	# Read valid cache data, first entry of a series wins
+	pattern = re.compile(r"(.*):CURR=(\d*):MAX=(\d*)\n")
+	if LEGACY_CACHE_PATH in paths:
+		entries = {}
+		try:
+			with open(LEGACY_CACHE_PATH, 'r') as cache_file:
+				for line in cache_file.readlines():
+					match = pattern.fullmatch(line)
+					if match and match.group(1) not in entries:
+						entries[match.group(1)] = (int(match.group(2) or 0),
+							int(match.group(3) or 0))
+		except OSError:
+			pass
+		db.executemany("""
+			INSERT INTO series (abbr, ch_curr, ch_max) VALUES (?, ?, ?)
+			ON CONFLICT (abbr) DO UPDATE SET
+				ch_curr = max(ch_curr, excluded.ch_curr),
+				ch_max 	= max(ch_max, excluded.ch_max)
+		""", ((abbr, ch_curr, ch_max) for (abbr, (ch_curr, ch_max)) 
+			in entries.items()))
 
-				# Record cache data for this row
-				cache_data[series_data] = (ch_curr, ch_max)
+	for table_path in paths:
+		if table_path == LEGACY_CACHE_PATH:
+			continue
+		series = os.path.basename(table_path)[:-len(".table")]
+		try:
+			with io.open(table_path, mode='r', encoding='utf8') as table_file:
+				page_table = [line.rstrip('\n') for line in table_file 
+					if line != u'\n']
+		except OSError:
+			continue
+		if len(page_table) > 0:
+			db.execute("DELETE FROM page_tables WHERE series = ?", (series.lower(),))
+			db.executemany("INSERT INTO page_tables VALUES (?, ?, ?)",
+				((series.lower(), i, code) for (i, code) in enumerate(page_table)))
 
-	return cache_data
+def readCacheData(l_series=None):
+	"""-------------------------------------------------------------------
+		Function:		[readCacheData]
+		Description:	Reads series' recent ch cache data
+		Input:
+			[l_series]	Series to read cache data for, all series if None
+		Return:			A dict mapping series to (current ch, latest ch)
+		------------------------------------------------------------------
+	"""
+	db = openCatalog()
+	try:
+		if l_series is None:
+			rows = db.execute("SELECT abbr, ch_curr, ch_max FROM series")
+		else:
+			l_series = list(l_series)
+			rows = db.execute("SELECT abbr, ch_curr, ch_max FROM series "
+				+ "WHERE abbr IN (%s)" % ",".join("?" * len(l_series)), l_series)
+		return {abbr: (ch_curr, ch_max) for (abbr, ch_curr, ch_max) in rows}
+	finally:
+		db.close()
 
-def writeCacheData(series, l_series, ch_curr=0, ch_max=0):
+def writeCacheData(updates, checked=False):
 	"""-------------------------------------------------------------------
 		Function:		[writeCacheData]
-		Description:	Writes/updates a series' recent ch cache data
+		Description:	Writes/updates series' recent ch cache data in a
+						single transaction. Chapters never move backwards
 		Input:			
-			[series]	The series to write cache data for
-			[ch_curr]	The current chapter downloaded by user for series
-			[ch_max]	The most recent chapter available by author
+			[updates]	Iterable of (series, current ch, latest ch). Pass 0
+						for a chapter that is not being updated
+			[checked]	Record these series as just checked for updates
+		Return:			None
+		------------------------------------------------------------------
+	"""
+	checked_time = time.time() if checked else None
+	db = openCatalog()
+	try:
+		with db:
+			db.execute("BEGIN IMMEDIATE")
+			db.executemany("""
+				INSERT INTO series (abbr, ch_curr, ch_max, checked) 
+				VALUES (?, ?, ?, ?)
+				ON CONFLICT (abbr) DO UPDATE SET
+					ch_curr = max(ch_curr, excluded.ch_curr),
+					ch_max 	= max(ch_max, excluded.ch_max),
+					checked = coalesce(excluded.checked, checked)
+			""", ((series, ch_curr, ch_max, checked_time) 
+				for (series, ch_curr, ch_max) in updates))
+	finally:
+		db.close()
+
+def readPageTable(series):
+	"""-------------------------------------------------------------------
+		Function:		[readPageTable]
+		Description:	Reads the stored page table of a series
+		Input:
+			[series]	The series to read the page table of
+		Return:			List of chapter codes or None if none is stored
+		------------------------------------------------------------------
+	"""
+	db = openCatalog()
+	try:
+		rows = db.execute("SELECT code FROM page_tables WHERE series = ? "
+			+ "ORDER BY idx", (series.lower(),))
+		page_table = [code for (code,) in rows]
+	finally:
+		db.close()
+	return page_table if len(page_table) > 0 else None
+
+def writePageTable(series, page_table):
+	"""-------------------------------------------------------------------
+		Function:		[writePageTable]
+		Description:	Replaces the stored page table of a series
+		Input:
+			[series]	The series the page table belongs to
+			[page_table] List of chapter codes
 		Return:			None
 		------------------------------------------------------------------
 	"""
-	cache_data = readCacheData()
-	cached_ch_curr = int(cache_data[series][0]) if series in cache_data else 0
-	cached_ch_max  = int(cache_data[series][1]) if series in cache_data else 0
-	cache_data[series] = (max(ch_curr, cached_ch_curr), max(ch_max, cached_ch_max))
-	with open(CACHE_PATH, 'w') as cache_file:
-		for entry in cache_data:
-			if entry in l_series:
-				(ch_curr, ch_max) = cache_data[entry]
-				data = "%s:CURR=%s:MAX=%s\n" % (entry, ch_curr, ch_max)
-				cache_file.write(data)
\ No newline at end of file
+	db = openCatalog()
+	try:
+		with db:
+			db.execute("BEGIN IMMEDIATE")
+			db.execute("DELETE FROM page_tables WHERE series = ?", (series.lower(),))
+			db.executemany("INSERT INTO page_tables VALUES (?, ?, ?)",
+				((series.lower(), i, code) for (i, code) in enumerate(page_table)))
+	finally:
+		db.close()
+
+def syncPageTable(series, page_table):
+	"""-------------------------------------------------------------------
+		Function:		[syncPageTable]
+		Description:	Brings the stored page table of a series up to date
+						with one freshly parsed from its index. Codes past
+						the end of the stored table are appended, the table
+						is only rewritten if the host changed the order or
+						removed chapters
+		Input:
+			[series]	The series the page table belongs to
+			[page_table] List of chapter codes parsed from the index
+		Return:			(number of chapters added, index of the first
+						stored code that changed or None)
+		------------------------------------------------------------------
+	"""
+	db = openCatalog()
+	try:
+		with db:
+			db.execute("BEGIN IMMEDIATE")
+			rows = db.execute("SELECT code FROM page_tables WHERE series = ? "
+				+ "ORDER BY idx", (series.lower(),))
+			stored = [code for (code,) in rows]
+
+			# Find the first stored code the index no longer agrees with
+			changed = None
+			for (i, code) in enumerate(stored):
+				if i >= len(page_table) or page_table[i] != code:
+					changed = i
+					break
+
+			if changed is not None:
+				db.execute("DELETE FROM page_tables WHERE series = ? AND idx >= ?",
+					(series.lower(), changed))
+			start = len(stored) if changed is None else changed
+			db.executemany("INSERT INTO page_tables VALUES (?, ?, ?)",
+				((series.lower(), i, page_table[i])
+				for i in range(start, len(page_table))))
+	finally:
+		db.close()
+	return (max(len(page_table) - len(stored), 0), changed)
+
+def hashSources(paths, salt=""):
+	"""-------------------------------------------------------------------
+		Function:		[hashSources]
+		Description:	Hashes the contents of the given source files
+		Input:
+			[paths]		List of source file paths
+			[salt]		Extra string mixed into the hash
+		Return:			Hex digest identifying this exact set of sources
+		------------------------------------------------------------------
+	"""
+	import hashlib
+	digest = hashlib.sha1(("%d:%s" % (COMPILED_VERSION, salt)).encode('utf8'))
+	for path in paths:
+		with open(path, 'rb') as src_file:
+			digest.update(src_file.read())
+		digest.update(b'\0')
+	return digest.hexdigest()
+
+def loadCompiled(name, paths, salt, compile_fn):
+	"""-------------------------------------------------------------------
+		Function:		[loadCompiled]
+		Description:	Loads a compiled artifact built from the given source
+						files, compiling and storing it first if no artifact
+						matches the current contents of those sources
+		Input:
+			[name]		Artifact name, unique per source file and salt
+			[paths]		Source files the artifact is compiled from
+			[salt]		Extra string the artifact depends on
+			[compile_fn] Zero argument function producing the artifact
+		Return:			(the compiled artifact, path it is stored at or None
+						if it could not be stored)
+		------------------------------------------------------------------
+	"""
+	import pickle
+	digest = hashSources(paths, salt)
+	artifact_path = os.path.join(COMPILED_PATH, "%s.%s.pkl" % (name, digest[:16]))
+	try:
+		with open(artifact_path, 'rb') as artifact_file:
+			return (pickle.load(artifact_file), artifact_path)
+	except Exception:
+		pass
+
+	artifact = compile_fn()
+	try:
+		if not os.path.exists(COMPILED_PATH):	os.makedirs(COMPILED_PATH)
+		# Drop artifacts compiled from older versions of these sources
+		for stale in glob.glob(os.path.join(COMPILED_PATH, glob.escape(name) + ".*.pkl")):
+			os.remove(stale)
+		tmp_path = "%s.%d.tmp" % (artifact_path, os.getpid())
+		with open(tmp_path, 'wb') as artifact_file:
+			pickle.dump(artifact, artifact_file, protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp_path, artifact_path)
+	except OSError:
+		print("[Warning] Unable to store compiled artifact [%s]" % name)
+		return (artifact, None)
+
+	return (artifact, artifact_path)
+
+def readCompiled(artifact_path):
+	"""-------------------------------------------------------------------
+		Function:		[readCompiled]
+		Description:	Loads an artifact stored by loadCompiled
+		Input:
+			[artifact_path] Path returned by loadCompiled
+		Return:			The compiled artifact
+		------------------------------------------------------------------
+	"""
+	import pickle
+	with open(artifact_path, 'rb') as artifact_file:
+		return pickle.load(artifact_file)
@@ -5,9 +5,9 @@
   Description:	This module initializes and holds data contained
   				in a given config JSON file customized by the user
 """
-from tabulate import tabulate	# Print pretty tables
 import functools as ft			# For reduction utility function
 import json 					# JSON processing library
+import sys 						# Exit on invalid config
 import cacheutils
 
 # Length of dividers when printing
@@ -15,6 +15,14 @@ DIVIDER_BOLD = "=" * 120
 DIVIDER_THIN = "-" * 120
 L_PADDING = ' ' * 2
 
+# Page cache size limit in MB when user config does not set page_cache_mb
+DEFAULT_PAGE_CACHE_MB = 512
+# Per series render memo size limit in MB when user config does not set
+# render_cache_mb
+DEFAULT_RENDER_CACHE_MB = 64
+# Optional per host request limits, see ratelimit.py for their defaults
+HOST_LIMIT_KEYS = ('rate', 'burst', 'max_connections')
+
 class ConfigData:
 	#--------------------------------------------------------------------------
 	#  ctor
@@ -31,13 +39,15 @@ class ConfigData:
 		with open(config_path) as config_file:
 			config = json.loads(config_file.read())
 
-			# Initialize verbose print function
-			print_verbose = verbose or config['verbose']
-			self.vprint = print if print_verbose else lambda *a,**k: None
+			# Initialize verbose print option
+			self.__verbose = verbose or config['verbose']
 
 			# Initialize other settings
 			self.__write_raw = config['write_raw']
 			self.__use_common_dict = config['use_common_dict']
+			self.__page_cache_mb = config.get('page_cache_mb', DEFAULT_PAGE_CACHE_MB)
+			self.__render_cache_mb = config.get('render_cache_mb', 
+				DEFAULT_RENDER_CACHE_MB)
 			self.__num_hosts = len(config['hosts'])
 			self.__num_series = len(config['series'])
 			browser = config['chrome_path']
@@ -55,6 +65,22 @@ class ConfigData:
 			# Initialize list of series and their corresponding datas
 			self.initSeriesMap(config['series'])
 
+	#--------------------------------------------------------------------------
+	#  Output functions
+	#--------------------------------------------------------------------------
+	def vprint(self, *args, **kwargs):
+		"""-------------------------------------------------------------------
+			Function:		[vprint]
+			Description:	Prints only if verbose output is enabled. Defined
+							as a method so ConfigData stays picklable for
+							worker processes
+			Input:			Same as print()
+			Return:			None
+			------------------------------------------------------------------
+		"""
+		if self.__verbose:
+			print(*args, **kwargs)
+
 	#--------------------------------------------------------------------------
 	#  Initializer functions
 	#--------------------------------------------------------------------------
@@ -68,12 +94,24 @@ class ConfigData:
 			------------------------------------------------------------------
 		"""
 		self.__hosts = {}
+		self.__host_limits = {}
 		self.vprint(DIVIDER_BOLD)
 		self.vprint(L_PADDING + "Detected Host Websites:")
 		self.vprint(DIVIDER_THIN)
 		for entry in hosts:
 			self.__hosts[entry['host_name']] = entry['base_url']
 			self.vprint(L_PADDING + "%-15s: %s" % (entry['host_name'], entry['base_url']))
+
+			# Request limits must be positive numbers, rate may be null
+			limits = {key: entry[key] for key in HOST_LIMIT_KEYS if key in entry}
+			for (key, value) in limits.items():
+				if (value is None and key == 'rate') or (isinstance(value, 
+					(int, float)) and not isinstance(value, bool) and value > 0):
+					continue
+				print("[Error] Invalid \"%s\": %s for the host \'%s\'. Must be "
+					% (key, value, entry['host_name']) + "a positive number")
+				sys.exit(1)
+			self.__host_limits[entry['base_url']] = limits
 		self.vprint(DIVIDER_BOLD + "\n")
 
 	def initSeriesMap(self, series):
@@ -91,9 +129,9 @@ class ConfigData:
 		self.vprint(DIVIDER_BOLD)
 
 		# This is just for aesthetics
-		cache = cacheutils.readCacheData()
-		ch_curr_len = max([len(ccurr) for (ccurr, cmax) in list(cache.values())])
-		ch_max_len  = max([len(cmax) for (ccurr, cmax) in list(cache.values())])
+		cache = cacheutils.readCacheData([entry['abbr'] for entry in series])
+		ch_curr_len = max([len(str(ccurr)) for (ccurr, cmax) in cache.values()], default=1)
+		ch_max_len  = max([len(str(cmax)) for (ccurr, cmax) in cache.values()], default=1)
 		CURR_NDEF = "-" * max(ch_curr_len, 1)
 		MAX_NDEF  = "-" * max(ch_max_len, 1)
 
@@ -109,8 +147,7 @@ class ConfigData:
 				)
 				sys.exit(1)
 
-			ch_curr = int(cache[entry['abbr']][0]) if entry['abbr'] in cache else 0
-			ch_max  = int(cache[entry['abbr']][1]) if entry['abbr'] in cache else 0
+			(ch_curr, ch_max) = cache.get(entry['abbr'], (0, 0))
 			self.__series[entry['abbr']] = {
 				'name'	 : entry['name'],
 				'lang'	 : entry['lang'],
@@ -131,8 +168,10 @@ class ConfigData:
 			data.append(row)
 
 		# Print series config data as pretty table
-		table_str = tabulate(data, headers=headers, numalign="left")
-		self.vprint(L_PADDING + table_str.replace('\n', '\n'+L_PADDING))
+		if self.__verbose:
+			from tabulate import tabulate	# Print pretty tables
+			table_str = tabulate(data, headers=headers, numalign="left")
+			self.vprint(L_PADDING + table_str.replace('\n', '\n'+L_PADDING))
 		self.vprint(DIVIDER_BOLD + "\n")
 
 	#--------------------------------------------------------------------------
@@ -285,6 +324,23 @@ class ConfigData:
 	def getUseCommonDictOpt(self):
 		return self.__use_common_dict
 
+	def getPageCacheSize(self):
+		return self.__page_cache_mb
+
+	def getRenderCacheSize(self):
+		return self.__render_cache_mb
+
+	def getHostLimits(self):
+		"""-------------------------------------------------------------------
+			Function:		[getHostLimits]
+			Description:	Fetches the request limits configured per host
+			Input:			None
+			Return:			Dict of host base URL to dict of the limits set in
+							its hosts entry
+			------------------------------------------------------------------
+		"""
+		return self.__host_limits
+
 	#--------------------------------------------------------------------------
 	#  Validation functions
 	#--------------------------------------------------------------------------
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[dictmatcher.py]
+  Description:	This module compiles a series dictionary into a multi-
+  				pattern matcher that finds every dictionary entry in a
+  				line in a single left-to-right pass. Names are matched
+  				together with any honorific suffix that follows them
+  				without every name + honorific pair being stored
+"""
+from collections import OrderedDict		# Ordered Dictionary
+import re 								# Regex for candidate start scanning
+
+# Key under which a trie node stores the translation of the entry ending at
+# that node. Trie edges are single characters so this never collides
+TERMINAL = ''
+# Key under which a trie node stores the translation of the name ending at
+# that node, which honorific suffixes can follow
+NAME = None
+# Joins a name translation to the translation of its honorific suffix
+SUFFIX_SEP = '-'
+
+#==========================================================================
+#	[DictLayer]
+#	One compiled dictionary source (honorifics, common.dict or a series
+#	dict). Layers are picklable so they can be cached on disk
+#==========================================================================
+class DictLayer:
+	def __init__(self, entries, names=(), suffixes=()):
+		"""-------------------------------------------------------------------
+			Function:		[CONSTRUCTOR]
+			Description:	Compiles the given dictionary entries into a trie
+							and the honorific suffixes names can take into a
+							second one
+			Input:
+			  [entries]		Iterable of (raw, translation) pairs. Later pairs
+			  				override the translation of earlier duplicates
+			  [names]		Iterable of (raw, translation) pairs of the names
+			  				among the entries, matched as "name-honorific"
+			  				when followed by a suffix
+			  [suffixes]	Iterable of (raw, translation) honorific suffixes
+			------------------------------------------------------------------
+		"""
+		self.entries = OrderedDict(entries)
+		self.names = OrderedDict(names)
+		self.suffixes = OrderedDict(suffixes) if len(self.names) > 0 else \
+			OrderedDict()
+		self.ranks = {raw: i for (i, raw) in enumerate(self.entries)}
+		self.suffix_ranks = {raw: i for (i, raw) in enumerate(self.suffixes, 1)}
+		self.suffix_lens = sorted(set(len(raw) for raw in self.suffixes),
+			reverse=True)
+
+		self.trie = {}
+		for (raw, trans) in self.entries.items():
+			node = self.trie
+			for char in raw:
+				node = node.setdefault(char, {})
+			node[TERMINAL] = trans
+		for (raw, trans) in self.names.items():
+			node = self.trie
+			for char in raw:
+				node = node.setdefault(char, {})
+			node[NAME] = trans
+
+		self.suffix_trie = {}
+		for (raw, trans) in self.suffixes.items():
+			node = self.suffix_trie
+			for char in raw:
+				node = node.setdefault(char, {})
+			node[TERMINAL] = trans
+
+	def variant(self, raw):
+		"""-------------------------------------------------------------------
+			Function:		[variant]
+			Description:	Splits a raw into a name and honorific suffix of
+							this layer
+			Input:
+			  [raw]			The raw to split
+			Return:			(name, suffix) or None if raw is not a name
+							followed by a suffix
+			------------------------------------------------------------------
+		"""
+		for length in self.suffix_lens:
+			if length < len(raw) and raw[-length:] in self.suffixes and \
+				raw[:-length] in self.names:
+				return (raw[:-length], raw[-length:])
+		return None
+
+	def get(self, raw):
+		"""-------------------------------------------------------------------
+			Function:		[get]
+			Description:	Looks up an entry or name + suffix of this layer.
+							Entries take precedence over name + suffix
+			Input:
+			  [raw]			The raw to look up
+			Return:			The translation or None
+			------------------------------------------------------------------
+		"""
+		trans = self.entries.get(raw)
+		if trans is None and len(self.names) > 0:
+			split = self.variant(raw)
+			if split is not None:
+				trans = self.names[split[0]] + SUFFIX_SEP + self.suffixes[split[1]]
+		return trans
+
+	def rank(self, raw):
+		"""-------------------------------------------------------------------
+			Function:		[rank]
+			Description:	Position of an entry in this layer. A name + suffix
+							comes right after its name, in suffix order
+			Input:
+			  [raw]			The raw to rank
+			Return:			Sortable position or None if raw is not in this
+							layer
+			------------------------------------------------------------------
+		"""
+		if raw in self.ranks:
+			return (self.ranks[raw], 0)
+		split = self.variant(raw) if len(self.names) > 0 else None
+		if split is not None:
+			return (self.ranks[split[0]], self.suffix_ranks[split[1]])
+		return None
+
+	def __iter__(self):
+		for raw in self.entries:
+			yield raw
+		for name in self.names:
+			for suffix in self.suffixes:
+				if name + suffix not in self.entries:
+					yield name + suffix
+
+	def __len__(self):
+		return len(self.entries) + sum(1 for name in self.names
+			for suffix in self.suffixes if name + suffix not in self.entries)
+
+#==========================================================================
+#	[DictMatcher]
+#	Stack of DictLayers matched together. Entries of later layers take
+#	precedence over identical entries of earlier ones
+#==========================================================================
+class DictMatcher:
+	#--------------------------------------------------------------------------
+	#  ctor
+	#--------------------------------------------------------------------------
+	def __init__(self, layers, version=None):
+		"""-------------------------------------------------------------------
+			Function:		[CONSTRUCTOR]
+			Description:	Overlays the given compiled layers
+			Input:
+			  [layers]		List of DictLayers, lowest precedence first
+			  [version]		What version() returns for these layers, if it
+			  				was already computed
+			------------------------------------------------------------------
+		"""
+		self.__layers = list(layers)
+		self.__tries = [(layer.trie, layer.suffix_trie if len(layer.suffix_trie) 
+			> 0 else None) for layer in self.__layers]
+		self.__version = version
+
+		# Jump straight to characters that can begin an entry instead of
+		# stepping through the line one character at a time
+		first_chars = set()
+		for (trie, suffix_trie) in self.__tries:
+			first_chars.update(trie)
+		first_chars.discard(TERMINAL)
+		first_chars.discard(NAME)
+		pattern = "".join(re.escape(c) for c in sorted(first_chars))
+		self.__starts = re.compile("[%s]" % pattern) if pattern else None
+
+	#--------------------------------------------------------------------------
+	#  Matching functions
+	#--------------------------------------------------------------------------
+	def match(self, line):
+		"""-------------------------------------------------------------------
+			Function:		[match]
+			Description:	Finds the leftmost-longest, non-overlapping
+							dictionary entries in the given line
+			Input:
+			  [line]		The raw line to scan
+			Return:			Generator of (start, end, translation) for each
+							match in order of appearance
+			------------------------------------------------------------------
+		"""
+		if self.__starts is None:
+			return
+
+		n = len(line)
+		candidate = self.__starts.search(line)
+		while candidate is not None:
+			i = candidate.start()
+			(best_end, best_trans) = (-1, None)
+
+			# Walk each layer's trie as far as the line allows, remembering
+			# the longest entry passed along the way. Ties go to later layers
+			# and, within a layer, to entries over name + suffix
+			for (trie, suffix_trie) in self.__tries:
+				node = trie.get(line[i])
+				j = i + 1
+				while node is not None:
+					if suffix_trie is not None and NAME in node and j < n:
+						# Longest honorific suffix right after the name
+						suffix = suffix_trie.get(line[j])
+						k = j + 1
+						while suffix is not None:
+							if TERMINAL in suffix and k >= best_end:
+								(best_end, best_trans) = (k, node[NAME] + 
+									SUFFIX_SEP + suffix[TERMINAL])
+							if k == n:
+								break
+							suffix = suffix.get(line[k])
+							k += 1
+					if TERMINAL in node and j >= best_end:
+						(best_end, best_trans) = (j, node[TERMINAL])
+					if j == n:
+						break
+					node = node.get(line[j])
+					j += 1
+
+			if best_end < 0:
+				candidate = self.__starts.search(line, i + 1)
+			else:
+				yield (i, best_end, best_trans)
+				candidate = self.__starts.search(line, best_end)
+
+	def rank(self, raw):
+		"""-------------------------------------------------------------------
+			Function:		[rank]
+			Description:	Position of the given entry in dictionary order:
+							longest entries first, then by where the entry
+							first appears across the layers
+			Input:
+			  [raw]			A raw dictionary entry
+			Return:			Sortable rank of the entry
+			------------------------------------------------------------------
+		"""
+		for (layer_idx, layer) in enumerate(self.__layers):
+			rank = layer.rank(raw)
+			if rank is not None:
+				return (-len(raw), layer_idx, rank)
+		raise KeyError(raw)
+
+	def version(self):
+		"""-------------------------------------------------------------------
+			Function:		[version]
+			Description:	Identifies the contents of this dictionary
+			Input:			None
+			Return:			Hex digest that changes whenever any entry, its
+							translation or its position in its layer changes
+			------------------------------------------------------------------
+		"""
+		if self.__version is None:
+			# Hash the layers as compiled rather than every name + suffix. In
+			# table order, since rank() and so the entry ids depend on it
+			import hashlib 		# Dictionary versioning
+			digest = hashlib.sha1()
+			for layer in self.__layers:
+				for table in (layer.entries, layer.names, layer.suffixes):
+					for (raw, trans) in table.items():
+						digest.update(("%s\0%s\0" % (raw, trans)).encode('utf8'))
+					digest.update(b'\1')
+			self.__version = digest.hexdigest()
+		return self.__version
+
+	def getLayers(self):
+		return list(self.__layers)
+
+	#--------------------------------------------------------------------------
+	#  Mapping functions
+	#--------------------------------------------------------------------------
+	def __getitem__(self, raw):
+		for layer in reversed(self.__layers):
+			trans = layer.get(raw)
+			if trans is not None:
+				return trans
+		raise KeyError(raw)
+
+	def __contains__(self, raw):
+		return any(layer.get(raw) is not None for layer in self.__layers)
+
+	def __iter__(self):
+		seen = set()
+		for layer in self.__layers:
+			for raw in layer:
+				if raw not in seen:
+					seen.add(raw)
+					yield raw
+
+	def __len__(self):
+		return sum(1 for raw in self)
+
+	def items(self):
+		return [(raw, self[raw]) for raw in self]
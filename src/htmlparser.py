@@ -10,10 +10,79 @@
 # =========================[ Imports ]==========================
 from abc import ABC, abstractmethod		# Pythonic abstract inheritance
 from enum import Enum 					# Pythonic enumerators
-import bs4 as soup 						# Python HTML query tool
+from html import unescape 				# Entity decoding
+import codecs 							# Charset name normalization
+import struct 							# Packed page records
+import zlib 							# Packed page compression
+import sys 								# System operations
 import re 								# Regex for personalized parsing HTML
 
 
+# Content line of the CN hosts, indented by four &nbsp;
+NBSP_LINE_PATTERN = re.compile(r'&nbsp;&nbsp;&nbsp;&nbsp;(.*?)<')
+# Title of a Biquyun chapter page
+BIQUYUN_TITLE_PATTERN = re.compile(r'<div class="bookname">\r\n\t\t\t\t\t<h1>(.*?)\
+			</h1>')
+# Chapter code of a Biquyun table of contents entry
+BIQUYUN_CHAPTER_PATTERN = re.compile(r'<a href="/.*?/(.*?)\.html">')
+# Title of a 69shu chapter page
+SHU69_TITLE_PATTERN = re.compile(r'<div class="h1title">.*?<h1[^>]*>([^<]*)</h1>',
+	re.DOTALL)
+# Title of a Syosetu chapter page
+SYOSETU_TITLE_PATTERN = re.compile(r'<p class="novel_subtitle">(.*?)</p>')
+# Chapter entry of a Syosetu table of contents
+SYOSETU_CHAPTER_PATTERN = re.compile(r"<dl class=\"novel_sublist2\">")
+# Paragraph made of a single literal break tag
+BR_LINE_PATTERN = re.compile(r'\s*<br\s*/>\s*')
+# Charset parameter of a Content-Type header
+HEADER_CHARSET_PATTERN = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.I)
+# Charset declared by a <meta> tag of a page
+META_CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?([\w.:-]+)', re.I)
+# Bytes of a page searched for a <meta> charset
+META_SCAN_BYTES = 4096
+# Declared charsets replaced by a superset that decodes the same pages
+CHARSET_SUPERSETS = {
+	'gbk'		: 'gb18030',
+	'gb2312'	: 'gb18030',
+	'ascii'		: 'utf-8'
+}
+# Python codec names that libxml2 knows by another name. Charsets libxml2
+# does not know at all are decoded by Python before parsing
+LIBXML_CHARSETS = {
+	'euc_jp'	: 'euc-jp',
+	'euc_kr'	: 'euc-kr',
+	'iso2022_jp': 'iso-2022-jp',
+	'utf-8-sig'	: 'utf-8'
+}
+
+# XPath matching elements whose class attribute contains the given class
+HAS_CLASS = "contains(concat(' ', normalize-space(@class), ' '), ' %s ')"
+# XPath expressions used by the parsers, compiled on first use by getXPath
+XPATHS = {
+	'syosetu_pre'	: "//div[@id='novel_p'][%s]" % (HAS_CLASS % "novel_view"),
+	'syosetu_main'	: "//div[@id='novel_honbun'][%s]" % (HAS_CLASS % "novel_view"),
+	'syosetu_post'	: "//div[@id='novel_a'][%s]" % (HAS_CLASS % "novel_view"),
+	'ruby'			: "//ruby[rb]",
+	'ruby_extra'	: "//ruby[rb]/*[not(self::rb)]",
+	'text'			: "string()",
+	'images'		: ".//img",
+	'shu69_toc'		: "(//ul[%s])[1]//li[not(@class) or @class='']" % 
+						(HAS_CLASS % "chapterlist"),
+	'first_link'	: "(.//a)[1]"
+}
+_xpaths = {}
+# Reusable lxml HTML parsers by charset, created by parseTree, along with
+# whether the page must be decoded by Python first
+_html_parsers = {}
+# Byte versions of the text patterns, compiled on first use by findAll
+_byte_patterns = {}
+
+# Header of a packed Page and of each of its records
+PACK_MAGIC = b"WNP1"
+PACK_HEADER = struct.Struct('<II')		# Number of lines, number of images
+PACK_LINE = struct.Struct('<BI')		# LType value, byte length of line
+PACK_TEXT = struct.Struct('<I')			# Byte length of title/image url
+
 # There are different types of content lines
 class LType(Enum):
 	TITLE 	 = 0	# Line is the chapter title
@@ -24,6 +93,71 @@ class LType(Enum):
 	POST_IMG = 5	# Image embedded in afterword section
 
 
+# A parsed chapter page
+class Page:
+	def __init__(self, title, content, images=None):
+		self.title = title 		# The chapter title
+		self.content = content 	# List of (LType, line) of the chapter
+		self.images = images if images is not None else [] # Image urls in order
+
+def packPage(page):
+	"""-------------------------------------------------------------------
+		Function:		[packPage]
+		Description:	Serializes a parsed page into a compact binary form
+		Input:
+		  [page]		The Page to serialize
+		Return:			Compressed bytes, read back with unpackPage
+		-------------------------------------------------------------------
+	"""
+	data = [PACK_MAGIC, PACK_HEADER.pack(len(page.content), len(page.images))]
+	title = page.title.encode('utf8')
+	data.append(PACK_TEXT.pack(len(title)))
+	data.append(title)
+	for (ltype, line) in page.content:
+		line = line.encode('utf8')
+		data.append(PACK_LINE.pack(ltype.value, len(line)))
+		data.append(line)
+	for url in page.images:
+		url = url.encode('utf8')
+		data.append(PACK_TEXT.pack(len(url)))
+		data.append(url)
+	return zlib.compress(b"".join(data))
+
+def unpackPage(data):
+	"""-------------------------------------------------------------------
+		Function:		[unpackPage]
+		Description:	Deserializes a page serialized by packPage
+		Input:
+		  [data]		Bytes returned by packPage
+		Return:			The Page or None if data is not a valid packed page
+		-------------------------------------------------------------------
+	"""
+	try:
+		data = zlib.decompress(data)
+		if data[:len(PACK_MAGIC)] != PACK_MAGIC:
+			return None
+		pos = len(PACK_MAGIC)
+		(num_lines, num_images) = PACK_HEADER.unpack_from(data, pos)
+		pos += PACK_HEADER.size
+
+		def readText():
+			nonlocal pos
+			(length,) = PACK_TEXT.unpack_from(data, pos)
+			pos += PACK_TEXT.size + length
+			return data[pos-length:pos].decode('utf8')
+
+		title = readText()
+		ltypes = {ltype.value: ltype for ltype in LType}
+		content = []
+		for i in range(num_lines):
+			(ltype, length) = PACK_LINE.unpack_from(data, pos)
+			pos += PACK_LINE.size + length
+			content.append((ltypes[ltype], data[pos-length:pos].decode('utf8')))
+		images = [readText() for i in range(num_images)]
+	except (zlib.error, struct.error, KeyError, ValueError):
+		return None
+	return Page(title, content, images)
+
 def createParser(host):
 	"""-------------------------------------------------------------------
 		Function:		[createParser]
@@ -43,13 +177,160 @@ def createParser(host):
 
 	return None
 
+def detectCharset(source, content_type=None, default='utf-8'):
+	"""-------------------------------------------------------------------
+		Function:		[detectCharset]
+		Description:	Determines the charset of an undecoded page from its
+						Content-Type header or its <meta> tags
+		Input:
+		  [source]		The page bytes
+		  [content_type] Content-Type header of the response, if any
+		  [default]		Charset used when the page declares none
+		Return:			Normalized Python codec name
+		-------------------------------------------------------------------
+	"""
+	match = HEADER_CHARSET_PATTERN.search(content_type or "")
+	declared = match.group(1) if match is not None else None
+	if declared is None:
+		match = META_CHARSET_PATTERN.search(source, 0, META_SCAN_BYTES)
+		declared = match.group(1).decode('ascii') if match is not None else None
+
+	for charset in (declared, default):
+		if charset is None:
+			continue
+		try:
+			name = codecs.lookup(charset).name
+		except LookupError:
+			continue
+		return CHARSET_SUPERSETS.get(name, name)
+	return 'utf-8'
+
+def parseTree(html, charset=None):
+	"""-------------------------------------------------------------------
+		Function:		[parseTree]
+		Description:	Parses HTML into an lxml element tree. lxml is only
+						imported here so modes that never parse a page do
+						not pay for loading it
+		Input:
+		  [html]		The HTML source code as bytes or string
+		  [charset]		Python codec name of the charset of html if it is
+		  				bytes, as returned by detectCharset
+		Return:			Root lxml element of the HTML
+		-------------------------------------------------------------------
+	"""
+	from lxml import etree 		# libxml2 HTML parser
+	charset = charset if isinstance(html, bytes) else None
+	entry = _html_parsers.get(charset)
+	if entry is None:
+		# Plain etree elements, lxml.html element classes are much slower
+		try:
+			entry = (etree.HTMLParser(encoding=LIBXML_CHARSETS.get(charset, 
+				charset)), False)
+		except LookupError:
+			entry = (etree.HTMLParser(), True)
+		_html_parsers[charset] = entry
+	(parser, decode) = entry
+	if decode:
+		html = html.decode(charset, 'replace')
+	tree = etree.fromstring(html, parser)
+	return tree if tree is not None else etree.Element('html')
+
+def findAll(pattern, html, charset=None):
+	"""-------------------------------------------------------------------
+		Function:		[findAll]
+		Description:	Runs a compiled text pattern over a page. Undecoded
+						pages are scanned with a byte version of the pattern
+						so only the matched text is ever decoded
+		Input:
+		  [pattern]		Compiled str pattern with ASCII only syntax and at
+		  				most one group
+		  [html]		The HTML source code as bytes or string
+		  [charset]		Charset of html if it is bytes. Must be ASCII
+		  				compatible, which every supported charset is
+		Return:			List of matches as strings, like pattern.findall
+		-------------------------------------------------------------------
+	"""
+	if not isinstance(html, bytes):
+		return pattern.findall(html)
+	byte_pattern = _byte_patterns.get(pattern)
+	if byte_pattern is None:
+		byte_pattern = _byte_patterns[pattern] = re.compile(
+			pattern.pattern.encode('ascii'), pattern.flags & ~re.UNICODE)
+	matches = byte_pattern.findall(html)
+	if len(matches) == 0 or any(b'\0' in match for match in matches):
+		return [match.decode(charset or 'utf-8', 'replace') for match in matches]
+	# Decode every match in a single call, split on a NUL separator
+	return b'\0'.join(matches).decode(charset or 'utf-8', 'replace').split(u'\0')
+
+def getXPath(name):
+	"""-------------------------------------------------------------------
+		Function:		[getXPath]
+		Description:	Returns the compiled XPath expression of the given
+						name, compiling it on first use
+		Input:
+		  [name]		Key of the expression in XPATHS
+		Return:			Callable lxml XPath object
+		-------------------------------------------------------------------
+	"""
+	xpath = _xpaths.get(name)
+	if xpath is None:
+		from lxml import etree 		# XPath compilation
+		xpath = _xpaths[name] = etree.XPath(XPATHS[name], smart_strings=False)
+	return xpath
+
+def parseNbspLines(html, charset=None):
+	"""-------------------------------------------------------------------
+		Function:		[parseNbspLines]
+		Description:	Parses content lines indented by four &nbsp; as used
+						by the CN hosts
+		Input:
+		  [html]		The HTML source code as bytes or string
+		  [charset]		Charset of html if it is bytes
+		Return:			A list consisting of each line of content in the form
+						(LType, line)
+		-------------------------------------------------------------------
+	"""
+	content = []
+
+	# Parse lines and make them readable before adding them to content
+	lines = findAll(NBSP_LINE_PATTERN, html, charset)
+	for line in lines:
+		content.append((LType.REG, line))
+		content.append((LType.REG, u'\n'))
+
+	return content
+
+def warmUp():
+	"""-------------------------------------------------------------------
+		Function:		[warmUp]
+		Description:	Loads lxml and builds everything the parsers
+						otherwise build on their first page: the compiled
+						XPaths, the byte patterns and an lxml parser per
+						supported charset
+		Input:			None
+		Return:			None
+		-------------------------------------------------------------------
+	"""
+	for name in XPATHS:
+		getXPath(name)
+	for pattern in (NBSP_LINE_PATTERN, BIQUYUN_TITLE_PATTERN, SHU69_TITLE_PATTERN,
+		SYOSETU_TITLE_PATTERN):
+		findAll(pattern, b"", 'utf-8')
+	for charset in set(CHARSET_SUPERSETS.values()):
+		parseTree(b"<html></html>", charset)
+
 #==========================================================================
 #	[HtmlParser]
-#	Generic abstract super class requiring children to implement a 
-#	parseTitle and parseContent method. All parsers MUST inherit from
-# 	this class.
+#	Generic abstract super class requiring children to implement a parse
+#	method that extracts everything needed from a chapter page in a single
+#	pass. All parsers MUST inherit from this class.
 #==========================================================================
 class HtmlParser(ABC):
+	# Version of what parse() produces. Bump it whenever a change to a
+	# parser changes its output so pages it parsed before are parsed again.
+	# Parsed pages are not cached for parsers that leave it None
+	VERSION = None
+
 	def __init__(self, table_needed):
 		# Is a page table needed for this parser
 		self.table_needed = table_needed
@@ -57,28 +338,64 @@ class HtmlParser(ABC):
 	def needsPageTable(self):
 		return self.table_needed
 
+	"""-------------------------------------------------------------------
+		Function:		[getCacheKey]
+		Description:	Identifies what this parser makes of a page decoded
+						with the given charset
+		Input:
+		  [charset]		Charset the page is decoded with
+		Return:			Key of the parsed page or None if this parser does
+						not declare a version
+		-------------------------------------------------------------------
+	"""
+	def getCacheKey(self, charset):
+		if self.VERSION is None:
+			return None
+		return "%s.v%d.%s" % (type(self).__name__, self.VERSION, 
+			re.sub(r'[^\w.-]', '_', (charset or "").lower()))
+
+	"""-------------------------------------------------------------------
+		Function:		[parse]
+		Description:	Parses the title, content and images of a chapter
+						from the HTML source code, parsing the page only once
+		Input:
+		  [html]		The HTML source code for a given chap, either
+		  				undecoded bytes or a string
+		  [charset]		Charset of html if it is bytes
+		Return:			A Page holding the chapter title, a list consisting
+						of each line of content in the form (LType, line) and
+						the urls of the images in the chapter
+		-------------------------------------------------------------------
+	"""
+	@abstractmethod
+	def parse(self, html, charset=None): pass
+
 	"""-------------------------------------------------------------------
 		Function:		[parseTitle]
-		Description:	Parses the title from the HTML source code
+		Description:	Parses the title from the HTML source code. Prefer
+						parse() when the content is needed as well
 		Input:
-		  [html]		The HTML source code in string form	for a given chap
+		  [html]		The HTML source code for a given chap
+		  [charset]		Charset of html if it is bytes
 		Return:			The string representing the chapter title
 		-------------------------------------------------------------------
 	"""
-	@abstractmethod
-	def parseTitle(self, html):	pass
+	def parseTitle(self, html, charset=None):
+		return self.parse(html, charset).title
 
 	"""-------------------------------------------------------------------
 		Function:		[parseContent]
-		Description:	Parses the chapter content from the HTML source code
+		Description:	Parses the chapter content from the HTML source code.
+						Prefer parse() when the title is needed as well
 		Input:
-		  [html]		The HTML source code in string form	for a given chap	
+		  [html]		The HTML source code for a given chap
+		  [charset]		Charset of html if it is bytes
 		Return:			A list constisting of each line of content from the 
 						chapter in the form (LType, line)
 		-------------------------------------------------------------------
 	"""
-	@abstractmethod
-	def parseContent(self, html): pass
+	def parseContent(self, html, charset=None):
+		return self.parse(html, charset).content
 
 	"""-------------------------------------------------------------------
 		Function:		[parsePageTableFromWeb]
@@ -111,69 +428,95 @@ class HtmlParser(ABC):
 	@abstractmethod
 	def getLatestChapter(self, html): pass
 
+	"""-------------------------------------------------------------------
+		Function:		[parseIndex]
+		Description:	Retrieves the latest chapter number and, if this
+						host needs one, the page table of a series while
+						parsing its table of contents only once
+		Input:
+		  [html]		The base table of contents html for a given series
+		Return:			(latest chapter, page table or None)
+		-------------------------------------------------------------------
+	"""
+	def parseIndex(self, html):
+		if self.needsPageTable():
+			page_table = self.parsePageTableFromWeb(html)
+			return (len(page_table), page_table)
+		return (self.getLatestChapter(html), None)
+
 #==========================================================================
 #	[SyosetuParser]
 #	HtmlParser specialized for parsing html chapters taken from the 
 #	https://ncode.syosetu.com domain 
 #==========================================================================
 class SyosetuParser(HtmlParser):
+	VERSION = 2
+
 	def __init__(self):
 		# Page table not needed for Syosetu domain
 		super(SyosetuParser, self).__init__(False)
 
-	def parseTitle(self, html):
-		title = re.findall(r'<p class="novel_subtitle">(.*?)</p>', html)
-		return title[0]
-
-	def parseContent(self, html):
+	def parse(self, html, charset=None):
 		content = []
-		# Filter out <ruby> tags that mess up translation
-		html = re.sub(r'<ruby>(.*?)<rb>(.*?)</rb>(.*?)</ruby>', r'\2', html)
-		html_soup = soup.BeautifulSoup(html, 'lxml')
+		images = []
+		tree = parseTree(html, charset)
+
+		# Chapter title, as marked up in the page and before ruby removal
+		title = findAll(SYOSETU_TITLE_PATTERN, html, charset)
+		title = title[0] if len(title) > 0 else "NOTITLE"
+
+		# Keep only the base text of <ruby> tags that mess up translation
+		rubies = getXPath('ruby')(tree)
+		if len(rubies) > 0:
+			from lxml import etree 		# Tree editing
+			for extra in getXPath('ruby_extra')(tree):
+				extra.getparent().remove(extra)
+			for ruby in rubies:
+				ruby.text = None
+			etree.strip_tags(tree, 'ruby', 'rb')
+
+		text = getXPath('text')
 
 		def processAndAppendLine(ltype, l):
 			# Turn break tags into new lines
-			if re.fullmatch(r'\s*<br\s*/>\s*', l):
+			if '<' in l and BR_LINE_PATTERN.fullmatch(l):
 				content.append((ltype, '\n'))
 			# Skip blanks
-			elif re.fullmatch(r'\s*', l):
+			elif l.isspace() or len(l) == 0:
 				return
 			else:
 				content.append((ltype, l))
 			content.append((ltype, '\n'))
 
+		def processSection(section, ltype, img_ltype):
+			for p in section.iterchildren('p'):
+				p_images = getXPath('images')(p) if img_ltype is not None else []
+				if len(p_images) > 0:
+					for img in p_images:
+						content.append((img_ltype, "https:" + img.get('src')))
+						images.append("https:" + img.get('src'))
+				else:
+					processAndAppendLine(ltype, text(p))
+
 		# Get prescript content if it exists
-		prescript = html_soup.find('div', {'class': 'novel_view', 'id': 'novel_p'})
-		if prescript is not None:
-			for p in prescript.find_all('p', recursive=False):
-				processAndAppendLine(LType.PRE, p.getText())
+		prescript = getXPath('syosetu_pre')(tree)
+		if len(prescript) > 0:
+			processSection(prescript[0], LType.PRE, None)
 
 		# Get main content
-		main = html_soup.find('div', {'class': 'novel_view', 'id': 'novel_honbun'})
-		if main is not None:
-			for p in main.find_all('p', recursive=False):
-				images = p.find_all('img')
-				if len(images) > 0:
-					for img in images:
-						content.append((LType.REG_IMG, "https:" + img['src']))
-				else:
-					processAndAppendLine(LType.REG, p.getText())
+		main = getXPath('syosetu_main')(tree)
+		if len(main) > 0:
+			processSection(main[0], LType.REG, LType.REG_IMG)
 		else:
 			print("[Error] Main content section not found in html...")
 			sys.exit(1)
 
 		# Get afterword content if it exists
-		afterword = html_soup.find('div', {'class': 'novel_view', 'id': 'novel_a'})
-		if afterword is not None:
-			for p in afterword.find_all('p', recursive=False):
-				images = p.find_all('img')
-				if len(images) > 0:
-					for img in images:
-						content.append((LType.POST_IMG, "https:" + img['src']))
-				else:
-					processAndAppendLine(LType.POST, p.getText())
+		afterword = getXPath('syosetu_post')(tree)
+		if len(afterword) > 0:
+			processSection(afterword[0], LType.POST, LType.POST_IMG)
 
-		return content
+		return Page(title, content, images)
 
 	# Syosetu domain has chapter codes corresponding to the chapter number
 	#   https://ncode.syosetu.com/<ncode>/1 = Chapter 1
@@ -184,8 +527,7 @@ class SyosetuParser(HtmlParser):
 		return None
 
 	def getLatestChapter(self, html):
-		pattern = re.compile(r"<dl class=\"novel_sublist2\">")
-		latest = len(pattern.findall(html))
+		latest = len(SYOSETU_CHAPTER_PATTERN.findall(html))
 		return latest
 
 #==========================================================================
@@ -194,30 +536,20 @@ class SyosetuParser(HtmlParser):
 #	https://www.biquyun.com/ domain 
 #==========================================================================
 class BiquyunParser(HtmlParser):
+	VERSION = 1
+
 	def __init__(self):
 		# Page table needed for Biquyun domain
 		super(BiquyunParser, self).__init__(True)
 
-	def parseTitle(self, html):
-		title = re.findall(r'<div class="bookname">\r\n\t\t\t\t\t<h1>(.*?)\
-			</h1>', html)
-		return title[0]
-
-	def parseContent(self, html):
-		content = []
-
-		# Parse lines and make them readable before adding them to content
-		lines = re.findall(r'&nbsp;&nbsp;&nbsp;&nbsp;(.*?)<', html)
-		for line in lines:
-			content.append((LType.REG, line))
-			content.append((LType.REG, u'\n'))
-
-		return content
+	def parse(self, html, charset=None):
+		title = findAll(BIQUYUN_TITLE_PATTERN, html, charset)
+		return Page(title[0], parseNbspLines(html, charset))
 
 	# Erratic chapter codes, so page table needed
 	def parsePageTableFromWeb(self, html):
 		# Note: this parsing scheme may be outdated for the Biquyun domain
-		page_table = re.findall(r'<a href="/.*?/(.*?)\.html">', html)
+		page_table = BIQUYUN_CHAPTER_PATTERN.findall(html)
 		return page_table
 
 	def getLatestChapter(self, html):
@@ -229,37 +561,27 @@ class BiquyunParser(HtmlParser):
 #	https://www.69shu.org/book/ domain 
 #==========================================================================
 class Shu69Parser(HtmlParser):
+	VERSION = 2
+
 	def __init__(self):
 		# Page table needed for Biquyun domain
 		super(Shu69Parser, self).__init__(True)
 
-	def parseTitle(self, html):
-		html_soup = soup.BeautifulSoup(html, 'lxml')
-		title_div = html_soup.find('div', {'class': 'h1title'})
-		title = title_div.h1.string if title_div.h1 is not None else "NOTITLE"
-		return title
-
-	def parseContent(self, html):
-		content = []
-
-		# Parse lines and make them readable before adding them to content
-		lines = re.findall(r'&nbsp;&nbsp;&nbsp;&nbsp;(.*?)<', html)
-		for line in lines:
-			content.append((LType.REG, line))
-			content.append((LType.REG, u'\n'))
-
-		return content
+	def parse(self, html, charset=None):
+		# The title is the only markup needed, no need to build a whole tree
+		title = findAll(SHU69_TITLE_PATTERN, html, charset)
+		title = unescape(title[0]) if len(title) > 0 else "NOTITLE"
+		return Page(title, parseNbspLines(html, charset))
 
 	# Erratic chapter codes, so page table needed
 	def parsePageTableFromWeb(self, html):
 		page_table = []
 
-		html_soup = soup.BeautifulSoup(html, 'lxml')
-		ch_list = html_soup.find('ul', {'class': 'chapterlist'})
-		for ch_elem in ch_list.find_all('li', {'class': ''}):
-			if ch_elem.a is not None:
-				ch_html = ch_elem.a.get('href')
-				page_table.append(ch_html)
+		tree = parseTree(html)
+		for ch_elem in getXPath('shu69_toc')(tree):
+			link = getXPath('first_link')(ch_elem)
+			if len(link) > 0:
+				page_table.append(link[0].get('href'))
 
 		return page_table
 
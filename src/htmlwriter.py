@@ -5,30 +5,129 @@
   Description:	This module is responsible for modifying and writing the
   				pre-processed HTML version of a given chapter translation
 """
-import pykakasi as pkk 	# Python Japanese romanization api
+import functools as ft 	# Memoization of romanized lines
+import sys 				# System operations
 import os 				# OS level operations
 import io 				# File reading/writing
 import re 				# Regex for parsing
 
 from htmlparser import LType
+import htmlparser
+import stagetimes
 
 PRE_MARKER  = r"<!--END_OF_PRESCRIPT-->"
 MAIN_MARKER = r"<!--END_OF_BODY-->"
 POST_MARKER = r"<!--END_OF_AFTERWORD-->"
 
+# Section dividers emitted right after their marker the first time a line of
+# the corresponding section is inserted
+PRE_HR  = "\n<hr id=\"prescript_div\">"
+POST_HR = "\n<hr id=\"postscript_div\">"
+
+# Every placeholder comment in skeleton.html that gets filled in per chapter
+SLOT_PATTERN = re.compile(r"(<!--(?:PAGE_TITLE|CHAPTER_TITLE|SERIES_LINK|"
+	+ r"CHAPTER_LINK|CHAPTER_NUMBER|END_OF_PRESCRIPT|END_OF_BODY|"
+	+ r"END_OF_AFTERWORD)-->)")
+
+# Number of romanized lines remembered per process
+ROMA_CACHE_SIZE = 4096
+
+# Compiled skeletons shared by every HtmlWriter in this process
+_templates = {}
+# Kakasi converter shared by every HtmlWriter in this process
+_converter = None
+
+def getConverter():
+	"""-------------------------------------------------------------------
+		Function:		[getConverter]
+		Description:	Builds the process-wide kakasi converter on first use.
+						pykakasi is only imported here since it is slow to
+						load and only needed for JP chapters
+		Input:			None
+		Return:			The shared kakasi converter
+		------------------------------------------------------------------
+	"""
+	global _converter
+	if _converter is None:
+		import pykakasi as pkk 	# Python Japanese romanization api
+		romanizer = pkk.kakasi()
+		romanizer.setMode("H","a") 			# Enable Hiragana to ascii
+		romanizer.setMode("K","a") 			# Enable Katakana to ascii
+		romanizer.setMode("J","a") 			# Enable Japanese to ascii
+		romanizer.setMode("r","Hepburn") 	# Use Hepburn Roman table
+		romanizer.setMode("s", True) 		# Add spaces
+		romanizer.setMode("C", True) 		# Capitalize
+		_converter = romanizer.getConverter()
+	return _converter
+
+def warmUp(langs):
+	"""-------------------------------------------------------------------
+		Function:		[warmUp]
+		Description:	Builds the state parsing and rendering otherwise
+						build on a process's first chapter. Cheap once built
+		Input:
+		  [langs]		Languages of the series to be rendered
+		Return:			None
+		------------------------------------------------------------------
+	"""
+	htmlparser.warmUp()
+	if "JP" in langs:
+		getConverter()
+
+@ft.lru_cache(maxsize=ROMA_CACHE_SIZE)
+def romanize(text_src):
+	"""-------------------------------------------------------------------
+		Function:		[romanize]
+		Description:	Romanizes Japanese text, memoizing recent lines
+		Input:
+		  [text_src]	The source Japanese text to romanize
+		Return:			The romanized text
+		------------------------------------------------------------------
+	"""
+	return getConverter().do(text_src)
+
+def loadTemplate(res_path, dev_opt=False):
+	"""-------------------------------------------------------------------
+		Function:		[loadTemplate]
+		Description:	Reads and compiles the skeleton.html resource file
+						once per process and returns the shared result
+		Input:
+		  [res_path]	Path to skeleton.html resource
+		  [dev_opt] 	Compile the developer version of the skeleton?
+		Return:			List of (is_slot, text) segments of the skeleton
+		------------------------------------------------------------------
+	"""
+	key = (res_path, dev_opt)
+	if key not in _templates:
+		with io.open(os.path.join(res_path), mode='r', encoding='utf8') as res:
+			resource = res.read()
+		if dev_opt:
+			pattern = re.compile(r"<!--PROD_LINKS-->(.*)<!--SKNIL_DORP-->", re.S)
+		else:
+			pattern = re.compile(r"<!--DEV_LINKS-->(.*)<!--SKNIL_VED-->", re.S)
+		resource = pattern.sub('', resource)
+
+		# re.split with a capture group alternates literal text and slots
+		segments = SLOT_PATTERN.split(resource)
+		_templates[key] = [(i % 2 == 1, seg) for (i, seg) in enumerate(segments)
+			if i % 2 == 1 or len(seg) > 0]
+	return _templates[key]
+
 class HtmlWriter:
 	#--------------------------------------------------------------------------
 	#  ctor
 	#--------------------------------------------------------------------------
-	def __init__(self, dictionary, log_file, res_path, dev_opt=False):
+	def __init__(self, dictionary, log_file, res_path, dev_opt=False, 
+		memo=None):
 		"""-------------------------------------------------------------------
 			Function:		[CONSTRUCTOR]
-			Description:	Reads in the skeleton.html resource file
+			Description:	Loads the compiled skeleton.html resource file
 			Input:			
-			  [dictionary]	Series dictionary
+			  [dictionary]	Series dictionary as a compiled DictMatcher
 			  [log_file]	File descriptor to write translation logs to
 			  [res_path]	Path to skeleton.html resource
 			  [dev_opt] 	Output developer version HTML?
+			  [memo]		ChapterMemo to reuse rendered lines from, if any
 			------------------------------------------------------------------
 		"""
 		# Various id attribute initializations
@@ -38,15 +137,16 @@ class HtmlWriter:
 		self.__dummynum = 1
 
 		self.__dictionary = dictionary
+		self.__matched = set()
 		self.__log = log_file
-		with io.open(os.path.join(res_path), mode='r', encoding='utf8') as res:
-			self.__resource = res.read()
-			if dev_opt:
-				pattern = re.compile(r"<!--PROD_LINKS-->(.*)<!--SKNIL_DORP-->", re.S)
-				self.__resource = pattern.sub('', self.__resource)
-			else:
-				pattern = re.compile(r"<!--DEV_LINKS-->(.*)<!--SKNIL_VED-->", re.S)
-				self.__resource = pattern.sub('', self.__resource)
+		self.__memo = memo
+		self.__template = loadTemplate(res_path, dev_opt)
+
+		# Chapter specific header fields and the accumulated html of each
+		# content section, only stitched together when the page is written
+		self.__fields = {}
+		self.__sections = {PRE_MARKER: [], MAIN_MARKER: [], POST_MARKER: []}
+		self.__dividers = {PRE_MARKER: "", MAIN_MARKER: "", POST_MARKER: ""}
 
 	#--------------------------------------------------------------------------
 	#  Romanization generation
@@ -62,16 +162,7 @@ class HtmlWriter:
 							romanization
 			------------------------------------------------------------------
 		"""
-		romanizer = pkk.kakasi()
-		romanizer.setMode("H","a") 			# Enable Hiragana to ascii
-		romanizer.setMode("K","a") 			# Enable Katakana to ascii
-		romanizer.setMode("J","a") 			# Enable Japanese to ascii
-		romanizer.setMode("r","Hepburn") 	# Use Hepburn Roman table
-		romanizer.setMode("s", True) 		# Add spaces
-		romanizer.setMode("C", True) 		# Capitalize
-
-		converter = romanizer.getConverter()
-		return converter.do(text_src)
+		return romanize(text_src)
 
 
 	#--------------------------------------------------------------------------
@@ -89,7 +180,7 @@ class HtmlWriter:
 			------------------------------------------------------------------
 		"""
 		pg_title = "%s %d" % (series, ch)
-		self.__resource = re.sub(r'<!--PAGE_TITLE-->', pg_title, self.__resource)
+		self.__fields['<!--PAGE_TITLE-->'] = pg_title
 		self.__log.write("Set page title: %s" % pg_title)
 
 	def setChapterTitle(self, ch_title):
@@ -102,7 +193,7 @@ class HtmlWriter:
 			Return:			None
 			------------------------------------------------------------------
 		"""
-		self.__resource = re.sub(r'<!--CHAPTER_TITLE-->', ch_title, self.__resource)
+		self.__fields['<!--CHAPTER_TITLE-->'] = ch_title
 		self.__log.write("Set series title: %s" % ch_title)
 
 	def setSeriesLink(self, link):
@@ -115,7 +206,7 @@ class HtmlWriter:
 			Return:			None
 			------------------------------------------------------------------
 		"""
-		self.__resource = re.sub(r'<!--SERIES_LINK-->', link, self.__resource)
+		self.__fields['<!--SERIES_LINK-->'] = link
 		self.__log.write("Set series link: %s" % link)
 
 	def setChapterLink(self, link):
@@ -128,7 +219,7 @@ class HtmlWriter:
 			Return:			None
 			------------------------------------------------------------------
 		"""
-		self.__resource = re.sub(r'<!--CHAPTER_LINK-->', link, self.__resource)
+		self.__fields['<!--CHAPTER_LINK-->'] = link
 		self.__log.write("Set chapter link: %s" % link)
 
 	def setChapterNumber(self, ch_num):
@@ -142,7 +233,7 @@ class HtmlWriter:
 			------------------------------------------------------------------
 		"""
 		ch_num = "Chapter " + ch_num
-		self.__resource = re.sub(r'<!--CHAPTER_NUMBER-->', ch_num, self.__resource)
+		self.__fields['<!--CHAPTER_NUMBER-->'] = ch_num
 		self.__log.write("Set chapter subtitle: %s" % ch_num)
 
 	def generateDummy(self, lang):
@@ -168,8 +259,8 @@ class HtmlWriter:
 	def insertLine(self, line_data, lang):
 		"""-------------------------------------------------------------------
 			Function:		[insertLine]
-			Description:	Inserts a line as an html paragraph into the given 
-							resource string
+			Description:	Appends a line as an html paragraph to the section
+							of the page it belongs to
 			Input:
 			  [line_data]	A 2-tuple representing line type and line content
 			  [lang]		The language the line is in
@@ -177,8 +268,7 @@ class HtmlWriter:
 			------------------------------------------------------------------
 		"""
 		if(self.__linenum == 1):
-			dummy_html = self.generateDummy(lang) + PRE_MARKER
-			self.__resource = re.sub(PRE_MARKER, dummy_html, self.__resource)
+			self.__sections[PRE_MARKER].append(self.generateDummy(lang))
 
 		(ltype, line) = line_data
 		# Strip unnecessary white space at the beginning
@@ -186,82 +276,167 @@ class HtmlWriter:
 
 		# Insert a prescript <hr> if prescript line detected
 		if ltype == LType.PRE:
-			hr_html = "%s\n<hr id=\"prescript_div\">" % PRE_MARKER
-			if not hr_html in self.__resource:
-				self.__resource = re.sub(PRE_MARKER, hr_html, self.__resource)
+			self.__dividers[PRE_MARKER] = PRE_HR
 		# Insert a postscript <hr> if postscript line detected
 		if ltype == LType.POST or ltype == LType.POST_IMG:
-			hr_html = "%s\n<hr id=\"postscript_div\">" % MAIN_MARKER
-			if not hr_html in self.__resource:
-				self.__resource = re.sub(MAIN_MARKER, hr_html, self.__resource)
+			self.__dividers[MAIN_MARKER] = POST_HR
 
 		# There's a special way to process images
-		if ltype == LType.REG_IMG:
-			alt = "image_%s" % self.__imgnum
-			img_html = "<img class=\"content_img\" id=\"i%s\" src=\"%s\" alt=\"%s\">\n%s" % \
-				(self.__imgnum, line, alt, MAIN_MARKER)
-			self.__resource = re.sub(MAIN_MARKER, img_html, self.__resource)
-			self.__imgnum += 1
-			return
-		elif ltype == LType.POST_IMG:
+		if ltype == LType.REG_IMG or ltype == LType.POST_IMG:
+			marker = MAIN_MARKER if ltype == LType.REG_IMG else POST_MARKER
 			alt = "image_%s" % self.__imgnum
-			img_html = "<img class=\"content_img\" id=\"i%s\" src=\"%s\" alt=\"%s\">\n%s" % \
-				(self.__imgnum, line, alt, POST_MARKER)
-			self.__resource = re.sub(POST_MARKER, img_html, self.__resource)
+			img_html = "<img class=\"content_img\" id=\"i%s\" src=\"%s\" alt=\"%s\">\n" % \
+				(self.__imgnum, line, alt)
+			self.__sections[marker].append(img_html)
 			self.__imgnum += 1
 			return
 
-		# Rest of this function handles normal lines
+		# Rest of this function handles normal lines. Their html only depends
+		# on the line, so it is rendered once as a template with the ids left
+		# open and reused from the memo after that
+		fragment = self.__memo.get(line) if self.__memo is not None else None
+		if fragment is None:
+			fragment = self.renderTemplate(line, lang)
+			if self.__memo is not None:
+				self.__memo.put(line, *fragment)
+		(template, entries) = fragment
+
+		# Every distinct entry gets one id, handed out in dictionary order
+		entry_ids = []
+		for (entry, trans) in entries:
+			self.__log.write("\n\tDetected token %s in line. Replacing \
+					with %s" % (entry, trans))
+			self.__matched.add(entry)
+			entry_ids.append(self.__pId)
+			self.__pId += 1
+
+		# Integrate line into its section
+		if ltype == LType.PRE:
+			marker = PRE_MARKER
+		elif ltype == LType.REG or ltype == LType.TITLE:
+			marker = MAIN_MARKER
+		elif ltype == LType.POST:
+			marker = POST_MARKER
+		else:
+			print("[Error] Unrecognized LType!")
+			sys.exit(1)
+
+		line_html = template.format(self.__linenum, self.__dummynum, *entry_ids)
+		self.__sections[marker].append(line_html)
+		self.__linenum += 1
+		self.__dummynum += 1
+
+	def renderTemplate(self, line, lang):
+		"""-------------------------------------------------------------------
+			Function:		[renderTemplate]
+			Description:	Renders a text line with its ids left as format
+							fields: {0} the line number, {1} the dummy number
+							and {2}, {3}, ... the id of each distinct entry
+			Input:
+			  [line]		The stripped line to render
+			  [lang]		The language the line is in
+			Return:			(template, list of (entry, translation) in the
+							order their ids are handed out)
+			------------------------------------------------------------------
+		"""
+		escape = lambda text: text.replace("{", "{{").replace("}", "}}")
+
 		# Display roma for JP
 		if lang == "JP":
-			raw_line = "<p class=\"content_raw notranslate\" id=r%s>%s</p>" % \
-				(self.__linenum, self.romanizeLine(line))
+			start = stagetimes.clock()
+			roma = self.romanizeLine(line)
+			stagetimes.add('romanize', stagetimes.clock() - start)
+			raw_line = "<p class=\"content_raw notranslate\" id=r{0}>%s</p>" % \
+				escape(roma)
 			src_lang = "ja"
 		# Display raw for CN
 		elif lang == "CN":
-			raw_line = "<p class=\"content_raw notranslate\" id=r%s>%s</p>" % \
-				(self.__linenum, line)
+			raw_line = "<p class=\"content_raw notranslate\" id=r{0}>%s</p>" % \
+				escape(line)
 			src_lang = "zh-CN"
 
 		# Double quotations in the google translate anchor mess up the link
-		line_0 = line.replace("\"", "\'")
+		line_0 = escape(line.replace("\"", "\'"))
 		raw_html = "<a href=\"https://translate.google.com/?hl=en&tab=TT&authuser\
 =0#view=home&op=translate&sl=%s&tl=en&text=%s\" class=\"noDecoration\" target=\"\
 _blank\">%s</a>" % (src_lang, line_0, raw_line)
 
-		# Preprocess line using dictionary entities
-		for entry in self.__dictionary:
-			if entry in line:
-				self.__log.write("\n\tDetected token %s in line. Replacing \
-					with %s" % (entry, self.__dictionary[entry]))
-
-				placeholder = "<span class=\"placeholder\" id=%d>placeholder\
-					</span>" % self.__pId
-				new_entry = "<span class=\"notranslate word_mem\" id=w%d>%s\
-					</span>" % (self.__pId, self.__dictionary[entry])
-				line = line.replace(entry, "%s%s" % (new_entry, placeholder))
+		# Preprocess line using dictionary entities. Matches are found on the
+		# raw line in one pass so injected markup is never rescanned
+		start = stagetimes.clock()
+		matches = list(self.__dictionary.match(line))
+		stagetimes.add('match', stagetimes.clock() - start)
+		entries = []
+		if len(matches) > 0:
+			entry_fields = {}
+			found = set(line[start:end] for (start, end, trans) in matches)
+			for entry in sorted(found, key=self.__dictionary.rank):
+				entry_fields[entry] = "{%d}" % (len(entries) + 2)
+				entries.append((entry, self.__dictionary[entry]))
 
-				self.__pId += 1
-
-		# Integrate line into resource string
-		if ltype == LType.PRE:
-			marker = PRE_MARKER
-		elif ltype == LType.REG or ltype == LType.TITLE:
-			marker = MAIN_MARKER
-		elif ltype == LType.POST:
-			marker = POST_MARKER
+			pieces = []
+			pos = 0
+			for (start, end, trans) in matches:
+				p_id = entry_fields[line[start:end]]
+				placeholder = "<span class=\"placeholder\" id=%s>placeholder\
+					</span>" % p_id
+				new_entry = "<span class=\"notranslate word_mem\" id=w%s>%s\
+					</span>" % (p_id, escape(trans))
+				pieces.append(escape(line[pos:start]))
+				pieces.append("%s%s" % (new_entry, placeholder))
+				pos = end
+			pieces.append(escape(line[pos:]))
+			text = "".join(pieces)
 		else:
-			print("[Error] Unrecognized LType!")
-			sys.exit(1)
+			text = escape(line)
 
-		dummy_html = self.generateDummy(lang) + marker
-		line_html = "<p class=\"content_line\" id=l%s>%s</p>%s\n%s" % \
-			(self.__linenum, line, raw_html, dummy_html)
-		self.__resource = re.sub(marker, line_html, self.__resource)
-		self.__linenum += 1
+		template = "<p class=\"content_line\" id=l{0}>%s</p>%s\n%s" % \
+			(text, raw_html, self.dummyTemplate(lang))
+		return (template, entries)
+
+	def dummyTemplate(self, lang):
+		"""-------------------------------------------------------------------
+			Function:		[dummyTemplate]
+			Description:	Renders the dummy paragraph with its id left as
+							the format field {1}, as in renderTemplate
+			Input:
+			  [lang]		The language the chapter is in
+			Return:			The dummy paragraph template
+			------------------------------------------------------------------
+		"""
+		if lang == "JP":
+			dummy = u"ダミー"
+		elif lang == "CN":
+			dummy = u"假"
+		return "<p class=\"dummy\" id=\"d{1}\">%s</p>\n" % dummy
 
 	#--------------------------------------------------------------------------
-	#  Accessor function
+	#  Output functions
 	#--------------------------------------------------------------------------
+	def writeTo(self, out_file):
+		"""-------------------------------------------------------------------
+			Function:		[writeTo]
+			Description:	Streams the finished page into the given file in a
+							single pass over the compiled skeleton
+			Input:
+			  [out_file]	Writable text file handle
+			Return:			None
+			------------------------------------------------------------------
+		"""
+		for (is_slot, text) in self.__template:
+			if not is_slot:
+				out_file.write(text)
+			elif text in self.__sections:
+				out_file.writelines(self.__sections[text])
+				out_file.write(text)
+				out_file.write(self.__dividers[text])
+			else:
+				out_file.write(self.__fields.get(text, text))
+
+	def getMatchedEntries(self):
+		return self.__matched
+
 	def getResourceString(self):
-		return self.__resource
\ No newline at end of file
+		out = io.StringIO()
+		self.writeTo(out)
+		return out.getvalue()
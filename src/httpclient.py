@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[httpclient.py]
+  Description:	This module implements a small thread-safe HTTP client that
+  				keeps a pool of persistent connections per host and
+  				transparently decodes gzip/deflate responses
+"""
+# http.client, ssl and gzip are imported where they are used, modes that
+# never fetch a page do not pay for loading them
+from urllib.parse import urlsplit, urljoin	# URL handling
+import threading 							# Pool locking
+import zlib 								# deflate content decoding
+import os 									# Process id
+
+# Maximum number of idle connections kept open per host
+MAX_IDLE_PER_HOST = 16
+# Maximum number of redirects followed per request
+MAX_REDIRECTS = 5
+# Seconds before a connect or read is abandoned
+TIMEOUT = 30
+
+DEFAULT_HEADERS = {
+	'User-Agent': 'Mozilla/5.0',
+	'Accept-Encoding': 'gzip, deflate',
+	'Connection': 'keep-alive'
+}
+
+
+class HttpError(Exception):
+	def __init__(self, code, url, headers=None):
+		super(HttpError, self).__init__("HTTP %d for <%s>" % (code, url))
+		self.code = code
+		self.url = url
+		self.headers = headers
+
+
+class RedirectError(HttpError):
+	def __init__(self, code, url, headers=None):
+		super(RedirectError, self).__init__(code, url, headers)
+		self.args = ("Still redirected after %d redirects for <%s>" % 
+			(MAX_REDIRECTS, url),)
+
+
+class HttpResponse:
+	def __init__(self, url, status, headers, body):
+		self.url = url 			# Final URL after redirects
+		self.status = status 	# HTTP status code
+		self.headers = headers 	# Case-insensitive http.client.HTTPMessage
+		self.body = body 		# Decoded body as bytes
+
+	def read(self):
+		return self.body
+
+
+class HttpClient:
+	#--------------------------------------------------------------------------
+	#  ctor
+	#--------------------------------------------------------------------------
+	def __init__(self, max_idle=MAX_IDLE_PER_HOST, timeout=TIMEOUT):
+		"""-------------------------------------------------------------------
+			Function:		[CONSTRUCTOR]
+			Description:	Creates an empty connection pool
+			Input:
+			  [max_idle]	Maximum number of idle connections kept per host
+			  [timeout]		Socket timeout in seconds
+			------------------------------------------------------------------
+		"""
+		import ssl 				# For certificate authentication
+		self.__max_idle = max_idle
+		self.__timeout = timeout
+		self.__lock = threading.Lock()
+		self.__idle = {}
+		self.__ssl_context = ssl._create_unverified_context()
+
+	#--------------------------------------------------------------------------
+	#  Connection pool functions
+	#--------------------------------------------------------------------------
+	def __acquire(self, key):
+		import http.client as httpc 	# Low level HTTP connections
+		with self.__lock:
+			idle = self.__idle.get(key)
+			if idle:
+				return (idle.pop(), True)
+
+		(scheme, host, port) = key
+		if scheme == "https":
+			conn = httpc.HTTPSConnection(host, port, timeout=self.__timeout,
+				context=self.__ssl_context)
+		else:
+			conn = httpc.HTTPConnection(host, port, timeout=self.__timeout)
+		return (conn, False)
+
+	def __release(self, key, conn):
+		with self.__lock:
+			idle = self.__idle.setdefault(key, [])
+			if len(idle) < self.__max_idle:
+				idle.append(conn)
+				return
+		conn.close()
+
+	def close(self):
+		"""-------------------------------------------------------------------
+			Function:		[close]
+			Description:	Closes every idle connection in the pool
+			Input:			None
+			Return:			None
+			------------------------------------------------------------------
+		"""
+		with self.__lock:
+			idle = self.__idle
+			self.__idle = {}
+		for conns in idle.values():
+			for conn in conns:
+				conn.close()
+
+	#--------------------------------------------------------------------------
+	#  Request functions
+	#--------------------------------------------------------------------------
+	def __send(self, url, headers):
+		import http.client as httpc 	# Stale connection errors
+		parts = urlsplit(url)
+		key = (parts.scheme, parts.hostname, parts.port)
+		path = parts.path or "/"
+		if parts.query:
+			path += "?" + parts.query
+
+		(conn, reused) = self.__acquire(key)
+		try:
+			conn.request("GET", path, headers=headers)
+			response = conn.getresponse()
+			body = response.read()
+		# The server closed a pooled connection while it sat idle
+		except (httpc.RemoteDisconnected, httpc.BadStatusLine,
+			ConnectionResetError, BrokenPipeError):
+			conn.close()
+			if not reused:
+				raise
+			# The server dropped an idle connection, send it again
+			return self.__send(url, headers)
+		except Exception:
+			conn.close()
+			raise
+
+		if response.will_close:
+			conn.close()
+		else:
+			self.__release(key, conn)
+		return (response.status, response.headers, body)
+
+	def get(self, url, headers=None):
+		"""-------------------------------------------------------------------
+			Function:		[get]
+			Description:	Performs a GET request over a pooled connection,
+							following redirects and decoding compressed bodies
+			Input:
+			  [url]			The url to make the request to
+			  [headers]		Extra request headers
+			Return:			HttpResponse of the final request
+			Raises:			HttpError for 4xx/5xx responses, RedirectError
+							when still redirected after MAX_REDIRECTS
+			------------------------------------------------------------------
+		"""
+		req_headers = dict(DEFAULT_HEADERS)
+		if headers is not None:
+			req_headers.update(headers)
+
+		redirects = 0
+		while True:
+			(status, resp_headers, body) = self.__send(url, req_headers)
+			location = resp_headers.get('Location')
+			if status not in (301, 302, 303, 307, 308) or location is None:
+				break
+			if redirects == MAX_REDIRECTS:
+				raise RedirectError(status, url, resp_headers)
+			redirects += 1
+			url = urljoin(url, location)
+
+		if status >= 400:
+			raise HttpError(status, url, resp_headers)
+
+		encoding = (resp_headers.get('Content-Encoding') or "").strip().lower()
+		if encoding == "gzip":
+			import gzip 		# gzip content decoding
+			body = gzip.decompress(body)
+		elif encoding == "deflate":
+			try:
+				body = zlib.decompress(body)
+			except zlib.error:
+				# Some servers send raw deflate streams without a zlib header
+				body = zlib.decompress(body, -zlib.MAX_WBITS)
+
+		return HttpResponse(url, status, resp_headers, body)
+
+
+# Client shared by every thread of this process
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+def getClient():
+	"""-------------------------------------------------------------------
+		Function:		[getClient]
+		Description:	Returns the process-wide HttpClient. Forked worker
+						processes get their own client instead of sharing the
+						parent's sockets
+		Input:			None
+		Return:			The shared HttpClient
+		------------------------------------------------------------------
+	"""
+	global _client, _client_pid
+	with _client_lock:
+		if _client is None or _client_pid != os.getpid():
+			_client = HttpClient()
+			_client_pid = os.getpid()
+		return _client
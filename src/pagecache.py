@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[pagecache.py]
+  Description:	This module implements an on-disk cache of fetched pages.
+  				Page bodies are stored content-addressed under objects/
+  				and each URL has a small JSON index entry holding its
+  				object hash, HTTP validators (ETag/Last-Modified) and
+  				Content-Type. What a parser made of an object is kept under
+  				parsed/ for as long as the object itself
+"""
+import threading 						# Counter locking
+import json 							# Index entries
+import time 							# Freshness and LRU timestamps
+import os 								# File operations
+
+# The cache location
+PAGE_CACHE_PATH = os.path.join("../cache/pages/")
+OBJECTS_PATH = os.path.join(PAGE_CACHE_PATH, "objects")
+INDEX_PATH = os.path.join(PAGE_CACHE_PATH, "index")
+PARSED_PATH = os.path.join(PAGE_CACHE_PATH, "parsed")
+# Bytes of stored objects as of the last full evict plus everything stored
+# since, so runs can tell if the cache is over its limit without a scan
+SIZE_PATH = os.path.join(PAGE_CACHE_PATH, "size")
+
+# Default size the cache is trimmed back to after a run
+DEFAULT_MAX_MB = 512
+
+# Run settings, see configure()
+_offline = False
+_ttl = 0
+_max_bytes = DEFAULT_MAX_MB * 1024 * 1024
+
+# Per process counters of how requests were served
+_counters = {'hit': 0, 'revalidated': 0, 'miss': 0}
+_counter_lock = threading.Lock()
+# Bytes of objects this process stored, not yet added to SIZE_PATH
+_stored_bytes = 0
+
+def configure(offline=False, ttl=0, max_mb=DEFAULT_MAX_MB):
+	"""-------------------------------------------------------------------
+		Function:		[configure]
+		Description:	Sets how the cache is used for this run
+		Input:
+		  [offline]		Serve pages only from the cache, never the network
+		  [ttl]			Seconds a cached page is used without revalidation
+		  [max_mb]		Size in MB the cache is trimmed to by evict()
+		Return:			None
+		------------------------------------------------------------------
+	"""
+	global _offline, _ttl, _max_bytes
+	_offline = offline
+	_ttl = ttl
+	_max_bytes = max_mb * 1024 * 1024
+
+def isOffline():
+	return _offline
+
+def _count(kind):
+	with _counter_lock:
+		_counters[kind] += 1
+
+def getCounters():
+	with _counter_lock:
+		return dict(_counters)
+
+#============================================================================
+#  Path helpers
+#============================================================================
+def _indexPath(url):
+	import hashlib 		# Content addressing
+	key = hashlib.sha1(url.encode('utf8')).hexdigest()
+	return os.path.join(INDEX_PATH, key[:2], key + ".json")
+
+def _objectPath(digest):
+	return os.path.join(OBJECTS_PATH, digest[:2], digest)
+
+def _parsedPath(digest, key):
+	return os.path.join(PARSED_PATH, digest[:2], "%s.%s" % (digest, key))
+
+def _writeAtomic(path, data):
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+	with open(tmp_path, 'wb') as tmp_file:
+		tmp_file.write(data)
+	os.replace(tmp_path, path)
+
+def _writeEntry(entry):
+	_writeAtomic(_indexPath(entry['url']), json.dumps(entry).encode('utf8'))
+
+#============================================================================
+#  Lookup functions
+#============================================================================
+def lookup(url):
+	"""-------------------------------------------------------------------
+		Function:		[lookup]
+		Description:	Finds the cache entry of a URL
+		Input:
+		  [url]			The url to look up
+		Return:			The entry dict or None if the URL is not cached
+		------------------------------------------------------------------
+	"""
+	try:
+		with open(_indexPath(url), 'rb') as index_file:
+			entry = json.loads(index_file.read().decode('utf8'))
+	except (OSError, ValueError):
+		return None
+	if not os.path.exists(_objectPath(entry['object'])):
+		return None
+	return entry
+
+def isFresh(entry, max_age=None):
+	"""-------------------------------------------------------------------
+		Function:		[isFresh]
+		Description:	Determines if an entry can be used without asking the
+						server whether it changed
+		Input:
+		  [entry]		A cache entry
+		  [max_age]		Seconds the entry stays fresh, the run's TTL if None
+		Return:			True if the entry is fresh
+		------------------------------------------------------------------
+	"""
+	max_age = _ttl if max_age is None else max_age
+	return time.time() - entry['fetched'] < max_age
+
+def conditionalHeaders(entry):
+	"""-------------------------------------------------------------------
+		Function:		[conditionalHeaders]
+		Description:	Builds the revalidation headers for an entry
+		Input:
+		  [entry]		A cache entry or None
+		Return:			Dict of If-None-Match/If-Modified-Since headers
+		------------------------------------------------------------------
+	"""
+	headers = {}
+	if entry is None:
+		return headers
+	if entry.get('etag'):
+		headers['If-None-Match'] = entry['etag']
+	if entry.get('last_modified'):
+		headers['If-Modified-Since'] = entry['last_modified']
+	elif not entry.get('etag'):
+		from email.utils import formatdate 		# HTTP dates
+		headers['If-Modified-Since'] = formatdate(entry['fetched'], usegmt=True)
+	return headers
+
+def readBody(entry, revalidated=False, headers=None):
+	"""-------------------------------------------------------------------
+		Function:		[readBody]
+		Description:	Reads the cached bytes of an entry and marks it as
+						recently used
+		Input:
+		  [entry]		A cache entry
+		  [revalidated]	Did the server just confirm the entry (304)?
+		  [headers]		Headers of the 304 response, if revalidated
+		Return:			The page bytes or None if the object is gone
+		------------------------------------------------------------------
+	"""
+	try:
+		with open(_objectPath(entry['object']), 'rb') as object_file:
+			body = object_file.read()
+	except OSError:
+		return None
+
+	now = time.time()
+	entry['used'] = now
+	if revalidated:
+		entry['fetched'] = now
+		if headers is not None:
+			entry['etag'] = headers.get('ETag') or entry.get('etag')
+			entry['last_modified'] = headers.get('Last-Modified') or \
+				entry.get('last_modified')
+	try:
+		_writeEntry(entry)
+	except OSError:
+		pass
+
+	_count('revalidated' if revalidated else 'hit')
+	return body
+
+def store(url, body, headers):
+	"""-------------------------------------------------------------------
+		Function:		[store]
+		Description:	Stores a freshly downloaded page
+		Input:
+		  [url]			The url the page was fetched from
+		  [body]		The page bytes
+		  [headers]		The response headers
+		Return:			None
+		------------------------------------------------------------------
+	"""
+	_count('miss')
+	digest = hashBody(body)
+	now = time.time()
+	entry = {
+		'url'			: url,
+		'object'		: digest,
+		'size'			: len(body),
+		'etag'			: headers.get('ETag'),
+		'last_modified'	: headers.get('Last-Modified'),
+		'content_type'	: headers.get('Content-Type'),
+		'fetched'		: now,
+		'used'			: now
+	}
+	try:
+		# Identical pages share one object
+		if not os.path.exists(_objectPath(digest)):
+			_writeAtomic(_objectPath(digest), body)
+			_countStored(len(body))
+		_writeEntry(entry)
+	except OSError:
+		print("[Warning] Unable to cache page <%s>" % url)
+
+def _countStored(size):
+	global _stored_bytes
+	with _counter_lock:
+		_stored_bytes += size
+
+def hashBody(body):
+	import hashlib 		# Content addressing
+	return hashlib.sha1(body).hexdigest()
+
+#============================================================================
+#  Parsed page functions
+#============================================================================
+def readParsed(digest, key):
+	"""-------------------------------------------------------------------
+		Function:		[readParsed]
+		Description:	Reads what a parser made of a page
+		Input:
+		  [digest]		hashBody() of the page bytes
+		  [key]			Identifies the parser, its version and the charset
+		Return:			The stored bytes or None if none are stored
+		------------------------------------------------------------------
+	"""
+	try:
+		with open(_parsedPath(digest, key), 'rb') as parsed_file:
+			return parsed_file.read()
+	except OSError:
+		return None
+
+def storeParsed(digest, key, data):
+	"""-------------------------------------------------------------------
+		Function:		[storeParsed]
+		Description:	Stores what a parser made of a page. Safe to call
+						from several processes at once
+		Input:
+		  [digest]		hashBody() of the page bytes
+		  [key]			Identifies the parser, its version and the charset
+		  [data]		The bytes to store
+		Return:			None
+		------------------------------------------------------------------
+	"""
+	try:
+		_writeAtomic(_parsedPath(digest, key), data)
+	except OSError:
+		pass
+
+#============================================================================
+#  Maintenance functions
+#============================================================================
+def _allEntries():
+	entries = []
+	for (root, dirs, files) in os.walk(INDEX_PATH):
+		for name in files:
+			if not name.endswith(".json"):
+				continue
+			try:
+				with open(os.path.join(root, name), 'rb') as index_file:
+					entries.append(json.loads(index_file.read().decode('utf8')))
+			except (OSError, ValueError):
+				continue
+	return entries
+
+def _allObjects():
+	objects = {}
+	for (root, dirs, files) in os.walk(OBJECTS_PATH):
+		for name in files:
+			if not name.endswith(".tmp"):
+				objects[name] = os.path.getsize(os.path.join(root, name))
+	return objects
+
+def _allParsed():
+	parsed = {}
+	for (root, dirs, files) in os.walk(PARSED_PATH):
+		for name in files:
+			if not name.endswith(".tmp"):
+				parsed[name] = name.split('.', 1)[0]
+	return parsed
+
+def _readSize():
+	try:
+		with open(SIZE_PATH, 'rb') as size_file:
+			return int(size_file.read())
+	except (OSError, ValueError):
+		return None
+
+def _writeSize(size):
+	try:
+		_writeAtomic(SIZE_PATH, str(size).encode('ascii'))
+	except OSError:
+		pass
+
+def evictIfNeeded():
+	"""-------------------------------------------------------------------
+		Function:		[evictIfNeeded]
+		Description:	Runs evict() only if the recorded size of the cache
+						says it is over its limit. Otherwise adds what this
+						run stored to the recorded size, which costs a read
+						and a write instead of a scan of the whole cache
+		Input:			None
+		Return:			Number of entries evicted
+		------------------------------------------------------------------
+	"""
+	global _stored_bytes
+	with _counter_lock:
+		stored = _stored_bytes
+		_stored_bytes = 0
+	size = _readSize()
+	if size is None or size + stored > _max_bytes:
+		return evict()
+	if stored > 0:
+		_writeSize(size + stored)
+	return 0
+
+def evict(max_bytes=None):
+	"""-------------------------------------------------------------------
+		Function:		[evict]
+		Description:	Drops least recently used entries until the stored
+						objects fit in the size limit, then deletes objects
+						no entry refers to anymore and their parsed pages
+		Input:
+		  [max_bytes]	Size limit, the configured limit if None
+		Return:			Number of entries evicted
+		------------------------------------------------------------------
+	"""
+	max_bytes = _max_bytes if max_bytes is None else max_bytes
+	entries = _allEntries()
+	objects = _allObjects()
+	refs = {}
+	for entry in entries:
+		refs[entry['object']] = refs.get(entry['object'], 0) + 1
+
+	total = sum(objects.values())
+	evicted = 0
+	for entry in sorted(entries, key=lambda e: e['used']):
+		if total <= max_bytes:
+			break
+		try:
+			os.remove(_indexPath(entry['url']))
+		except OSError:
+			continue
+		evicted += 1
+		refs[entry['object']] -= 1
+		if refs[entry['object']] == 0 and entry['object'] in objects:
+			total -= objects[entry['object']]
+
+	# Remove every object without a referring entry
+	for (digest, size) in objects.items():
+		if refs.get(digest, 0) == 0:
+			try:
+				os.remove(_objectPath(digest))
+			except OSError:
+				pass
+
+	# Parsed pages go with their object, whatever parser version made them
+	for (name, digest) in _allParsed().items():
+		if refs.get(digest, 0) == 0:
+			try:
+				os.remove(os.path.join(PARSED_PATH, digest[:2], name))
+			except OSError:
+				pass
+	_writeSize(sum(size for (digest, size) in objects.items()
+		if refs.get(digest, 0) > 0))
+	return evicted
+
+def getStats():
+	"""-------------------------------------------------------------------
+		Function:		[getStats]
+		Description:	Summarizes the contents of the cache
+		Input:			None
+		Return:			Dict of cache statistics
+		------------------------------------------------------------------
+	"""
+	entries = _allEntries()
+	objects = _allObjects()
+	parsed = _allParsed()
+	hosts = {}
+	for entry in entries:
+		host = entry['url'].split('/')[2] if entry['url'].count('/') >= 2 else "?"
+		hosts[host] = hosts.get(host, 0) + 1
+	return {
+		'entries'	: len(entries),
+		'objects'	: len(objects),
+		'parsed'	: len(parsed),
+		'bytes'		: sum(objects.values()),
+		'logical'	: sum(entry['size'] for entry in entries),
+		'validated'	: sum(1 for e in entries if e.get('etag') or e.get('last_modified')),
+		'oldest'	: min([e['fetched'] for e in entries], default=None),
+		'newest'	: max([e['fetched'] for e in entries], default=None),
+		'hosts'		: hosts,
+		'limit'		: _max_bytes
+	}
+
+def printStats():
+	"""-------------------------------------------------------------------
+		Function:		[printStats]
+		Description:	Prints a summary of the contents of the cache
+		Input:			None
+		Return:			None
+		------------------------------------------------------------------
+	"""
+	stats = getStats()
+	fmt_time = lambda t: time.strftime("%Y-%m-%d %H:%M", time.localtime(t)) \
+		if t is not None else "-"
+	print("\nPage cache: %s" % os.path.realpath(PAGE_CACHE_PATH))
+	print("  Entries        : %d (%d with ETag/Last-Modified)" %
+		(stats['entries'], stats['validated']))
+	print("  Stored objects : %d" % stats['objects'])
+	print("  Parsed pages   : %d" % stats['parsed'])
+	print("  Size on disk   : %.2f MB of %.0f MB limit (%.2f MB before dedup)" %
+		(stats['bytes'] / 2**20, stats['limit'] / 2**20, stats['logical'] / 2**20))
+	print("  Oldest fetch   : %s" % fmt_time(stats['oldest']))
+	print("  Newest fetch   : %s" % fmt_time(stats['newest']))
+	for (host, count) in sorted(stats['hosts'].items()):
+		print("    %-30s: %d pages" % (host, count))
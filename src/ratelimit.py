@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[ratelimit.py]
+  Description:	This module schedules every request of this process by host.
+  				Each host gets a token bucket capping its request rate and a
+  				cap on concurrent requests. The cap is halved whenever the
+  				host throttles (429/503) and grows back one request at a time
+  				as requests succeed. Throttled hosts are paused for their
+  				Retry-After or an exponential backoff with jitter
+"""
+from contextlib import contextmanager 		# Request scoping
+from timeit import default_timer as clock 	# Scheduling clock
+from urllib.parse import urlsplit 			# Host of a URL
+import threading 							# Scheduler locking
+import random 								# Backoff jitter
+import time 								# Retry-After dates
+
+import httpclient 			# HttpError
+
+# Limits of hosts that do not configure their own in user_config.json. The
+# rate is unlimited unless configured, and the connection cap is above the
+# thread counts used so it only comes into play once a host throttles
+DEFAULT_RATE = None 		# Requests per second, None for unlimited
+DEFAULT_BURST = 5 			# Requests sent back to back after idling
+DEFAULT_CONNECTIONS = 16 	# Concurrent requests
+
+# Status codes of a host asking to slow down
+THROTTLE_CODES = (429, 503)
+# Backoff before retrying a failed request is a random delay up to
+# BACKOFF_BASE * 2^(tries - 1) seconds, at most BACKOFF_MAX
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# Throttled responses tolerated per request before giving up
+MAX_THROTTLES = 20
+
+def backoff(tries):
+	"""-------------------------------------------------------------------
+		Function:		[backoff]
+		Description:	Exponential backoff with full jitter
+		Input:
+		  [tries]		Number of failed attempts so far, at least 1
+		Return:			Seconds to wait before the next attempt
+		------------------------------------------------------------------
+	"""
+	return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (tries - 1)))
+
+def parseRetryAfter(value):
+	"""-------------------------------------------------------------------
+		Function:		[parseRetryAfter]
+		Description:	Parses a Retry-After header
+		Input:
+		  [value]		Header value, delay seconds or an HTTP date
+		Return:			Seconds to wait or None if value is missing/invalid
+		------------------------------------------------------------------
+	"""
+	from email.utils import parsedate_to_datetime	# Retry-After dates
+	if value is None:
+		return None
+	value = value.strip()
+	try:
+		return max(float(value), 0.0)
+	except ValueError:
+		pass
+	try:
+		return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+	except (TypeError, ValueError, IndexError, OverflowError):
+		return None
+
+def isThrottle(error):
+	return isinstance(error, httpclient.HttpError) and \
+		error.code in THROTTLE_CODES
+
+class HostLimiter:
+	#--------------------------------------------------------------------------
+	#  ctor
+	#--------------------------------------------------------------------------
+	def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+		connections=DEFAULT_CONNECTIONS):
+		"""-------------------------------------------------------------------
+			Function:		[CONSTRUCTOR]
+			Description:	Creates the scheduler of one host
+			Input:
+			  [rate]		Requests per second, unlimited if None
+			  [burst]		Token bucket capacity
+			  [connections]	Maximum concurrent requests
+			------------------------------------------------------------------
+		"""
+		self.__cond = threading.Condition()
+		self.__rate = rate
+		self.__burst = max(burst, 1)
+		self.__tokens = float(self.__burst)
+		self.__refilled = clock()
+
+		# Concurrency cap, adapted between 1 and connections
+		self.__max_limit = max(connections, 1)
+		self.__limit = self.__max_limit
+		self.__inflight = 0
+		self.__successes = 0
+
+		# Throttling state. Requests sent before the last decrease must not
+		# decrease the cap again, they were sent at the old rate
+		self.__paused_until = 0.0
+		self.__decreased_at = 0.0
+		self.__strikes = 0
+
+	#--------------------------------------------------------------------------
+	#  Scheduling functions
+	#--------------------------------------------------------------------------
+	def acquire(self):
+		"""-------------------------------------------------------------------
+			Function:		[acquire]
+			Description:	Blocks until this host may be sent a request
+			Input:			None
+			Return:			clock() when the request was let through
+			------------------------------------------------------------------
+		"""
+		with self.__cond:
+			while True:
+				now = clock()
+				if now < self.__paused_until:
+					self.__cond.wait(self.__paused_until - now)
+					continue
+				if self.__inflight >= self.__limit:
+					self.__cond.wait()
+					continue
+				if self.__rate is not None:
+					self.__tokens = min(self.__burst, self.__tokens +
+						(now - self.__refilled) * self.__rate)
+					self.__refilled = now
+					if self.__tokens < 1:
+						self.__cond.wait((1 - self.__tokens) / self.__rate)
+						continue
+					self.__tokens -= 1
+				self.__inflight += 1
+				return now
+
+	def release(self, sent, error=None):
+		"""-------------------------------------------------------------------
+			Function:		[release]
+			Description:	Ends a request, adapting the concurrency cap and
+							pausing the host if it throttled the request
+			Input:
+			  [sent]		The clock() returned by acquire()
+			  [error]		The exception the request raised, if any
+			Return:			None
+			------------------------------------------------------------------
+		"""
+		with self.__cond:
+			self.__inflight -= 1
+			if isThrottle(error):
+				now = clock()
+				if sent >= self.__decreased_at:
+					self.__limit = max(self.__limit // 2, 1)
+					self.__decreased_at = now
+					self.__strikes += 1
+				self.__successes = 0
+				self.__tokens = 0.0
+				delay = parseRetryAfter(error.headers.get('Retry-After')
+					if error.headers is not None else None)
+				if delay is None:
+					delay = backoff(self.__strikes)
+				self.__paused_until = max(self.__paused_until, now + delay)
+			elif error is None:
+				# Additive increase, one more request per full window
+				self.__strikes = 0
+				self.__successes += 1
+				if self.__successes >= self.__limit and \
+					self.__limit < self.__max_limit:
+					self.__limit += 1
+					self.__successes = 0
+			self.__cond.notify_all()
+
+	def getLimit(self):
+		return self.__limit
+
+
+# Limiters of every host requested by this process, keyed by URL netloc
+_limiters = {}
+_limits = {}
+_lock = threading.Lock()
+
+def configure(limits):
+	"""-------------------------------------------------------------------
+		Function:		[configure]
+		Description:	Sets the limits of the configured hosts
+		Input:
+		  [limits]		Dict of base URL to dict of any of 'rate', 'burst'
+		  				and 'max_connections'
+		Return:			None
+		------------------------------------------------------------------
+	"""
+	global _limits
+	with _lock:
+		_limits = {urlsplit(url).netloc: host for (url, host) in limits.items()}
+		_limiters.clear()
+
+def getLimiter(url):
+	"""-------------------------------------------------------------------
+		Function:		[getLimiter]
+		Description:	Returns the limiter shared by every request to the
+						host of a URL
+		Input:
+		  [url]			The url about to be requested
+		Return:			The HostLimiter of the url's host
+		------------------------------------------------------------------
+	"""
+	netloc = urlsplit(url).netloc
+	with _lock:
+		limiter = _limiters.get(netloc)
+		if limiter is None:
+			host = _limits.get(netloc, {})
+			limiter = HostLimiter(host.get('rate', DEFAULT_RATE),
+				host.get('burst', DEFAULT_BURST),
+				host.get('max_connections', DEFAULT_CONNECTIONS))
+			_limiters[netloc] = limiter
+		return limiter
+
+@contextmanager
+def request(url):
+	"""-------------------------------------------------------------------
+		Function:		[request]
+		Description:	Scopes one request to the host of a URL, waiting for
+						its turn first
+		Input:
+		  [url]			The url about to be requested
+		Return:			Context manager
+		------------------------------------------------------------------
+	"""
+	limiter = getLimiter(url)
+	sent = limiter.acquire()
+	try:
+		yield
+	except BaseException as e:
+		limiter.release(sent, e)
+		raise
+	limiter.release(sent)
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[rawindex.py]
+  Description:	This module maintains a per-series full-text index over the
+  				raw lines of every rendered chapter. Chapters are indexed
+  				by the character bigrams they contain so a term lookup only
+  				scans the lines of chapters that can contain it
+"""
+import os 			# File operations
+
+# The raw index location
+RAW_INDEX_PATH = os.path.join("../cache/rawindex/")
+
+# Length of the character n-grams chapters are indexed by. Two characters
+# keeps two character CN/JP names selective
+GRAM_LEN = 2
+
+# Most grams a query narrows its candidate chapters by. The rarest grams of
+# a term already leave few candidates, and every gram is a compound SELECT
+# arm, of which SQLite allows only a few hundred
+MAX_QUERY_GRAMS = 8
+
+# Number of grams counted per query, below SQLite's variable limit
+LOOKUP_CHUNK = 500
+
+def toGrams(text):
+	"""-------------------------------------------------------------------
+		Function:		[toGrams]
+		Description:	Splits text into its distinct character n-grams
+		Input:
+		  [text]		The text to split
+		Return:			Set of n-grams of length GRAM_LEN
+		------------------------------------------------------------------
+	"""
+	return set(text[i:i+GRAM_LEN] for i in range(len(text) - GRAM_LEN + 1))
+
+class RawIndex:
+	#--------------------------------------------------------------------------
+	#  ctor
+	#--------------------------------------------------------------------------
+	def __init__(self, series):
+		"""-------------------------------------------------------------------
+			Function:		[CONSTRUCTOR]
+			Description:	Opens or creates the raw index of a series
+			Input:
+			  [series]		The series the index belongs to
+			------------------------------------------------------------------
+		"""
+		import sqlite3 		# Index storage
+		if not os.path.exists(RAW_INDEX_PATH):	os.makedirs(RAW_INDEX_PATH)
+		db_path = os.path.join(RAW_INDEX_PATH, "%s.db" % series.lower())
+		self.__db = sqlite3.connect(db_path)
+		self.__db.executescript("""
+			CREATE TABLE IF NOT EXISTS lines (
+				ch 		INTEGER NOT NULL,
+				line 	INTEGER NOT NULL,
+				text 	TEXT NOT NULL,
+				PRIMARY KEY (ch, line)
+			) WITHOUT ROWID;
+			CREATE TABLE IF NOT EXISTS grams (
+				gram 	TEXT NOT NULL,
+				ch 		INTEGER NOT NULL,
+				PRIMARY KEY (gram, ch)
+			) WITHOUT ROWID;
+		""")
+
+	#--------------------------------------------------------------------------
+	#  Update functions
+	#--------------------------------------------------------------------------
+	def addChapter(self, ch, lines):
+		"""-------------------------------------------------------------------
+			Function:		[addChapter]
+			Description:	Replaces the indexed lines of a chapter. Changes
+							are only persisted by commit()
+			Input:
+			  [ch]			The chapter number
+			  [lines]		List of (line number, raw line) of the chapter
+			Return:			None
+			------------------------------------------------------------------
+		"""
+		grams = set()
+		for (line_num, text) in lines:
+			grams.update(toGrams(text))
+
+		self.__db.execute("DELETE FROM lines WHERE ch = ?", (ch,))
+		self.__db.execute("DELETE FROM grams WHERE ch = ?", (ch,))
+		self.__db.executemany("INSERT INTO lines VALUES (?, ?, ?)",
+			((ch, line_num, text) for (line_num, text) in lines))
+		self.__db.executemany("INSERT INTO grams VALUES (?, ?)",
+			((gram, ch) for gram in grams))
+
+	def commit(self):
+		self.__db.commit()
+
+	def close(self):
+		self.__db.commit()
+		self.__db.close()
+
+	#--------------------------------------------------------------------------
+	#  Query functions
+	#--------------------------------------------------------------------------
+	def query(self, term):
+		"""-------------------------------------------------------------------
+			Function:		[query]
+			Description:	Finds every indexed line containing a term
+			Input:
+			  [term]		The raw term to look up
+			Return:			List of (ch, line number, line) in chapter order
+			------------------------------------------------------------------
+		"""
+		grams = sorted(toGrams(term))
+		if len(grams) == 0:
+			# Too short to use the gram index, scan every line
+			rows = self.__db.execute("SELECT ch, line, text FROM lines "
+				+ "WHERE instr(text, ?) > 0 ORDER BY ch, line", (term,))
+			return rows.fetchall()
+
+		# Only chapters holding every gram of the term can contain it. The
+		# rarest few narrow them down and instr() does the exact check
+		grams = self.rarestGrams(grams)
+		if grams is None:
+			return []
+		candidates = " INTERSECT ".join(
+			["SELECT ch FROM grams WHERE gram = ?"] * len(grams))
+		rows = self.__db.execute("SELECT ch, line, text FROM lines "
+			+ "WHERE ch IN (%s) AND instr(text, ?) > 0 " % candidates
+			+ "ORDER BY ch, line", grams + [term])
+		return rows.fetchall()
+
+	def rarestGrams(self, grams):
+		"""-------------------------------------------------------------------
+			Function:		[rarestGrams]
+			Description:	Picks the grams found in the fewest chapters
+			Input:
+			  [grams]		List of grams of a term
+			Return:			Up to MAX_QUERY_GRAMS of the grams, rarest first,
+							or None if a gram is in no chapter at all
+			------------------------------------------------------------------
+		"""
+		counts = {}
+		for i in range(0, len(grams), LOOKUP_CHUNK):
+			chunk = grams[i:i+LOOKUP_CHUNK]
+			counts.update(self.__db.execute("SELECT gram, COUNT(*) FROM grams "
+				+ "WHERE gram IN (%s) GROUP BY gram" % ",".join("?" * len(chunk)),
+				chunk))
+		if len(counts) < len(grams):
+			return None
+		return sorted(grams, key=lambda gram: (counts[gram], gram))[:MAX_QUERY_GRAMS]
+
+	def getText(self, ch):
+		"""-------------------------------------------------------------------
+			Function:		[getText]
+			Description:	Reassembles the raw text of an indexed chapter
+			Input:
+			  [ch]			The chapter number
+			Return:			The raw lines of the chapter joined by newlines
+			------------------------------------------------------------------
+		"""
+		rows = self.__db.execute("SELECT text FROM lines WHERE ch = ? "
+			+ "ORDER BY line", (ch,))
+		return u'\n'.join(text for (text,) in rows)
+
+	def getNumChapters(self):
+		row = self.__db.execute("SELECT COUNT(DISTINCT ch) FROM lines").fetchone()
+		return row[0]
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[rendermemo.py]
+  Description:	This module keeps a per-series store of rendered text lines.
+  				Each line is stored as a fragment template with its l/r/w/d
+  				ids left open, keyed by the raw line, the version of the
+  				compiled dictionary and the language, so a line rendered
+  				once is only renumbered when it shows up again
+"""
+import json 		# Matched entries of a fragment
+import time 		# LRU timestamps
+import os 			# File operations
+
+# The render memo location
+RENDER_MEMO_PATH = os.path.join("../cache/render/")
+
+# Default size each series' memo is trimmed back to after a run
+DEFAULT_MAX_MB = 64
+
+# Number of keys looked up per query, below SQLite's variable limit
+LOOKUP_CHUNK = 500
+
+def _memoPath(series):
+	return os.path.join(RENDER_MEMO_PATH, "%s.db" % series.lower())
+
+def fragmentKey(line, version, lang):
+	"""-------------------------------------------------------------------
+		Function:		[fragmentKey]
+		Description:	Identifies the rendering of a line
+		Input:
+		  [line]		The raw line, stripped as HtmlWriter renders it
+		  [version]		Version of the compiled dictionary
+		  [lang]		The language the line is in
+		Return:			Hex digest keying the fragment of the line
+		------------------------------------------------------------------
+	"""
+	import hashlib 		# Fragment keys
+	return hashlib.sha1(("%s\0%s\0%s" % (version, lang, line))
+		.encode('utf8')).hexdigest()
+
+def prefetch(series, version, lang, lines):
+	"""-------------------------------------------------------------------
+		Function:		[prefetch]
+		Description:	Loads every stored fragment of a chapter's lines in
+						one pass. Only reads the memo, so it is safe to call
+						from worker processes while the main process writes
+		Input:
+		  [series]		The series the chapter belongs to
+		  [version]		Version of the compiled dictionary
+		  [lang]		The language of the series
+		  [lines]		The raw lines of the chapter
+		Return:			ChapterMemo holding the fragments found
+		------------------------------------------------------------------
+	"""
+	import sqlite3 		# Fragment storage
+	keys = list(set(fragmentKey(line.lstrip(), version, lang) for line in lines))
+	fragments = {}
+	try:
+		db = sqlite3.connect("file:%s?mode=ro" % _memoPath(series), uri=True)
+	except sqlite3.Error:
+		# Nothing was memoized for this series yet
+		return ChapterMemo(version, lang, fragments)
+	try:
+		for i in range(0, len(keys), LOOKUP_CHUNK):
+			chunk = keys[i:i+LOOKUP_CHUNK]
+			rows = db.execute("SELECT key, template, entries FROM frags WHERE "
+				+ "key IN (%s)" % ",".join("?" * len(chunk)), chunk)
+			for (key, template, entries) in rows:
+				fragments[key] = (template, [tuple(e) for e in json.loads(entries)])
+	except sqlite3.Error:
+		pass
+	finally:
+		db.close()
+	return ChapterMemo(version, lang, fragments)
+
+class ChapterMemo:
+	#--------------------------------------------------------------------------
+	#  ctor
+	#--------------------------------------------------------------------------
+	def __init__(self, version, lang, fragments):
+		"""-------------------------------------------------------------------
+			Function:		[CONSTRUCTOR]
+			Description:	Fragments available to the render of one chapter,
+							along with what the render used and added
+			Input:
+			  [version]		Version of the compiled dictionary
+			  [lang]		The language of the chapter
+			  [fragments]	Dict of key to (template, entries)
+			------------------------------------------------------------------
+		"""
+		self.version = version
+		self.lang = lang
+		self.fragments = fragments
+		self.added = {}
+		self.used = set()
+		self.hits = 0
+		self.misses = 0
+
+	def __getstate__(self):
+		# Only what the render produced goes back to the main process
+		state = dict(self.__dict__)
+		state['fragments'] = {}
+		return state
+
+	def get(self, line):
+		"""-------------------------------------------------------------------
+			Function:		[get]
+			Description:	Looks up the fragment of a line, counting the hit
+							or miss
+			Input:
+			  [line]		The stripped raw line
+			Return:			(template, entries) or None if not memoized
+			------------------------------------------------------------------
+		"""
+		key = fragmentKey(line, self.version, self.lang)
+		fragment = self.fragments.get(key)
+		if fragment is None:
+			self.misses += 1
+			return None
+		self.hits += 1
+		self.used.add(key)
+		return fragment
+
+	def put(self, line, template, entries):
+		key = fragmentKey(line, self.version, self.lang)
+		self.fragments[key] = (template, entries)
+		self.added[key] = (template, entries)
+
+class RenderMemo:
+	#--------------------------------------------------------------------------
+	#  ctor
+	#--------------------------------------------------------------------------
+	def __init__(self, series, max_mb=DEFAULT_MAX_MB):
+		"""-------------------------------------------------------------------
+			Function:		[CONSTRUCTOR]
+			Description:	Opens or creates the render memo of a series
+			Input:
+			  [series]		The series the memo belongs to
+			  [max_mb]		Size in MB the memo is trimmed to by evict()
+			------------------------------------------------------------------
+		"""
+		import sqlite3 		# Fragment storage
+		if not os.path.exists(RENDER_MEMO_PATH):	os.makedirs(RENDER_MEMO_PATH)
+		self.__max_bytes = max_mb * 1024 * 1024
+		self.__counters = {'hit': 0, 'miss': 0, 'added': 0}
+		self.__db = sqlite3.connect(_memoPath(series))
+		# WAL lets render processes read while this process writes
+		self.__db.execute("PRAGMA journal_mode=WAL")
+		self.__db.execute("PRAGMA synchronous=NORMAL")
+		self.__db.executescript("""
+			CREATE TABLE IF NOT EXISTS frags (
+				key 		TEXT PRIMARY KEY,
+				template 	TEXT NOT NULL,
+				entries 	TEXT NOT NULL,
+				size 		INTEGER NOT NULL,
+				used 		REAL NOT NULL
+			) WITHOUT ROWID;
+			CREATE INDEX IF NOT EXISTS frags_used ON frags (used);
+		""")
+
+	#--------------------------------------------------------------------------
+	#  Update functions
+	#--------------------------------------------------------------------------
+	def store(self, chapter_memo):
+		"""-------------------------------------------------------------------
+			Function:		[store]
+			Description:	Saves the fragments a chapter render added and
+							marks the ones it reused as recently used
+			Input:
+			  [chapter_memo] The ChapterMemo returned by the render
+			Return:			None
+			------------------------------------------------------------------
+		"""
+		now = time.time()
+		rows = []
+		for (key, (template, entries)) in chapter_memo.added.items():
+			entries = json.dumps(entries, ensure_ascii=False)
+			size = len(key) + len(template.encode('utf8')) + len(entries.encode('utf8'))
+			rows.append((key, template, entries, size, now))
+		with self.__db:
+			self.__db.executemany("INSERT OR REPLACE INTO frags VALUES "
+				+ "(?, ?, ?, ?, ?)", rows)
+			self.__db.executemany("UPDATE frags SET used = ? WHERE key = ?",
+				((now, key) for key in chapter_memo.used if key not in chapter_memo.added))
+		self.__counters['hit'] += chapter_memo.hits
+		self.__counters['miss'] += chapter_memo.misses
+		self.__counters['added'] += len(rows)
+
+	def evict(self, max_bytes=None):
+		"""-------------------------------------------------------------------
+			Function:		[evict]
+			Description:	Drops least recently used fragments until the memo
+							fits in the size limit
+			Input:
+			  [max_bytes]	Size limit, the configured limit if None
+			Return:			Number of fragments evicted
+			------------------------------------------------------------------
+		"""
+		max_bytes = self.__max_bytes if max_bytes is None else max_bytes
+		(total,) = self.__db.execute("SELECT coalesce(sum(size), 0) FROM frags").fetchone()
+		if total <= max_bytes:
+			return 0
+
+		# Oldest first, ties between fragments used at once go in key order
+		doomed = []
+		for (key, size) in self.__db.execute("SELECT key, size FROM frags "
+			+ "ORDER BY used, key"):
+			if total <= max_bytes:
+				break
+			doomed.append((key,))
+			total -= size
+		with self.__db:
+			self.__db.executemany("DELETE FROM frags WHERE key = ?", doomed)
+		return len(doomed)
+
+	def close(self):
+		self.evict()
+		self.__db.close()
+
+	#--------------------------------------------------------------------------
+	#  Query functions
+	#--------------------------------------------------------------------------
+	def getCounters(self):
+		return dict(self.__counters)
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[renderpreload.py]
+  Description:	This module is imported once by the forkserver the render
+  				processes of a batch are forked from. Importing it loads the
+  				parsing and rendering modules and builds their lazily built
+  				state, so every render process starts out with it ready.
+  				Nothing else should import this module
+"""
+import os 			# Environment of the forkserver
+
+import htmlwriter	# Custom html writing class
+
+# Comma separated languages of the series being rendered, set by the process
+# starting the forkserver
+LANGS_ENV = "WN_RENDER_LANGS"
+
+htmlwriter.warmUp(os.environ.get(LANGS_ENV, "").split(","))
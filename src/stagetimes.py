@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[stagetimes.py]
+  Description:	This module times the stages every chapter goes through
+  				(fetch, parse, dictionary match, romanization, HTML assembly
+  				and write) and summarizes them across a run as percentiles.
+  				When tracing is enabled, every stage is also recorded as a
+  				span and exported as a Chrome trace-event timeline
+"""
+from timeit import default_timer as clock 	# Stage timers, system-wide clock
+import threading 							# Report locking
+import json 								# Report output
+import os 									# Process ids
+
+# Stages in the order a chapter goes through them
+STAGES = ('fetch', 'parse', 'memo', 'match', 'romanize', 'assemble', 'write')
+# Percentiles reported for every stage
+PERCENTILES = (50, 95)
+
+# Stage times accumulated by this process for the chapter being rendered.
+# Chapters are rendered one at a time per process so no locking is needed
+_current = {}
+
+# Spans recorded by this process while tracing is enabled. Each is a tuple
+# of (name, chapter, start, end, pid, thread id, thread name)
+_tracing = False
+_spans = []
+
+def add(stage, seconds):
+	_current[stage] = _current.get(stage, 0.0) + seconds
+
+def take():
+	"""-------------------------------------------------------------------
+		Function:		[take]
+		Description:	Returns the stage times accumulated by this process
+						since the last call and starts over
+		Input:			None
+		Return:			Dict of stage to seconds
+		------------------------------------------------------------------
+	"""
+	global _current
+	times = _current
+	_current = {}
+	return times
+
+def enableTrace(enabled=True):
+	global _tracing
+	_tracing = enabled
+
+def span(name, chapter, start, end=None):
+	"""-------------------------------------------------------------------
+		Function:		[span]
+		Description:	Records a timeline span if tracing is enabled. Does
+						nothing otherwise
+		Input:
+		  [name]		The stage name
+		  [chapter]		(series, chapter number) or None
+		  [start]		clock() at the start of the span
+		  [end]			clock() at the end of the span, now if None
+		Return:			None
+		------------------------------------------------------------------
+	"""
+	if not _tracing:
+		return
+	end = clock() if end is None else end
+	thread = threading.current_thread()
+	_spans.append((name, chapter, start, end, os.getpid(), thread.ident, 
+		thread.name))
+
+def takeSpans():
+	"""-------------------------------------------------------------------
+		Function:		[takeSpans]
+		Description:	Returns the spans recorded by this process since the
+						last call and starts over. Spans a forked worker 
+						inherited from its parent are dropped
+		Input:			None
+		Return:			List of span tuples
+		------------------------------------------------------------------
+	"""
+	global _spans
+	spans = _spans
+	_spans = []
+	pid = os.getpid()
+	return [s for s in spans if s[4] == pid]
+
+def percentile(values, p):
+	"""-------------------------------------------------------------------
+		Function:		[percentile]
+		Description:	Nearest-rank percentile
+		Input:
+		  [values]		Sorted list of numbers
+		  [p]			Percentile in [0, 100]
+		Return:			The percentile or 0 if values is empty
+		------------------------------------------------------------------
+	"""
+	if len(values) == 0:
+		return 0.0
+	rank = max(int(round(p / 100.0 * len(values) + 0.5)) - 1, 0)
+	return values[min(rank, len(values) - 1)]
+
+# Stand-in profiler holding stats collected in another process, pstats only
+# accepts files or objects with create_stats()
+class ProfileData:
+	def __init__(self, stats):
+		self.stats = stats
+
+	def create_stats(self):
+		pass
+
+class StageReport:
+	#--------------------------------------------------------------------------
+	#  ctor
+	#--------------------------------------------------------------------------
+	def __init__(self):
+		"""-------------------------------------------------------------------
+			Function:		[CONSTRUCTOR]
+			Description:	Creates an empty report
+			Input:			None
+			------------------------------------------------------------------
+		"""
+		self.__lock = threading.Lock()
+		self.__chapters = {}
+		self.__profiles = []
+		self.__spans = []
+		self.__pid = os.getpid()
+
+	#--------------------------------------------------------------------------
+	#  Recording functions
+	#--------------------------------------------------------------------------
+	def record(self, chapter, times):
+		"""-------------------------------------------------------------------
+			Function:		[record]
+			Description:	Adds stage times of a chapter. Safe to call from
+							several threads
+			Input:
+			  [chapter]		(series, chapter number)
+			  [times]		Dict of stage to seconds
+			Return:			None
+			------------------------------------------------------------------
+		"""
+		with self.__lock:
+			totals = self.__chapters.setdefault(chapter, {})
+			for (stage, seconds) in times.items():
+				totals[stage] = totals.get(stage, 0.0) + seconds
+
+	def addProfile(self, stats):
+		"""-------------------------------------------------------------------
+			Function:		[addProfile]
+			Description:	Adds cProfile stats collected in any process
+			Input:
+			  [stats]		The stats dict of a cProfile.Profile
+			Return:			None
+			------------------------------------------------------------------
+		"""
+		with self.__lock:
+			self.__profiles.append(stats)
+
+	def addSpans(self, spans):
+		with self.__lock:
+			self.__spans.extend(spans)
+
+	def getNumChapters(self):
+		return len(self.__chapters)
+
+	#--------------------------------------------------------------------------
+	#  Output functions
+	#--------------------------------------------------------------------------
+	def summarize(self):
+		"""-------------------------------------------------------------------
+			Function:		[summarize]
+			Description:	Summarizes each stage across chapters
+			Input:			None
+			Return:			Dict of stage to dict of p50/p95/max/total seconds
+			------------------------------------------------------------------
+		"""
+		summary = {}
+		for stage in STAGES:
+			values = sorted(times[stage] for times in self.__chapters.values()
+				if stage in times)
+			if len(values) == 0:
+				continue
+			summary[stage] = {'p%d' % p: percentile(values, p) for p in PERCENTILES}
+			summary[stage]['max'] = values[-1]
+			summary[stage]['total'] = sum(values)
+		return summary
+
+	def printTable(self):
+		"""-------------------------------------------------------------------
+			Function:		[printTable]
+			Description:	Prints the per stage percentiles in milliseconds
+			Input:			None
+			Return:			None
+			------------------------------------------------------------------
+		"""
+		from tabulate import tabulate 		# Print pretty tables
+		summary = self.summarize()
+		if len(summary) == 0:
+			return
+		headers = ["Stage"] + ["p%d (ms)" % p for p in PERCENTILES] + \
+			["max (ms)", "total (ms)"]
+		data = []
+		for (stage, stats) in summary.items():
+			data.append([stage] + [stats['p%d' % p] * 1000 for p in PERCENTILES]
+				+ [stats['max'] * 1000, stats['total'] * 1000])
+		print("\nStage times over %d chapters:" % len(self.__chapters))
+		print("  " + tabulate(data, headers=headers, numalign="right", 
+			floatfmt=".1f").replace('\n', '\n  '))
+
+	def writeJson(self, path, info=None):
+		"""-------------------------------------------------------------------
+			Function:		[writeJson]
+			Description:	Writes the per chapter stage times and their
+							summary as JSON
+			Input:
+			  [path]		The output file path
+			  [info]		Dict of extra run information to include
+			Return:			None
+			------------------------------------------------------------------
+		"""
+		report = {
+			'run'		: info if info is not None else {},
+			'summary'	: self.summarize(),
+			'chapters'	: {"%s %d" % chapter: times for (chapter, times)
+				in sorted(self.__chapters.items())}
+		}
+		with open(path, 'w') as report_file:
+			json.dump(report, report_file, indent=2)
+
+	def writeProfile(self, path):
+		"""-------------------------------------------------------------------
+			Function:		[writeProfile]
+			Description:	Merges every added cProfile stats and writes them
+							in pstats format
+			Input:
+			  [path]		The output file path
+			Return:			False if no profile was added, True otherwise
+			------------------------------------------------------------------
+		"""
+		import pstats 		# Profile merging
+		if len(self.__profiles) == 0:
+			return False
+		merged = pstats.Stats(ProfileData(self.__profiles[0]))
+		for stats in self.__profiles[1:]:
+			merged.add(ProfileData(stats))
+		merged.dump_stats(path)
+		return True
+
+	def writeTrace(self, path):
+		"""-------------------------------------------------------------------
+			Function:		[writeTrace]
+			Description:	Writes the recorded spans as a Chrome trace-event
+							JSON file, viewable in chrome://tracing or
+							Perfetto. Every stage is a span on the thread
+							that ran it and every chapter an async span from
+							its first to its last stage
+			Input:
+			  [path]		The output file path
+			Return:			None
+			------------------------------------------------------------------
+		"""
+		if len(self.__spans) == 0:
+			events = []
+		else:
+			origin = min(s[2] for s in self.__spans)
+			to_us = lambda t: round((t - origin) * 1e6, 1)
+			events = []
+			threads = {}
+			chapters = {}
+			for (name, chapter, start, end, pid, tid, tname) in self.__spans:
+				(series, ch) = chapter if chapter is not None else (None, None)
+				events.append({'name': name, 'cat': "stage", 'ph': "X",
+					'ts': to_us(start), 'dur': to_us(end) - to_us(start),
+					'pid': pid, 'tid': tid, 'args': {'series': series, 'ch': ch}})
+				threads[(pid, tid)] = tname
+				if chapter is not None:
+					(first, last) = chapters.get(chapter, (start, end))
+					chapters[chapter] = (min(first, start), max(last, end))
+
+			# Chapter spans from first fetch to final write
+			for (chapter, (first, last)) in sorted(chapters.items()):
+				for (ph, t) in (("b", first), ("e", last)):
+					events.append({'name': "%s ch %d" % chapter, 'cat': "chapter",
+						'ph': ph, 'id': "%s %d" % chapter, 'ts': to_us(t), 
+						'pid': self.__pid, 'tid': 0})
+
+			# Name the processes and threads
+			for pid in set(pid for (pid, tid) in threads):
+				events.append({'name': "process_name", 'ph': "M", 'pid': pid,
+					'args': {'name': "main" if pid == self.__pid else 
+					"render worker %d" % pid}})
+			for ((pid, tid), tname) in threads.items():
+				events.append({'name': "thread_name", 'ph': "M", 'pid': pid,
+					'tid': tid, 'args': {'name': tname}})
+
+		with open(path, 'w') as trace_file:
+			json.dump({'traceEvents': events, 'displayTimeUnit': "ms"}, trace_file)
@@ -8,41 +8,61 @@
 """
 
 # =========================[ Imports ]==========================
+# Only cheap modules are imported here. tqdm, multiprocessing, webbrowser,
+# concurrent.futures and the parser/romanizer dependencies are imported where
+# they are used so that modes like -I and -C start quickly
 from timeit import default_timer as timer 	# Timer
-from collections import OrderedDict			# Ordered Dictionary
-from tqdm import tqdm						# Progress bar
-from pdb import set_trace					# Python debugger
-from urllib.request import Request, urlopen	# Fetch URL Requests
-from urllib.error import HTTPError 			# HTTP fetch errors
-from stat import S_IREAD, S_IRGRP, S_IROTH 	# Changing file permissions
-from concurrent.futures import ThreadPoolExecutor as PoolExec # Parallelization
 
 import sys, os, io, shutil			# System operations
-import multiprocessing as mp 		# General mp utilities
 import time 						# For sleeping thread between retries
+import queue 						# Hand-off between batch pipeline stages
+import collections 					# Queue of chapters not yet fetched
 
 import argparse as argp 			# Parse input arguments
 import re 							# Regex
 import json 						# JSON parsing
-import webbrowser					# Open translation HTMLs in browser
-import platform						# Used to determine Operating System
-import ssl 							# For certificate authentication
 
 # Internal dependencies
 import configdata			# Custom config data structure
 import htmlparser			# Custom html parsing class
 import htmlwriter			# Custom html writing class
+import dictmatcher			# Compiled dictionary matcher
 import cacheutils			# Utility class related to caching info
+import httpclient			# Pooled keep-alive HTTP client
+import pagecache			# On-disk cache of fetched pages
+import buildindex			# Record of what each chapter was built from
+import rawindex				# Full-text index over raw chapter lines
+import stagetimes			# Per chapter stage timing
+import ratelimit			# Per host request scheduling
+import batchjournal			# Journal of batch progress for resuming
+import rendermemo			# Memo of rendered lines
 
 # =========================[ Constants ]=========================
 # Maximum number of retries on translate and URL fetching
 MAX_TRIES = 5
 
+# Charset of pages that do not declare one, by series language
+LANG_CHARSETS = {
+	'JP': 'utf8',
+	'CN': 'gb18030'		# Superset of GBK/GB2312
+}
+
+# Characters of context printed on each side of a query hit
+QUERY_CONTEXT = 20
+# Number of chapters listed in the query frequency summary
+QUERY_TOP = 10
+
+# Default number of concurrent page fetches in batch mode
+FETCH_JOBS = 8
+# Chapters allowed in flight per render process beyond the ones being fetched
+PIPELINE_DEPTH = 2
+# Environment variable telling renderpreload.py the languages of a batch
+RENDER_LANGS_ENV = "WN_RENDER_LANGS"
+
 # File paths
 DICT_PATH = 		os.path.join("../dicts/")
 RAW_PATH = 			os.path.join("../raws/")
 TRANS_PATH = 		os.path.join("../trans/")
-TABLES_PATH = 		os.path.join("../tables/")
 LOG_PATH = 			os.path.join("../logs/")
 RESOURCE_PATH = 	os.path.join("../resources/")
 CONFIG_FILE_PATH = 	os.path.join("../user_config.json")
@@ -51,17 +71,40 @@ COMMON_DICT_PATH =  os.path.join("../dicts/common.dict")
 
 # Format of the divider for .dict file
 DIV = r' --> '
+# Format of a name entry in a .dict file
+NAME_PATTERN = re.compile(r"\s*@name\{(.+), (.+)\}.*")
 
 # =========================[  Globals  ]=========================
 config_data = None   # Global config data container initialized by initConfig
 html_parser = None 	 # Global specialized parser initialized by initHtmlParser
 series_dict = None   # Global series-specific dictionary initialized by initDict
+dict_artifacts = None # Compiled layer files of series_dict, init by initDict
 page_table  = None 	 # Global series-specific page table init by initPageTable
+build_index = None 	 # Global series-specific build index init by initBuildIndex
+raw_index   = None 	 # Global series-specific raw line index init by initRawIndex
+render_memo = None 	 # Global series-specific render memo init by initRenderMemo
+stage_report = None  # Global stage timing report of this run, init by main
+worker_contexts = None # Globals packages of a render process, init by initWorker
+render_ctx = None 	 # Start method of render processes, init by startRenderServer
+
+# Globals only used by the main process, left out when a package is sent to
+# a child process
+LOCAL_GLOBALS = ('build_index', 'raw_index', 'render_memo')
 
 # Simple package class to share globals w/ child processes
 class GlobalsPackage:
 	def packGlobal(self, var_name):
-		exec("setattr(self, \'%s\', %s)" % (var_name, var_name))
+		setattr(self, var_name, globals()[var_name])
+
+	def __getstate__(self):
+		state = {name: value for (name, value) in self.__dict__.items()
+			if name not in LOCAL_GLOBALS}
+		# Child processes load the dictionary from its compiled layer files
+		# instead, see initWorker
+		if state.get('dict_artifacts') is not None:
+			state['dict_version'] = state['series_dict'].version()
+			state['series_dict'] = None
+		return state
 
 
 #============================================================================
@@ -119,7 +162,6 @@ def initEssentialPaths(series):
 		------------------------------------------------------------------
 	"""
 	if not os.path.exists(DICT_PATH):	os.makedirs(DICT_PATH)
-	if not os.path.exists(TABLES_PATH):	os.makedirs(TABLES_PATH)
 	# Init raw directory for this series
 	if not os.path.exists(RAW_PATH):	os.makedirs(RAW_PATH)
 	if not os.path.exists(os.path.join(RAW_PATH, series)):
@@ -158,6 +200,49 @@ def initArgParser():
 		action="store_true",
 		help="Print user config information"
 		)
+	parser.add_argument('--offline',
+		action="store_true",
+		help="Render only from pages in the page cache, never use the network"
+		)
+	parser.add_argument('--ttl',
+		type=int,
+		default=0,
+		help="Seconds a cached page is reused without asking the host if it "
+		 + "changed [default=0, always revalidate]"
+		)
+	parser.add_argument('-f', '--fetch-jobs',
+		type=int,
+		default=FETCH_JOBS,
+		help="Number of concurrent page fetches when using -B/--batch or "
+		 + "-A/--catch-up "
+		 + "[default=%d]" % FETCH_JOBS
+		)
+	parser.add_argument('--resume',
+		action="store_true",
+		help="With -B/--batch, skip the chapters an earlier interrupted batch "
+		 + "of the series already wrote"
+		)
+	parser.add_argument('--profile',
+		metavar="FILE",
+		help="Write per chapter stage timings of this run to FILE as JSON"
+		)
+	parser.add_argument('--trace',
+		metavar="FILE",
+		help="Write a timeline of every chapter stage of this run to FILE in " +
+		"Chrome trace-event format (chrome://tracing or ui.perfetto.dev)"
+		)
+	parser.add_argument('--cprofile',
+		action="store_true",
+		help="With --profile, also cProfile parsing/rendering in every " +
+		"process and write the merged stats to FILE.pstats"
+		)
+	parser.add_argument('-j', '--jobs',
+		type=int,
+		default=None,
+		help="Number of parse/render processes when using -B/--batch or "
+		 + "-A/--catch-up "
+		 + "[default=number of CPUs]"
+		)
 
 	# Control flags are shortcuts that download the previous, current, or next 
 	# chapter for a series according to the current cache data. Only available
@@ -191,12 +276,28 @@ def initArgParser():
 		action="store_true",
 		help="Checks and caches the most recent chapter for all series"
 		)
+	mode_flags.add_argument('-Q', '--query',
+		metavar="TERM",
+		help="Lists every chapter and line of a series whose raw contains TERM"
+		)
+	mode_flags.add_argument('-S', '--stats',
+		action="store_true",
+		help="View statistics of the page cache"
+		)
 	mode_flags.add_argument('-B', '--batch',
 		action="store_true", 
 		help="Downloads and translates a batch of chapters")
+	mode_flags.add_argument('-A', '--catch-up',
+		action="store_true",
+		help="Downloads and translates every chapter past the current one of "
+		 + "every series, up to the latest found by -U/--update")
 	mode_flags.add_argument('-O', '--one',
 		action="store_true", 
 		help="Downloads and translates one chapter")
+	mode_flags.add_argument('-R', '--retranslate',
+		action="store_true", 
+		help="Re-renders only the chapters of a series affected by edits to "
+		 + "its dictionary since they were last rendered")
 
 	# Positional arguments
 	parser.add_argument('series', 
@@ -214,6 +315,8 @@ def initArgParser():
 	# Handle errors or address warnings
 	args = parser.parse_args()
 	initConfig(args.verbose or args.info)
+	pagecache.configure(args.offline, args.ttl, config_data.getPageCacheSize())
+	ratelimit.configure(config_data.getHostLimits())
 
 	# -O/--one parser constraints
 	if args.one:
@@ -244,6 +347,22 @@ def initArgParser():
 				+ "received both a 'start'\nand 'end' argument. Script will "
 				+ "ignore argument end=%d...." % args.end))
 
+	# -Q/--query parser constraints
+	if args.query is not None:
+		if args.series is None:
+			parser.error("For queries, the series arg is required")
+		if not config_data.seriesIsValid(args.series):
+			parser.error("The series '"+str(args.series)+"' does not exist in "
+				+ "the source code mapping")
+
+	# -R/--retranslate parser constraints
+	if args.retranslate:
+		if args.series is None:
+			parser.error("For retranslation, the series arg is required")
+		if not config_data.seriesIsValid(args.series):
+			parser.error("The series '"+str(args.series)+"' does not exist in "
+				+ "the source code mapping")
+
 	# -B/--batch parser constraints
 	if args.batch:
 		# Batch command w/out all 'series' 'start' and 'end' args is invalid
@@ -262,6 +381,12 @@ def initArgParser():
 		if not args.start < args.end:
 			parser.error("End chapter must be strictly greater than the start "
 				+ "chapter [start=%d, end=%d]" % (args.start, args.end))
+	elif args.resume:
+		parser.error("--resume is only available with -B/--batch")
+
+	# Pipeline needs at least one worker in each stage
+	if args.fetch_jobs < 1 or (args.jobs is not None and args.jobs < 1):
+		parser.error("Fetch and render job counts are a minimum of 1")
 
 	return parser
 
@@ -294,7 +419,9 @@ def initDict(series, common_opt):
 		------------------------------------------------------------------
 	"""
 	global series_dict
+	global dict_artifacts
 	global config_data
+	dict_artifacts = None
 	dict_name = series.lower() + ".dict"
 	dict_path = os.path.join(DICT_PATH, dict_name)
 
@@ -310,31 +437,28 @@ def initDict(series, common_opt):
 			dict_file.write(u'\n九尾の狐 --> Nine Tailed Fox')
 			dict_file.write("\n\n// END OF FILE")
 			dict_file.close()
-			series_dict = {}
+			series_dict = dictmatcher.DictMatcher([])
+			dict_artifacts = []
 		except Exception:
 			print("[Error] Error creating or modifying dict file [%s]" % dict_name)
 		return
 
-	# Parse the mappings into a list
+	# Each source is compiled into its own layer and cached under
+	# dicts/.compiled/, keyed by the contents of the source and honorifics.json
 	series_lang = config_data.getSeriesLang(series)
-	dict_list = []
+	layers = [] 	# (layer, compiled file path)
 
 	# First add standalone honorifics
-	with io.open(HONORIFICS_PATH, mode='r', encoding='utf8') as hon_file:
-		try:
-			honorifics = json.loads(hon_file.read())
-			for entry in honorifics[config_data.getSeriesLang(series)]:
-				if entry['standalone']:
-					dict_list.append((entry['h_raw'], entry['h_trans']))
-		except:
-			print("\n[Error] There seems to be a syntax issue with your "
-				+ "honorifics.json... Please correct it and try again")
-			sys.exit(1)
+	layers.append(cacheutils.loadCompiled("honorifics.%s" % series_lang,
+		[HONORIFICS_PATH], series_lang,
+		lambda: dictmatcher.DictLayer([(entry['h_raw'], entry['h_trans'])
+			for entry in loadHonorifics(series_lang) if entry['standalone']])
+	))
 
 	# Process common_dict if option is set
 	if common_opt:
 		try:
-			dict_list.extend(processDictFile(series_lang, COMMON_DICT_PATH))
+			layers.append(compileDictFile(series_lang, COMMON_DICT_PATH))
 		except Exception:
 			print("[Error] Error processing common.dict file. Make sure this file "
 				+ "exists or switch use_common_dict option in user_config to false")
@@ -342,22 +466,28 @@ def initDict(series, common_opt):
 
 	# Process series specific dict
 	try:
-		dict_list.extend(processDictFile(series_lang, dict_path))
+		layers.append(compileDictFile(series_lang, dict_path))
 	except Exception:
 		print("[Error] Error opening dictionary file [%s]" % dict_name)
 		sys.exit(1)
 
-	# Initialize the global. Need to sort such that longer strings are processed
-	# before the shorter ones so sort by length of the Chinese string
-	dict_list.sort(key= lambda x: len(x[0]), reverse=True)
-	series_dict = OrderedDict(dict_list)
+	# Initialize the global. Series entries override common entries which
+	# override standalone honorifics. The version is computed here so child
+	# processes receive it instead of each hashing the dictionary again
+	series_dict = dictmatcher.DictMatcher([layer for (layer, path) in layers])
+	series_dict.version()
+	paths = [path for (layer, path) in layers]
+	dict_artifacts = paths if None not in paths else None
 
-def initPageTable(series):
+def initPageTable(series, ch_last=None):
 	"""-------------------------------------------------------------------
 		Function:		[initPageTable]
-		Description:	Initializes the page table global for given series
+		Description:	Initializes the page table global for given series,
+						syncing it with the series index first if it does
+						not reach the last chapter needed
 		Input:			
 		  [series]		The series to build the page table for
+		  [ch_last]		The last chapter this run needs, if known
 		Return: 		None, initializes a global page_table
 		PRECONDITION:	initHtmlParser() has been invoked before this call
 		------------------------------------------------------------------
@@ -366,40 +496,129 @@ def initPageTable(series):
 	global html_parser
 	global config_data
 
-	table_name = "%s.table" % series.lower()
-	series_table = os.path.join(TABLES_PATH, table_name)
-	
 	# If table is marked as not needed for this parser, skip this function
+	page_table = None
 	if not html_parser.needsPageTable():
 		return
-	# If .table DNE for this series, parse it from web and write one
-	elif not os.path.exists(series_table) or os.path.getsize(series_table) == 0:
-		set_trace()
-		print("No table file exists for this series... Creating a new table")
-		series_index_url = getSeriesUrl(series)
-		series_index_html = fetchHTML(series_index_url, config_data.getSeriesLang(series))
-		page_table = html_parser.parsePageTableFromWeb(series_index_html)
-
-		# Save to .table file
-		try:
-			table_file = io.open(series_table, mode='w', encoding='utf8')
-			for entry in page_table:
-				table_file.write(entry + u'\n')
-			table_file.close()
-		except Exception:
-			print("[Error] Error creating or modifying table file [%s]" % table_name)
 
-		# Mark file as readonly
-		os.chmod(series_table, S_IREAD|S_IRGRP|S_IROTH)
-	# If .table already exists for this series, just read that in
-	else:
-		try:
-			table_file = io.open(series_table, mode='r', encoding='utf8')
-			page_table = []
-			for line in table_file:
-				if line != u'\n':	page_table.append(line[:-1])
-		except Exception:
-			print("[Error] Error reading existing series table file [%s]" % table_name)
+	page_table = cacheutils.readPageTable(series)
+	if page_table is not None and (ch_last is None or ch_last <= len(page_table)):
+		return
+
+	# Stored table is missing or too short, sync it with the series index
+	if page_table is None:
+		print("No table exists for this series... Creating a new table")
+	series_index_html = fetchHTML(getSeriesUrl(series), 
+		config_data.getSeriesLang(series), max_age=0)
+	if series_index_html is not None:
+		web_table = html_parser.parsePageTableFromWeb(series_index_html)
+		if syncPageTable(series, web_table):
+			page_table = web_table
+	if page_table is not None and ch_last is not None and ch_last > len(page_table):
+		print("[Warning] The index of %s only lists %d chapters" % 
+			(series, len(page_table)))
+
+def initBuildIndex(series):
+	"""-------------------------------------------------------------------
+		Function:		[initBuildIndex]
+		Description:	Loads the build index of the given series
+		Input:			
+		  [series]		The series to load the build index for
+		Return: 		None, initializes a global build_index
+		------------------------------------------------------------------
+	"""
+	global build_index
+	build_index = buildindex.BuildIndex(series)
+
+def initRawIndex(series):
+	"""-------------------------------------------------------------------
+		Function:		[initRawIndex]
+		Description:	Opens the raw line index of the given series
+		Input:			
+		  [series]		The series to open the raw index for
+		Return: 		None, initializes a global raw_index
+		------------------------------------------------------------------
+	"""
+	global raw_index
+	raw_index = rawindex.RawIndex(series)
+
+def initRenderMemo(series):
+	"""-------------------------------------------------------------------
+		Function:		[initRenderMemo]
+		Description:	Opens the memo of rendered lines of the given series
+		Input:			
+		  [series]		The series to open the render memo for
+		Return: 		None, initializes a global render_memo
+		------------------------------------------------------------------
+	"""
+	global render_memo
+	global config_data
+	render_memo = rendermemo.RenderMemo(series, config_data.getRenderCacheSize())
+
+def initSeries(series, ch_last=None):
+	"""-------------------------------------------------------------------
+		Function:		[initSeries]
+		Description:	Initializes every series-specific global for the 
+						given series and packages them
+		Input:			
+		  [series]		The series to initialize
+		  [ch_last]		The last chapter this run needs, if known
+		Return: 		Globals package of the series
+		------------------------------------------------------------------
+	"""
+	global config_data
+
+	# Create subdirectories if they don't already exist
+	initEssentialPaths(series)
+	# Initialize the HTML parser corresponding to the host of this series
+	initHtmlParser(config_data.getSeriesHost(series))
+	# Initialize the series page table according to series host
+	initPageTable(series, ch_last)
+	# Initialize series dictionary
+	initDict(series, config_data.getUseCommonDictOpt())
+	# Initialize record of previously rendered chapters
+	initBuildIndex(series)
+	# Initialize raw line index of this series
+	initRawIndex(series)
+	# Initialize memo of rendered lines of this series
+	initRenderMemo(series)
+
+	# Package the finished globals as a Python equivalent of a C-struct
+	globals_pkg = GlobalsPackage()
+	globals_pkg.packGlobal("config_data")
+	globals_pkg.packGlobal("html_parser")
+	globals_pkg.packGlobal("series_dict")
+	globals_pkg.packGlobal("dict_artifacts")
+	globals_pkg.packGlobal("page_table")
+	globals_pkg.packGlobal("build_index")
+	globals_pkg.packGlobal("raw_index")
+	globals_pkg.packGlobal("render_memo")
+	return globals_pkg
+
+def initWorker(contexts, langs):
+	"""-------------------------------------------------------------------
+		Function:		[initWorker]
+		Description:	Installs the globals of every series in a render
+						process once, when the process starts. Processes
+						forked from this one share its copy. Those started
+						from a forkserver or spawned receive the packages
+						pickled once, without the compiled dictionaries,
+						and load those from their files in dicts/.compiled/
+		Input:			
+		  [contexts]	Dict of series to its globals package
+		  [langs]		Languages of the series, see htmlwriter.warmUp
+		Return: 		None, initializes a global worker_contexts
+		------------------------------------------------------------------
+	"""
+	global worker_contexts
+	for globals_pkg in contexts.values():
+		if globals_pkg.series_dict is None:
+			globals_pkg.series_dict = dictmatcher.DictMatcher(
+				[cacheutils.readCompiled(path) for path in globals_pkg.dict_artifacts],
+				globals_pkg.dict_version)
+	worker_contexts = contexts
+	# Already built unless the process was spawned
+	htmlwriter.warmUp(langs)
 
 #============================================================================
 #  General utility functions
@@ -486,17 +705,99 @@ def handleClean():
 
 	return 
 
+def loadHonorifics(lang):
+	"""-------------------------------------------------------------------
+		Function:		[loadHonorifics]
+		Description:	Reads the honorifics.json entries for a language
+		Input:
+		  [lang] 		The language of the raw 'CN' or 'JP'
+		Return:			List of honorific entries as dicts with 'standalone',
+						'h_raw' and 'h_trans' keys
+		------------------------------------------------------------------
+	"""
+	with io.open(HONORIFICS_PATH, mode='r', encoding='utf8') as hon_file:
+		try:
+			return json.loads(hon_file.read())[lang]
+		except:
+			print("\n[Error] There seems to be a syntax issue with your "
+				+ "honorifics.json... Please correct it and try again")
+			sys.exit(1)
+
+def compileDictFile(series_lang, dict_path):
+	"""-------------------------------------------------------------------
+		Function:		[compileDictFile]
+		Description:	Loads the compiled dictionary layer of a .dict file,
+						reprocessing the file only if it or honorifics.json
+						changed since it was last compiled
+		Input:
+		  [series_lang]	Series language
+		  [dict_path]	Path to the dictionary file
+		Return:			(the compiled DictLayer, path of its compiled file or
+						None if it could not be stored)
+		------------------------------------------------------------------
+	"""
+	def compileLayer():
+		(entries, names) = processDictFile(series_lang, dict_path)
+		# Every honorific can follow a name, standalone or not
+		suffixes = [(entry['h_raw'], entry['h_trans']) 
+			for entry in loadHonorifics(series_lang)]
+		return dictmatcher.DictLayer(entries, names, suffixes)
+
+	name = "%s.%s" % (os.path.basename(dict_path), series_lang)
+	return cacheutils.loadCompiled(name, [dict_path, HONORIFICS_PATH],
+		series_lang, compileLayer)
+
+def handleQuery(series, term):
+	"""-------------------------------------------------------------------
+		Function:		[handleQuery]
+		Description:	Prints every raw line of a series containing a term
+						along with frequency counts
+		Input:
+		  [series]		The series to search
+		  [term]		The raw term to look up
+		Return:			None
+		------------------------------------------------------------------
+	"""
+	start = timer()
+	index = rawindex.RawIndex(series)
+	hits = index.query(term)
+	elapsed = timer() - start
+
+	# Count occurrences per chapter
+	ch_counts = {}
+	for (ch, line_num, text) in hits:
+		ch_counts[ch] = ch_counts.get(ch, 0) + text.count(term)
+
+	for (ch, line_num, text) in hits:
+		pos = text.find(term)
+		lo = max(pos - QUERY_CONTEXT, 0)
+		hi = min(pos + len(term) + QUERY_CONTEXT, len(text))
+		context = ("..." if lo > 0 else "") + text[lo:hi] + \
+			("..." if hi < len(text) else "")
+		print("  Ch %-5d L%-5d: %s" % (ch, line_num, context))
+
+	print("\n'%s' occurs %d times on %d lines in %d of %d indexed chapters "
+		% (term, sum(ch_counts.values()), len(hits), len(ch_counts), 
+		index.getNumChapters()) + "[%.1f ms]" % (elapsed * 1000))
+	top = sorted(ch_counts.items(), key=lambda x: (-x[1], x[0]))[:QUERY_TOP]
+	if len(top) > 0:
+		print("  Most frequent in: " + ", ".join("ch %d (%d)" % x for x in top))
+	index.close()
+
 def processDictFile(series_lang, dict_path):
 	"""-------------------------------------------------------------------
 		Function:		[processDictFile]
-		Description:	Opens a given chapter in select browser
+		Description:	Parses a .dict file into its dictionary entries
 		Input:
 		  [series_lang]	Series language
 		  [dict_path]	Path to the dictionary file
-		Return:			N/A
+		Return:			(list of (raw, translation) pairs in file order, 
+						list of the (raw, translation) pairs of @name
+						entries). Names are also listed among the entries
 		------------------------------------------------------------------
 	"""
 	dict_list = []
+	name_list = []
 
 	with io.open(dict_path, mode='r', encoding='utf8') as dict_file:
 		for line in dict_file:
@@ -504,17 +805,13 @@ def processDictFile(series_lang, dict_path):
 			line = line[:-1]	# Ignore newline '\n' at the end of the line
 
 			# Skip comment lines and unformatted/misformatted lines
-			name_pattern = re.compile(r"\s*@name\{(.+), (.+)\}.*")
-			name_match = name_pattern.fullmatch(line)
+			name_match = NAME_PATTERN.fullmatch(line)
 			if line[0:2] == "//" or len(line) == 0 or line.isspace():
 				continue
 			elif name_match is not None:
-				variants = generateNameVariants(
-					name_match[1].strip(), 
-					name_match[2].strip(), 
-					series_lang)
-				for variant in variants:
-					dict_list.append(variant)
+				name = (name_match[1].strip(), name_match[2].strip())
+				dict_list.append(name)
+				name_list.append(name)
 			else:
 				if DIV not in line:
 					fname = os.path.basename(dict_path)
@@ -531,7 +828,7 @@ def processDictFile(series_lang, dict_path):
 				dict_list.append((raw_div[0].strip(), trans_div[0].strip()))
 
 	print("\n")
-	return dict_list
+	return (dict_list, name_list)
 
 def openBrowser(series, ch):
 	"""-------------------------------------------------------------------
@@ -550,6 +847,8 @@ def openBrowser(series, ch):
 		print("No preferred browser detected. Please open translation files "
 			+ "manually or input a path for chrome.exe file in user_config.json")
 	else:
+		import webbrowser		# Open translation HTMLs in browser
+		import platform			# Used to determine Operating System
 		path_trans = os.path.join(TRANS_PATH, series, "t%s_%d.html" % (series, ch))
 		try:
 			if platform.system() == "Darwin":
@@ -566,33 +865,6 @@ def openBrowser(series, ch):
 		except Exception:
 			print("\n[Error] Cannot open Google Chrome [%s]. Skipping" % chrome_path)
 
-def generateNameVariants(rName, tName, lang):
-	"""-------------------------------------------------------------------
-		Function:		[generateNameVariants]
-		Description:	Generates all variants of rName --> tName dictionary
-						entries using the honorifics indicated in honorifics.json
-		Input:
-		  [rName]		The raw name dict entry
-		  [tName]		The translated name dict entry
-		  [lang] 		The language of the raw 'CN' or 'JP'
-		Return:			List of pairs of raw name variants to translated name 
-						variants
-		------------------------------------------------------------------
-	"""
-	res = [(rName, tName)]
-	with io.open(HONORIFICS_PATH, mode='r', encoding='utf8') as hon_file:
-		try:
-			honorifics = json.loads(hon_file.read())
-			for entry in honorifics[lang]:
-				variant = (rName+entry['h_raw'], tName+"-"+entry['h_trans'])
-				res.append(variant)
-		except:
-			print("\n[Error] There seems to be a syntax issue with your "
-				+ "honorifics.json... Please correct it and try again")
-			sys.exit(1)
-
-	return res
-
 def handleUpdate():
 	start = timer()
 	global config_data
@@ -602,19 +874,28 @@ def handleUpdate():
 	args = ((getSeriesUrl(s), config_data.getSeriesLang(s)) for s in series)
 
 	print("Updating series cache data...")
+	from concurrent.futures import ThreadPoolExecutor as PoolExec 	# Parallelization
+	from tqdm import tqdm 		# Progress bar
+	updates = []
 	with PoolExec(max_workers=10) as pexec:
 		index = 0
-		l_series = config_data.getSeries().keys()
-		for response in tqdm(pexec.map(lambda x: fetchHTML(*x), args), total=n):
+		# Index pages change often so always revalidate them
+		fetch = lambda x: fetchHTML(*x, max_age=0)
+		for response in tqdm(pexec.map(fetch, args), total=n):
 			s = series[index]
 			if response is not None:
 				parser = htmlparser.createParser(config_data.getSeriesHost(s))
-				latest = parser.getLatestChapter(response)
-				cacheutils.writeCacheData(series=s, l_series=l_series, ch_max=latest)
+				(latest, table) = parser.parseIndex(response)
+				updates.append((s, 0, latest))
+				if table is not None:
+					syncPageTable(s, table)
 			else:
 				print("[Error] Unable to fetch updates for \'%s\'" % s)
 			index += 1
 
+	# Commit every series in one transaction
+	cacheutils.writeCacheData(updates, checked=True)
+
 	# Display to the user
 	configdata.ConfigData(CONFIG_FILE_PATH, True)
 
@@ -628,6 +909,54 @@ def handleUpdate():
 		print("  Elapsed Time: %.2f sec" % elapsed)
 
 
+def syncPageTable(series, web_table):
+	"""-------------------------------------------------------------------
+		Function:		[syncPageTable]
+		Description:	Updates the stored page table of a series with one
+						parsed from its index and reports what changed
+		Input:
+		  [series]		The series the page table belongs to
+		  [web_table]	List of chapter codes parsed from the series index
+		Return:			True if the stored table now matches web_table,
+						False otherwise
+		------------------------------------------------------------------
+	"""
+	global config_data
+	if len(web_table) == 0:
+		print("[Error] No chapters found in the index of \'%s\'. Keeping " % series
+			+ "its stored page table")
+		return False
+	try:
+		(added, changed) = cacheutils.syncPageTable(series, web_table)
+	except Exception:
+		print("[Error] Error storing page table of series [%s]" % series)
+		return False
+
+	if changed is not None:
+		print("[Warning] The index of \'%s\' changed from chapter %d on. " % 
+			(series, changed + 1) + "Chapters after it may need redownloading")
+	elif added > 0:
+		config_data.vprint("  Page table of %s: %d new chapters" % (series, added))
+	return True
+
+def catchUpWork():
+	"""-------------------------------------------------------------------
+		Function:		[catchUpWork]
+		Description:	Lists the chapters every series is behind by 
+						according to the cache data
+		Input:			None
+		Return:			List of (series, chapter number) past the current
+						chapter up to the latest chapter of each series
+		------------------------------------------------------------------
+	"""
+	global config_data
+	work = []
+	for series in config_data.getSeries():
+		ch_curr = config_data.getSeriesCurrChapter(series)
+		ch_max = config_data.getSeriesMaxChapter(series)
+		work.extend((series, ch) for ch in range(ch_curr + 1, ch_max + 1))
+	return work
+
 #============================================================================
 #  Web scraping functions
 #============================================================================
@@ -662,12 +991,15 @@ def getChapterUrl(series, ch, globals_pkg):
 		  [ch]			The chapter to build url for
 		  [globals_pkg]	Globals package
 		Return: 		The full URL of the page containing chapter [ch] of
-						[series] or just the series index URL if ch is None
+						[series] or None if the page table of [series] does
+						not reach [ch]
 		------------------------------------------------------------------
 	"""
 	# Unpack the needed globals
 	config_data = globals_pkg.config_data
 	page_table = globals_pkg.page_table
+	if page_table is not None and int(ch) > len(page_table):
+		return None
 
 	# Build the url for this chapter
 	base_url = config_data.getHostUrl(config_data.getSeriesHost(series))
@@ -677,54 +1009,108 @@ def getChapterUrl(series, ch, globals_pkg):
 
 	return series_url
 
-def fetchHTML(url, lang):
+def fetchPage(url, lang, max_age=None, chapter=None):
 	"""-------------------------------------------------------------------
-		Function:		[fetchHTML]
+		Function:		[fetchPage]
 		Description:	Tries to prompt a response url and return the received
-						HTML content as a UTF-8 decoded string
+						page undecoded along with its charset. Responses are
+						kept in the page cache and revalidated on later calls
 		Input:			
 		  [url]			The url to make the request to
-		  [lang]		The page's language, determines decoding scheme
-		Return: 		The HTML content of the given website address
+		  [lang]		The page's language, determines the charset when the
+		  				page does not declare one
+		  [max_age]		Seconds a cached copy is used without revalidating,
+		  				the --ttl option if None
+		  [chapter]		(series, chapter number) the page is fetched for,
+		  				recorded on retry spans. None for other pages
+		Return: 		(page bytes, charset) of the given website address or
+						None if it could not be fetched
 		------------------------------------------------------------------
 	"""
+	source = None
+	content_type = None
+	entry = pagecache.lookup(url)
+	if entry is not None and (pagecache.isOffline() or 
+		pagecache.isFresh(entry, max_age)):
+		source = pagecache.readBody(entry)
+		content_type = entry.get('content_type')
+	if source is None and pagecache.isOffline():
+		print("\n[Error] <%s> is not in the page cache and --offline is set" % url)
+		return None
+
 	tries = 0
-	while True:
+	throttles = 0
+	while source is None:
 		try:
-			headers = { 'User-Agent' : 'Mozilla/5.0' }
-			request = Request(url, None, headers)
-			response = urlopen(request, context=ssl._create_unverified_context())
-			break
-		# Page not found
-		except HTTPError as e:
-			if e.code == 404:
-				print("\n[Error] URL not found. Is the following page real?: " + 
-					url)
-				sys.exit(1)
+			# Waits for the host's turn, see ratelimit.py
+			with ratelimit.request(url):
+				response = httpclient.getClient().get(url, 
+					pagecache.conditionalHeaders(entry))
+			if response.status == 304 and entry is not None:
+				source = pagecache.readBody(entry, True, response.headers)
+				content_type = entry.get('content_type')
+				# Cached object vanished, ask for the full page again
+				if source is None:	entry = None
+			else:
+				source = response.read()
+				content_type = response.headers.get('Content-Type')
+				pagecache.store(url, source, response.headers)
 		# Some error has occurred
 		except Exception as e:
+			# Page not found, asking again would not find it either. Callers
+			# decide whether that ends the run
+			if isinstance(e, httpclient.HttpError) and e.code == 404:
+				print("\n[Error] URL not found. Is the following page real?: " + 
+					url)
+				return None
+			# Redirect loop, asking again would only loop again
+			if isinstance(e, httpclient.RedirectError):
+				print("\n[Error] Too many redirects from <%s>" % url)
+				return None
+			# Host asked to slow down, the limiter already paused it
+			if ratelimit.isThrottle(e):
+				throttles += 1
+				if throttles < ratelimit.MAX_THROTTLES:
+					continue
+				print("\n[Error] <%s> is still throttled after " % url
+					+ "%d tries" % throttles)
+				return None
 			tries += 1
 			print("\n[Error] Could not get response from <%s>... Retrying " % url
 				+ "[tries=%s]" % tries)
-			time.sleep(2)
+			wait_start = stagetimes.clock()
+			time.sleep(ratelimit.backoff(tries))
+			stagetimes.span('retry_wait', chapter, wait_start)
 		
 		if tries == MAX_TRIES:
 			print("\n[Error] Max tries reached. No response from <%s>. " % url
 				+ "Make sure this URL exists")
 			return None
 
-	# Read and decode the response according to series language
-	source = response.read()
-	if lang == "JP":
-		data = source.decode('utf8')
-	elif lang == "CN":
-		data = source.decode('gbk')
-	else:
+	# Charset declared by the page, otherwise the series language default
+	if lang not in LANG_CHARSETS:
 		print("Unrecognized language option: \'%s\'" % lang)
 		print("Defaulting to deciding as UTF8")
-		data = source.decode('utf8')
+	default = LANG_CHARSETS.get(lang, 'utf8')
+	return (source, htmlparser.detectCharset(source, content_type, default))
 
-	return data
+def fetchHTML(url, lang, max_age=None):
+	"""-------------------------------------------------------------------
+		Function:		[fetchHTML]
+		Description:	Fetches a page like fetchPage and decodes it
+		Input:			
+		  [url]			The url to make the request to
+		  [lang]		The page's language, determines decoding scheme
+		  [max_age]		Seconds a cached copy is used without revalidating,
+		  				the --ttl option if None
+		Return: 		The HTML content of the given website address
+		------------------------------------------------------------------
+	"""
+	page = fetchPage(url, lang, max_age)
+	if page is None:
+		return None
+	(source, charset) = page
+	return source.decode(charset, 'replace')
 
 #============================================================================
 #  Writer functions
@@ -762,23 +1148,17 @@ def writeRaw(series, ch, content):
 	raw_file.close()
 	return 0
 
-def writeTrans(series, ch, content, globals_pkg, dev_opt=False):
+def openTransFiles(series, ch):
 	"""-------------------------------------------------------------------
-		Function:		[writeTrans]
-		Description:	Write translations to trans file
+		Function:		[openTransFiles]
+		Description:	Opens the trans and log files of a chapter
 		Input:
-		  [series]		The series to write translation for
-		  [ch]			The chapter number to write translation for
-		  [content] 	The content to write as fetched from html_parser
-		  [globals_pkg]	Globals package
-		  [dev_opt] 	Write developer version HTML?
-		Return:			N/A
+		  [series]		The series to open files for
+		  [ch]			The chapter number to open files for
+		Return:			(trans_file, log_file) or (None, None) if the trans
+						file could not be opened
 		------------------------------------------------------------------
 	"""
-	# Unpack necessary globals
-	series_dict = globals_pkg.series_dict
-	config_data = globals_pkg.config_data
-
 	# Initialize trans_file
 	try:
 		trans_name = "t%s_%d.html" % (series, ch)
@@ -789,7 +1169,7 @@ def writeTrans(series, ch, content, globals_pkg, dev_opt=False):
 	except Exception:
 		print(("[Error] Error opening translation file [%s]" % trans_name))
 		print("Exiting...")
-		return 1
+		return (None, None)
 
 	# Open log file
 	try:
@@ -803,10 +1183,35 @@ def writeTrans(series, ch, content, globals_pkg, dev_opt=False):
 		print("Proceeding without logs")
 		log_file = open(os.devnull, 'w')
 
+	return (trans_file, log_file)
+
+def renderTrans(series, ch, content, globals_pkg, trans_file, log_file, 
+	dev_opt=False, progress=False, memo=None):
+	"""-------------------------------------------------------------------
+		Function:		[renderTrans]
+		Description:	Renders the translation HTML of a chapter into the 
+						given file handles
+		Input:
+		  [series]		The series to render translation for
+		  [ch]			The chapter number to render translation for
+		  [content] 	The content to render as fetched from html_parser
+		  [globals_pkg]	Globals package
+		  [trans_file]	Writable handle the HTML is streamed into
+		  [log_file]	Writable handle translation logs are written to
+		  [dev_opt] 	Render developer version HTML?
+		  [progress]	Show a per-line progress bar?
+		  [memo]		ChapterMemo to reuse rendered lines from, if any
+		Return:			Set of dictionary entries matched in the chapter
+		------------------------------------------------------------------
+	"""
+	# Unpack necessary globals
+	series_dict = globals_pkg.series_dict
+	config_data = globals_pkg.config_data
+
 	# Initialize HTML Writer
 	skeleton_path = RESOURCE_PATH + "skeleton.html"
 	html_writer = htmlwriter.HtmlWriter(series_dict, log_file, skeleton_path,
-		dev_opt)
+		dev_opt, memo)
 	html_writer.setPageTitle(series, ch)
 	html_writer.setChapterTitle(config_data.getSeriesTitle(series))
 	html_writer.setSeriesLink(getSeriesUrl(series, globals_pkg))
@@ -815,7 +1220,12 @@ def writeTrans(series, ch, content, globals_pkg, dev_opt=False):
 
 	# Build the processed translation HTML
 	line_num = 0
-	for line in tqdm(content, total=len(content)):
+	if progress:
+		from tqdm import tqdm 	# Progress bar
+		lines = tqdm(content, total=len(content))
+	else:
+		lines = content
+	for line in lines:
 		line_num += 1
 		# Skip blank lines
 		if not re.fullmatch(r'\s*\n', line[1]):
@@ -823,9 +1233,34 @@ def writeTrans(series, ch, content, globals_pkg, dev_opt=False):
 			log_file.write("\n[L%d] Processing non-blank line..." % line_num)
 			html_writer.insertLine(line, config_data.getSeriesLang(series))
 
-	# Write the HTML to trans file
-	resource_string = html_writer.getResourceString()
-	trans_file.write(resource_string)
+	# Stream the finished HTML into the trans file
+	html_writer.writeTo(trans_file)
+
+	if config_data.getSeriesLang(series) == "JP":
+		roma_info = htmlwriter.romanize.cache_info()
+		config_data.vprint("  Romanization cache: %d hits, %d misses (%d/%d lines)"
+			% (roma_info.hits, roma_info.misses, roma_info.currsize, roma_info.maxsize))
+
+	return html_writer.getMatchedEntries()
+
+def writeRendered(series, ch, trans_html, log_text):
+	"""-------------------------------------------------------------------
+		Function:		[writeRendered]
+		Description:	Write an already rendered translation and its logs
+		Input:
+		  [series]		The series to write translation for
+		  [ch]			The chapter number to write translation for
+		  [trans_html]	The rendered translation HTML
+		  [log_text]	The translation logs produced while rendering
+		Return:			0 upon success, 1 otherwise
+		------------------------------------------------------------------
+	"""
+	(trans_file, log_file) = openTransFiles(series, ch)
+	if trans_file is None:
+		return 1
+
+	trans_file.write(trans_html)
+	log_file.write(log_text)
 
 	# Close all files file
 	print(("Downtrans [t%s_%s.html] complete!" % (series, ch)))
@@ -834,41 +1269,409 @@ def writeTrans(series, ch, content, globals_pkg, dev_opt=False):
 	return 0
 
 # =========================[ Script ]=========================
-def batch_procedure(series, ch_queue, globals_pkg, dev_opt):
+def renderLangs(l_series):
+	global config_data
+	return sorted(set(config_data.getSeriesLang(series) for series in l_series))
+
+def startRenderServer(l_series):
+	"""-------------------------------------------------------------------
+		Function:		[startRenderServer]
+		Description:	Picks how the render processes of a batch start and
+						builds the parser and kakasi state they need before
+						they do. Where the platform forks by default, it is
+						built in this process and every render process
+						inherits it. Elsewhere render processes are forked
+						from a forkserver that runs renderpreload.py once,
+						started here so it warms up while the series are
+						initialized. Without a forkserver each spawned
+						process builds it in initWorker
+		Input:
+		  [l_series]	The series whose chapters will be rendered
+		Return:			multiprocessing context of the render pool
+		------------------------------------------------------------------
+	"""
+	global render_ctx
+	import multiprocessing as mp 		# General mp utilities
+	if render_ctx is not None:
+		return render_ctx
+	langs = renderLangs(l_series)
+	if mp.get_start_method() == 'fork':
+		htmlwriter.warmUp(langs)
+		render_ctx = mp.get_context('fork')
+		return render_ctx
+	if 'forkserver' not in mp.get_all_start_methods():
+		render_ctx = mp.get_context()
+		return render_ctx
+
+	os.environ[RENDER_LANGS_ENV] = ",".join(langs)
+	render_ctx = mp.get_context('forkserver')
+	# Preload this script by module name as well, the forkserver may not be
+	# able to preload __main__
+	script = os.path.splitext(os.path.basename(__file__))[0]
+	render_ctx.set_forkserver_preload(['__main__', script, 'renderpreload'])
+	from multiprocessing import forkserver
+	forkserver.ensure_running()
+	return render_ctx
+
+def batch_procedure(work, contexts, dev_opt, fetch_jobs=FETCH_JOBS, 
+	cpu_jobs=None, profile=False, trace=False, journals=None):
 	"""-------------------------------------------------------------------
 		Function:		[batch_procedure]
-		Description:	Does the default procedure on each chapter in the list
-						of [chapters]
+		Description:	Downtranses each chapter in [work] through a three
+						stage pipeline: a thread pool fetches pages, a 
+						process pool parses and renders them and this process
+						writes the results to disk. Fetches are spread over
+						the hosts of the work so one slow host does not
+						stall the others
 		Input:
-		  [series]	 	The series for which to downtrans chapter
-		  [ch_queue] 	The list of chapter numbers to downtrans
-		  [globals_pkg]	Globals package
+		  [work]	 	List of (series, chapter number) to downtrans
+		  [contexts]	Dict of every series in [work] to its globals package
 		  [dev_opt]		Write developer version HTML?
-		Return:			N/A
+		  [fetch_jobs]	Number of concurrent page fetches
+		  [cpu_jobs]	Number of parse/render processes, cpu_count() if None
+		  [profile]		cProfile the parse and render of every chapter?
+		  [trace]		Record timeline spans of every stage?
+		  [journals]	Dict of series to the BatchJournal to record chapter
+		  				progress in, if any
+		Return:			Dict of (series, chapter number) to 0 upon success,
+						non-0 otherwise
 		------------------------------------------------------------------
 	"""
-	print(("Downtransing %s chapters: %s" % (series, str(ch_queue))))
+	from concurrent.futures import ThreadPoolExecutor as PoolExec
+	from concurrent.futures import ProcessPoolExecutor as ProcessPoolExec
+	from tqdm import tqdm 				# Progress bar
+	import multiprocessing as mp 		# General mp utilities
+
+	journals = journals if journals is not None else {}
+	cpu_jobs = cpu_jobs if cpu_jobs is not None else mp.cpu_count()
+	for series in contexts:
+		print(("Downtransing %s chapters: %s" % (series, 
+			str([ch for (s, ch) in work if s == series]))))
+	print("Using %d fetch threads and %d render processes" % (fetch_jobs, cpu_jobs))
 	print("This may take a minute or two...")
 
-	# Multiprocess queue of chapters requested
-	pool = mp.Pool(processes=mp.cpu_count())
-	args = [(series, ch, globals_pkg, dev_opt) for ch in ch_queue]
-
-	results = pool.imap_unordered(_default_procedure, args)
-	pool.close()
-	pool.join()
+	# Chapters between the start of their fetch and the end of their write.
+	# Bounding this bounds the pages and renders held in memory at once
+	max_inflight = fetch_jobs + PIPELINE_DEPTH * cpu_jobs
+	finished = queue.Queue()
+	ret_codes = {}
+
+	# Queue the work of each host separately, in the order given
+	hosts = {series: globals_pkg.config_data.getSeriesHost(series) 
+		for (series, globals_pkg) in contexts.items()}
+	pending = collections.OrderedDict()
+	for (series, ch) in work:
+		pending.setdefault(hosts[series], collections.deque()).append((series, ch))
+	host_inflight = dict.fromkeys(pending, 0)
+
+	# Render processes get the globals of every series once when they start,
+	# each task only carries its chapter
+	with PoolExec(max_workers=fetch_jobs) as fetch_pool, \
+		ProcessPoolExec(max_workers=cpu_jobs, mp_context=startRenderServer(contexts),
+		initializer=initWorker, initargs=(contexts, renderLangs(contexts))) \
+		as render_pool:
+
+		def fetch_stage(series, ch):
+			globals_pkg = contexts[series]
+			journal = journals.get(series)
+			try:
+				page = fetchChapter(series, ch, globals_pkg)
+				if page is not None:
+					if journal is not None:
+						journal.record(ch, batchjournal.FETCHED, 
+							batchjournal.hashData(page[0]))
+					render = render_pool.submit(render_task, series, ch, page, 
+						dev_opt, profile, trace)
+			except Exception:
+				page = None
+			# The writer waits on every chapter, so a chapter that never
+			# reaches the render pool must still be reported to it
+			if page is None:
+				if journal is not None:
+					journal.record(ch, batchjournal.FAILED)
+				finished.put((series, ch, None))
+				return
+			render.add_done_callback(
+				lambda future: finished.put((series, ch, future)))
+
+		inflight = 0
+		with tqdm(total=len(work)) as progress_bar:
+			while pending or inflight > 0:
+				# Keep the fetch stage fed up to the in-flight limit, always
+				# from the host with the fewest chapters in the pipeline
+				while pending and inflight < max_inflight:
+					host = min(pending, key=lambda h: host_inflight[h])
+					(series, ch) = pending[host].popleft()
+					pending.move_to_end(host)
+					if len(pending[host]) == 0:
+						del pending[host]
+					fetch_pool.submit(fetch_stage, series, ch)
+					host_inflight[host] += 1
+					inflight += 1
+
+				# Writer stage, in order of render completion
+				(series, ch, render) = finished.get()
+				host_inflight[hosts[series]] -= 1
+				inflight -= 1
+				progress_bar.update(1)
+				journal = journals.get(series)
+				if render is None:
+					# Fetch failed, already journaled by the fetch stage
+					ret_codes[(series, ch)] = 1
+					continue
+				try:
+					rendered = render.result()
+				except Exception:
+					ret_codes[(series, ch)] = 1
+					if journal is not None:
+						journal.record(ch, batchjournal.FAILED)
+					continue
+				if journal is not None:
+					output_hash = batchjournal.hashData(rendered[2])
+					journal.record(ch, batchjournal.RENDERED, output_hash)
+				ret = write_stage(series, ch, rendered, contexts[series])
+				ret_codes[(series, ch)] = ret
+				if journal is not None:
+					journal.record(ch, batchjournal.WRITTEN if ret == 0
+						else batchjournal.FAILED, output_hash)
 
 	print("\nError Report (Consider redownloading erroneous chapters w/ -O flag)")
-	ret_codes = list(results)
-	for i in range(0, len(ret_codes)):
-		status = "Success" if ret_codes[i] == 0 else "Failure"
-		print("\tChapter %-5s: %s" % (ch_queue[i], status))
+	for series in contexts:
+		if len(contexts) > 1:
+			print("  %s" % series)
+		for (s, ch) in work:
+			if s == series:
+				status = "Success" if ret_codes.get((s, ch)) == 0 else "Failure"
+				print("\tChapter %-5s: %s" % (ch, status))
+	return ret_codes
+
+def fetchChapter(series, ch, globals_pkg):
+	"""-------------------------------------------------------------------
+		Function:		[fetchChapter]
+		Description:	Fetch stage: downloads the page of a chapter, timing
+						the download including retries
+		Input:
+		  [series]		The series to fetch chapter for
+		  [ch]			The chapter number to fetch
+		  [globals_pkg]	Globals package
+		Return:			(page bytes, charset) of the chapter or None if it
+						could not be fetched
+		------------------------------------------------------------------
+	"""
+	global stage_report
+	url = getChapterUrl(series, ch, globals_pkg)
+	if url is None:
+		print("\n[Error] Chapter %d of %s is past the end of its page table. " %
+			(ch, series) + "Sync it with -U")
+		return None
+	config_data = globals_pkg.config_data
+	start = stagetimes.clock()
+	page = fetchPage(url, config_data.getSeriesLang(series),
+		chapter=(series, ch))
+	stagetimes.span('fetch', (series, ch), start)
+	if stage_report is not None:
+		stage_report.record((series, ch), {'fetch': stagetimes.clock() - start})
+	return page
+
+def parseChapter(page, globals_pkg):
+	"""-------------------------------------------------------------------
+		Function:		[parseChapter]
+		Description:	Parse stage: extracts the content of a chapter page.
+						Pages parsed before by the same parser version are
+						read back from the page cache instead
+		Input:
+		  [page]		(page bytes, charset) of the chapter
+		  [globals_pkg]	Globals package
+		Return:			List of (LType, line) starting with the title
+		------------------------------------------------------------------
+	"""
+	(source, charset) = page
+	html_parser = globals_pkg.html_parser
+	key = html_parser.getCacheKey(charset)
+	parsed = None
+	if key is not None:
+		digest = pagecache.hashBody(source)
+		data = pagecache.readParsed(digest, key)
+		if data is not None:
+			parsed = htmlparser.unpackPage(data)
+	if parsed is None:
+		parsed = html_parser.parse(source, charset)
+		if key is not None:
+			pagecache.storeParsed(digest, key, htmlparser.packPage(parsed))
+	return [(htmlparser.LType.TITLE, parsed.title + u'\n')] + parsed.content
+
+def render_stage(series, ch, page, globals_pkg, dev_opt, progress=False, 
+	profile=False, trace=False):
+	"""-------------------------------------------------------------------
+		Function:		[render_stage]
+		Description:	Parse and render stages of the pipeline, run in a
+						worker process when batching
+		Input:
+		  [series]		The series to render chapter for
+		  [ch]			The chapter number to render
+		  [page]		(page bytes, charset) of the fetched chapter
+		  [globals_pkg]	Globals package
+		  [dev_opt] 	Render developer version HTML?
+		  [progress]	Show a per-line progress bar?
+		  [profile]		cProfile the parse and render?
+		  [trace]		Record timeline spans of the parse and render?
+		Return:			(content or None if raws are not written, list of
+						(line number, raw line) of non-blank text lines,
+						rendered translation HTML, translation logs, matched
+						dictionary entries, ChapterMemo of the lines reused
+						and rendered, metrics dict with the stage 'times', 
+						cProfile stats 'profile' and trace 'spans')
+		------------------------------------------------------------------
+	"""
+	stagetimes.enableTrace(trace)
+	if profile:
+		import cProfile 	# Render profiling
+		profiler = cProfile.Profile()
+		profiler.enable()
+
+	stagetimes.take()
+	start = stagetimes.clock()
+	content = parseChapter(page, globals_pkg)
+	stagetimes.add('parse', stagetimes.clock() - start)
+	stagetimes.span('parse', (series, ch), start)
+
+	# Look up every line rendered before in one pass over the memo
+	start = stagetimes.clock()
+	memo = rendermemo.prefetch(series, globals_pkg.series_dict.version(),
+		globals_pkg.config_data.getSeriesLang(series), [line for (ltype, line) 
+		in content if ltype != htmlparser.LType.REG_IMG and 
+		ltype != htmlparser.LType.POST_IMG])
+	stagetimes.add('memo', stagetimes.clock() - start)
+
+	trans_file = io.StringIO()
+	log_file = io.StringIO()
+	terms = renderTrans(series, ch, content, globals_pkg, trans_file, log_file,
+		dev_opt, progress, memo)
+
+	# Line numbers match the [L#] numbering of the translation logs
+	lines = [(line_num, line.strip()) for (line_num, (ltype, line)) in 
+		enumerate(content, 1) if ltype != htmlparser.LType.REG_IMG and 
+		ltype != htmlparser.LType.POST_IMG and line.strip()]
+	write_raw = globals_pkg.config_data.getWriteRawOpt()
+	trans_html = trans_file.getvalue()
+
+	# Assembly is whatever rendering time was not spent matching/romanizing
+	times = stagetimes.take()
+	times['assemble'] = stagetimes.clock() - start - times.get('match', 0.0) \
+		- times.get('romanize', 0.0) - times.get('memo', 0.0)
+	stagetimes.span('render', (series, ch), start)
+
+	metrics = {'times': times, 'profile': None, 'spans': stagetimes.takeSpans()}
+	if profile:
+		profiler.disable()
+		profiler.create_stats()
+		metrics['profile'] = profiler.stats
+	return (content if write_raw else None, lines, trans_html, 
+		log_file.getvalue(), terms, memo, metrics)
+
+def render_task(series, ch, page, dev_opt, profile=False, trace=False):
+	"""-------------------------------------------------------------------
+		Function:		[render_task]
+		Description:	Runs render_stage in a render process with the
+						globals installed by initWorker
+		Input:
+		  [series]		The series to render chapter for
+		  [ch]			The chapter number to render
+		  [page]		(page bytes, charset) of the fetched chapter
+		  [dev_opt] 	Render developer version HTML?
+		  [profile]		cProfile the parse and render?
+		  [trace]		Record timeline spans of the parse and render?
+		Return:			The tuple returned by render_stage
+		------------------------------------------------------------------
+	"""
+	return render_stage(series, ch, page, worker_contexts[series], dev_opt, 
+		False, profile, trace)
 
-def _default_procedure(args):
-	""" Simple wrapper method for pooling default_procedure """
-	return default_procedure(*args)
+def write_stage(series, ch, rendered, globals_pkg):
+	"""-------------------------------------------------------------------
+		Function:		[write_stage]
+		Description:	Writer stage of the pipeline, always run in the main
+						process. Writes the outputs of render_stage, records
+						the build in the series build index and indexes the
+						raw lines of the chapter
+		Input:
+		  [series]		The series to write chapter for
+		  [ch]			The chapter number to write
+		  [rendered]	The tuple returned by render_stage
+		  [globals_pkg]	Globals package
+		Return:			0 upon success, non-0 otherwise
+		------------------------------------------------------------------
+	"""
+	global stage_report
+	build_index = globals_pkg.build_index
+	raw_index = globals_pkg.raw_index
+	render_memo = globals_pkg.render_memo
+	(content, lines, trans_html, log_text, terms, memo, metrics) = rendered
 
-def default_procedure(series, ch, globals_pkg, dev_opt):
+	start = stagetimes.clock()
+	ret = 0
+	if content is not None:
+		ret += writeRaw(series, ch, content)
+
+	# Leave the trans file alone if re-rendering produced the same bytes
+	output_hash = buildindex.hashOutput(trans_html)
+	trans_path = os.path.join(TRANS_PATH, series, "t%s_%d.html" % (series, ch))
+	if build_index is not None and build_index.getOutputHash(ch) == output_hash \
+		and os.path.exists(trans_path):
+		print(("Downtrans [t%s_%s.html] unchanged" % (series, ch)))
+	else:
+		ret += writeRendered(series, ch, trans_html, log_text)
+
+	if ret == 0 and build_index is not None:
+		build_index.record(ch, globals_pkg.series_dict, terms, output_hash)
+	if ret == 0 and raw_index is not None:
+		raw_index.addChapter(ch, lines)
+	if render_memo is not None:
+		render_memo.store(memo)
+
+	stagetimes.span('write', (series, ch), start)
+	if stage_report is not None:
+		metrics['times']['write'] = stagetimes.clock() - start
+		stage_report.record((series, ch), metrics['times'])
+		stage_report.addSpans(metrics['spans'])
+		if metrics['profile'] is not None:
+			stage_report.addProfile(metrics['profile'])
+	return ret
+
+def writeProfile(args, contexts, report, elapsed):
+	"""-------------------------------------------------------------------
+		Function:		[writeProfile]
+		Description:	Writes the stage timing report of this run and, if
+						requested, the merged cProfile stats
+		Input:
+		  [args]		The parsed command line arguments
+		  [contexts]	Dict of every series of this run to its globals package
+		  [report]		The StageReport of this run
+		  [elapsed]		Wall time of the run in seconds
+		Return:			None
+		------------------------------------------------------------------
+	"""
+	info = {
+		'series'	 : args.series,
+		'mode'		 : "batch" if args.batch else "one" if args.one else 
+			"catch-up" if args.catch_up else "retranslate",
+		'fetch_jobs' : args.fetch_jobs,
+		'jobs'		 : args.jobs,
+		'elapsed'	 : elapsed,
+		'page_cache' : pagecache.getCounters(),
+		'render_memo': {series: globals_pkg.render_memo.getCounters() 
+			for (series, globals_pkg) in contexts.items()}
+	}
+	try:
+		report.writeJson(args.profile, info)
+		print("Stage timings written to %s" % args.profile)
+		if args.cprofile and report.writeProfile(args.profile + ".pstats"):
+			print("cProfile stats written to %s.pstats" % args.profile)
+	except OSError:
+		print("[Error] Unable to write profile [%s]" % args.profile)
+
+def default_procedure(series, ch, globals_pkg, dev_opt, profile=False, 
+	trace=False):
 	"""-------------------------------------------------------------------
 		Function:		[default_procedure]
 		Description:	Downloads and saves a raw for chapter [ch] of series 
@@ -879,29 +1682,38 @@ def default_procedure(series, ch, globals_pkg, dev_opt):
 		  [ch]			The integer indicating which chapter to downtrans
 		  [globals_pkg]	Globals package
 		  [dev_opt] 	Write developer version HTML?
+		  [profile]		cProfile the parse and render?
+		  [trace]		Record timeline spans of every stage?
 		Return:			N/A
 		------------------------------------------------------------------
 	"""
-	# Ret code: 0 - success, non-0 - failure
-	ret = 0
-
-	# Write the raw file
-	url = getChapterUrl(series, ch, globals_pkg)
-	config_data = globals_pkg.config_data
-	html = fetchHTML(url, config_data.getSeriesLang(series))
-	if html is None:
+	page = fetchChapter(series, ch, globals_pkg)
+	if page is None:
 		return 1
-	# Parse out relevant content from the website source code
-	html_parser = globals_pkg.html_parser
-	title = html_parser.parseTitle(html) + u'\n'
-	content = [(htmlparser.LType.TITLE, title)] + html_parser.parseContent(html)
-	if config_data.getWriteRawOpt():
-		ret += writeRaw(series, ch, content)
+	rendered = render_stage(series, ch, page, globals_pkg, dev_opt, 
+		progress=True, profile=profile, trace=trace)
+	return write_stage(series, ch, rendered, globals_pkg)
 
-	# Write translation as HTML
-	ret += writeTrans(series, ch, content, globals_pkg, dev_opt)
-	return ret
 
+def oneChapter(args):
+	"""-------------------------------------------------------------------
+		Function:		[oneChapter]
+		Description:	Determines the chapter -O/--one downtranses
+		Input:
+		  [args]		The parsed command line arguments
+		Return:			The chapter number given by the control flag or
+						the start argument
+		------------------------------------------------------------------
+	"""
+	global config_data
+	ch_curr = config_data.getSeriesCurrChapter(args.series)
+	if args.prev:
+		return max(ch_curr-1, 1)
+	elif args.curr:
+		return ch_curr
+	elif args.next:
+		return ch_curr+1
+	return args.start
 
 def main():
 	start = timer()
@@ -920,55 +1732,135 @@ def main():
 	elif args.update:
 		handleUpdate()
 		sys.exit(0)
+	elif args.stats:
+		pagecache.printStats()
+		sys.exit(0)
+	elif args.query is not None:
+		handleQuery(args.series, args.query)
+		sys.exit(0)
 
 
-	# Create subdirectories if they don't already exist
-	initEssentialPaths(args.series)
-	# Initialize the HTML parser corresponding to the host of this series
-	initHtmlParser(config_data.getSeriesHost(args.series))
-	# Initialize the series page table according to series host
-	initPageTable(args.series)
-	# Initialize series dictionary
-	initDict(args.series, config_data.getUseCommonDictOpt())
-
-	# Package the finished globals as a Python equivalent of a C-struct
-	globals_pkg = GlobalsPackage()
-	globals_pkg.packGlobal("config_data")
-	globals_pkg.packGlobal("html_parser")
-	globals_pkg.packGlobal("series_dict")
-	globals_pkg.packGlobal("page_table")
+	# Initialize the globals of every series this run works on. The state
+	# render processes need is built first, or by a forkserver meanwhile
+	if args.catch_up:
+		work = catchUpWork()
+		if len(work) == 0:
+			print("Every series is caught up. Check for new chapters with -U")
+			sys.exit(0)
+		startRenderServer(set(s for (s, ch) in work))
+		contexts = collections.OrderedDict()
+		for series in collections.OrderedDict.fromkeys(s for (s, ch) in work):
+			contexts[series] = initSeries(series, 
+				config_data.getSeriesMaxChapter(series))
+	else:
+		ch_last = None
+		if args.batch:
+			ch_last = args.end
+		elif args.one:
+			ch_start = oneChapter(args)
+			ch_last = ch_start
+		if not args.one:
+			startRenderServer([args.series])
+		globals_pkg = initSeries(args.series, ch_last)
+		contexts = {args.series: globals_pkg}
+
+	# Time the stages of every chapter rendered this run
+	global stage_report
+	stage_report = stagetimes.StageReport()
+	profile = args.profile is not None and args.cprofile
+	trace = args.trace is not None
+	stagetimes.enableTrace(trace)
 
 	# Different execution paths depending on mode
-	l_series = config_data.getSeries().keys()
 	if args.batch:
 		chapters = list(range(args.start, args.end+1))
-		batch_procedure(args.series, chapters, globals_pkg, args.dev)
-		cacheutils.writeCacheData(series, l_series, args.end)
+		journal = batchjournal.BatchJournal(args.series, args.resume)
+		if args.resume:
+			# Only trust the journal for chapters whose output is still there
+			done = set(ch for ch in journal.completedChapters(chapters)
+				if os.path.exists(os.path.join(TRANS_PATH, args.series, 
+				"t%s_%d.html" % (args.series, ch))))
+			chapters = [ch for ch in chapters if ch not in done]
+			print("Resuming: %d of %d chapters were already written" % 
+				(len(done), args.end - args.start + 1))
+		try:
+			if len(chapters) > 0:
+				batch_procedure([(args.series, ch) for ch in chapters], contexts,
+					args.dev, args.fetch_jobs, args.jobs, profile, trace, 
+					{args.series: journal})
+		finally:
+			journal.close()
+		cacheutils.writeCacheData([(args.series, args.end, 0)])
 		openBrowser(args.series, args.start)
+	elif args.catch_up:
+		ret_codes = {}
+		try:
+			ret_codes = batch_procedure(work, contexts, args.dev, 
+				args.fetch_jobs, args.jobs, profile, trace)
+		finally:
+			# Advance each series past the chapters written without a gap
+			updates = []
+			for series in contexts:
+				ch_curr = config_data.getSeriesCurrChapter(series)
+				while ret_codes.get((series, ch_curr + 1)) == 0:
+					ch_curr += 1
+				if ch_curr > config_data.getSeriesCurrChapter(series):
+					updates.append((series, ch_curr, 0))
+			cacheutils.writeCacheData(updates)
 	elif args.one:
-		ch_curr = config_data.getSeriesCurrChapter(args.series)
-		if args.prev:
-			ch_start = max(ch_curr-1, 1)
-		elif args.curr:
-			ch_start = ch_curr
-		elif args.next:
-			ch_start = ch_curr+1
-		else:
-			ch_start = args.start
-
-		err_code = default_procedure(args.series, ch_start, globals_pkg, args.dev)
+		err_code = default_procedure(args.series, ch_start, globals_pkg, args.dev,
+			profile, trace)
 		if err_code != 0:
 			print("[Error] Could not download or translate. Exiting")
 			sys.exit(1)
-		cacheutils.writeCacheData(args.series, l_series, ch_start)
+		cacheutils.writeCacheData([(args.series, ch_start, 0)])
 		openBrowser(args.series, ch_start)
+	elif args.retranslate:
+		# Reuse cached pages no matter their age, only render is needed
+		pagecache.configure(args.offline, float('inf'), 
+			config_data.getPageCacheSize())
+		chapters = build_index.affectedChapters(series_dict, raw_index)
+		print("Dictionary changes affect %d of %d recorded chapters" % 
+			(len(chapters), build_index.getNumChapters()))
+		if len(chapters) > 0:
+			batch_procedure([(args.series, ch) for ch in chapters], contexts,
+				args.dev, args.fetch_jobs, args.jobs, profile, trace)
 	else:
 		print("[Error] Unexpected mode")
 		sys.exit(1)
 
+	# Persist what was built this run and trim the page cache and memos
+	for (series, globals_pkg) in contexts.items():
+		globals_pkg.build_index.close()
+		globals_pkg.raw_index.close()
+		globals_pkg.render_memo.close()
+		counters = globals_pkg.render_memo.getCounters()
+		lookups = counters['hit'] + counters['miss']
+		config_data.vprint("  Render memo [%s]: %d hits, %d misses (%.1f%% hit rate)"
+			% (series, counters['hit'], counters['miss'], 
+			100.0 * counters['hit'] / lookups if lookups > 0 else 0.0))
+	pagecache.evictIfNeeded()
+	counters = pagecache.getCounters()
+	config_data.vprint("  Page cache: %d hits, %d revalidated, %d fetched" %
+		(counters['hit'], counters['revalidated'], counters['miss']))
+
+	# Report where the time went
+	elapsed = timer() - start
+	if args.batch or args.catch_up or args.retranslate or \
+		args.profile is not None:
+		stage_report.printTable()
+	if args.profile is not None:
+		writeProfile(args, contexts, stage_report, elapsed)
+	if trace:
+		stage_report.addSpans(stagetimes.takeSpans())
+		try:
+			stage_report.writeTrace(args.trace)
+			print("Timeline trace written to %s" % args.trace)
+		except OSError:
+			print("[Error] Unable to write trace [%s]" % args.trace)
+
 	# Print completion statistics
 	print(("\n[Complete] Check output files in %s" % TRANS_PATH))
-	elapsed = timer() - start
 	if elapsed > 60:
 		elapsed = elapsed / 60
 		print(("  Elapsed Time: %.2f min" % elapsed))
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[conftest.py]
+  Description:	Shared test setup. Puts src/ on the import path, provides
+  				a local stand-in HTTP server for the network modules and
+  				copies of the repo config to run the script against
+"""
+import http.server 		# Stand-in server
+import socketserver 	# Threaded server
+import subprocess 		# Script runs
+import threading 		# Server thread
+import shutil 			# Repo copies
+import pytest 			# Fixtures
+import json 			# Config rewrite
+import re 				# Request paths
+import sys 				# Import path
+import os 				# File paths
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, os.path.abspath(SRC_PATH))
+
+REPO_PATH = os.path.abspath(os.path.join(SRC_PATH, ".."))
+SCRIPT_PATH = os.path.abspath(os.path.join(SRC_PATH, "wn_downtrans.py"))
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+class StandInServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+	daemon_threads = True
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+	# Keeps connections open between requests like the real hosts do
+	protocol_version = "HTTP/1.1"
+
+	def log_message(self, *args):
+		pass
+
+	def reply(self, status, body=b"", headers=None):
+		self.send_response(status)
+		for (name, value) in (headers or {}).items():
+			self.send_header(name, value)
+		if status != 304:
+			self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+class ChapterHandler(StandInHandler):
+	# Serves the saved Syosetu page as every chapter, except those missing.
+	# Flaky chapters answer their first request with a server error
+	missing = set()
+	flaky = set()
+	page = None
+
+	def do_GET(self):
+		if ChapterHandler.page is None:
+			with open(os.path.join(FIXTURES_PATH, "syosetu_utf8.html"), 'rb') \
+				as page_file:
+				ChapterHandler.page = page_file.read()
+		match = re.search(r"/(\d+)/?$", self.path)
+		if match is None or int(match.group(1)) in self.missing:
+			self.reply(404)
+		elif int(match.group(1)) in self.flaky:
+			ChapterHandler.flaky = self.flaky - {int(match.group(1))}
+			self.reply(500)
+		else:
+			self.reply(200, self.page, {'Content-Type': "text/html; charset=utf-8"})
+
+
+@pytest.fixture
+def standin():
+	"""-------------------------------------------------------------------
+		Function:		[standin]
+		Description:	Starts local stand-in servers for the test, shut
+						down when it ends
+		Return:			Function taking a StandInHandler subclass and
+						returning the base url of a server running it
+		------------------------------------------------------------------
+	"""
+	servers = []
+	def start(handler):
+		server = StandInServer(("127.0.0.1", 0), handler)
+		threading.Thread(target=server.serve_forever, args=(0.05,),
+			daemon=True).start()
+		servers.append(server)
+		return "http://127.0.0.1:%d" % server.server_address[1]
+	yield start
+	for server in servers:
+		server.shutdown()
+		server.server_close()
+
+
+def makeRepo(root, base_url=None):
+	"""-------------------------------------------------------------------
+		Function:		[makeRepo]
+		Description:	Copies the config, dictionaries and resources into a
+						directory the script can run from, never touching
+						the caches or outputs of the real repo
+		Input:
+		  [root]		Directory to copy into, a pathlib path
+		  [base_url]	Url the Syosetu host is pointed at, if any
+		Return:			The src/ working directory of the copy
+		------------------------------------------------------------------
+	"""
+	shutil.copy(os.path.join(REPO_PATH, "honorifics.json"), str(root))
+	for name in ("dicts", "resources"):
+		shutil.copytree(os.path.join(REPO_PATH, name), str(root / name),
+			ignore=shutil.ignore_patterns(".compiled"))
+	with open(os.path.join(REPO_PATH, "user_config.json"), 'r',
+		encoding='utf8') as config_file:
+		config = json.load(config_file)
+	if base_url is not None:
+		config['write_raw'] = False
+		for host in config['hosts']:
+			if host['host_name'] == "Syosetu":
+				host['base_url'] = base_url + "/"
+	with open(str(root / "user_config.json"), 'w', encoding='utf8') as config_file:
+		json.dump(config, config_file, ensure_ascii=False, indent=2)
+	(root / "src").mkdir()
+	return str(root / "src")
+
+
+def runScript(cwd, args, timeout=120):
+	"""-------------------------------------------------------------------
+		Function:		[runScript]
+		Description:	Runs the script in a fresh interpreter. A run still
+						going after the timeout fails the test instead of
+						hanging it
+		Input:
+		  [cwd]			src/ working directory returned by makeRepo
+		  [args]		Command line arguments of the script
+		  [timeout]		Seconds the run may take
+		Return:			The finished subprocess.CompletedProcess
+		------------------------------------------------------------------
+	"""
+	try:
+		return subprocess.run([sys.executable, SCRIPT_PATH] + args, cwd=cwd,
+			stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+			universal_newlines=True, timeout=timeout)
+	except subprocess.TimeoutExpired as e:
+		pytest.fail("%s did not finish in %d s:\n%s" % (" ".join(args),
+			timeout, e.output))
+
+
+def batchStatuses(output):
+	# Chapter number -> Success/Failure from the error report of a batch
+	return dict((int(ch), status) for (ch, status) in
+		re.findall(r"Chapter (\d+)\s*: (\w+)", output))
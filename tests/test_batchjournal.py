@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[test_batchjournal.py]
+  Description:	Tests of the batch journal and of resuming batches from it
+"""
+from conftest import ChapterHandler, makeRepo, runScript, batchStatuses
+import batchjournal
+import pytest
+import os
+
+
+@pytest.fixture
+def journal_path(tmp_path, monkeypatch):
+	monkeypatch.setattr(batchjournal, "JOURNAL_PATH", str(tmp_path / "journal"))
+	return str(tmp_path / "journal" / "series.journal")
+
+
+def test_torn_last_line_is_ignored(journal_path):
+	journal = batchjournal.BatchJournal("Series")
+	journal.record(1, batchjournal.WRITTEN, "a1")
+	journal.record(2, batchjournal.FETCHED, "b1")
+	journal.close()
+	# A crash in the middle of the next record
+	with open(journal_path, 'a', encoding='utf8') as journal_file:
+		journal_file.write("2\twrit")
+
+	journal = batchjournal.BatchJournal("Series", resume=True)
+	assert journal.getStatus(1) == batchjournal.WRITTEN
+	assert journal.getStatus(2) == batchjournal.FETCHED
+	assert journal.getHash(2) == "b1"
+	journal.close()
+
+
+def test_resume_keeps_latest_status(journal_path):
+	journal = batchjournal.BatchJournal("Series")
+	for ch in (1, 2, 3):
+		journal.record(ch, batchjournal.FETCHED, "p%d" % ch)
+	journal.record(1, batchjournal.WRITTEN, "o1")
+	journal.record(2, batchjournal.WRITTEN, "o2")
+	journal.record(2, batchjournal.FAILED)
+	journal.close()
+
+	journal = batchjournal.BatchJournal("Series", resume=True)
+	assert journal.completedChapters([1, 2, 3, 4]) == {1}
+	journal.close()
+
+
+def test_new_batch_truncates_journal(journal_path):
+	journal = batchjournal.BatchJournal("Series")
+	journal.record(1, batchjournal.WRITTEN, "o1")
+	journal.close()
+
+	journal = batchjournal.BatchJournal("Series")
+	assert journal.completedChapters([1]) == set()
+	journal.close()
+	assert os.path.getsize(journal_path) == 0
+
+
+def journalRecords(root):
+	path = str(root / "cache" / "journal" / "weakmage.journal")
+	with open(path, 'r', encoding='utf8') as journal_file:
+		return [line.split('\t')[:2] for line in journal_file]
+
+
+def test_missing_chapter_is_journaled_failed(tmp_path, standin):
+	ChapterHandler.missing = {2}
+	cwd = makeRepo(tmp_path, standin(ChapterHandler))
+	run = runScript(cwd, ["-B", "WeakMage", "1", "3", "-j", "2"])
+	assert run.returncode == 0, run.stdout
+
+	latest = dict((int(ch), status) for (ch, status) in journalRecords(tmp_path))
+	assert latest == {1: batchjournal.WRITTEN, 2: batchjournal.FAILED,
+		3: batchjournal.WRITTEN}
+
+
+def test_resume_redoes_failed_and_deleted_chapters(tmp_path, standin):
+	ChapterHandler.missing = {2}
+	cwd = makeRepo(tmp_path, standin(ChapterHandler))
+	runScript(cwd, ["-B", "WeakMage", "1", "4", "-j", "2"])
+	os.remove(str(tmp_path / "trans" / "WeakMage" / "tWeakMage_4.html"))
+
+	# Chapter 2 is found now, 4 was written but its output is gone
+	ChapterHandler.missing = set()
+	run = runScript(cwd, ["-B", "WeakMage", "1", "4", "-j", "2", "--resume"])
+	assert run.returncode == 0, run.stdout
+	assert "Resuming: 2 of 4 chapters were already written" in run.stdout
+	assert batchStatuses(run.stdout) == {2: "Success", 4: "Success"}
+
+	run = runScript(cwd, ["-B", "WeakMage", "1", "4", "--resume"])
+	assert "Resuming: 4 of 4 chapters were already written" in run.stdout
+	assert batchStatuses(run.stdout) == {}
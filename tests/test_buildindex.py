@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[test_buildindex.py]
+  Description:	Tests of the build index and the chapters it finds affected
+  				by dictionary edits
+"""
+from dictmatcher import DictLayer, DictMatcher
+import buildindex
+import rawindex
+import sqlite3
+import pytest
+
+CHAPTERS = {
+	1: [(0, u"陈平安走进小镇"), (1, u"宁姚来了")],
+	2: [(0, u"宁姚拔剑")],
+	3: [(0, u"小镇下雨了")],
+}
+
+
+@pytest.fixture
+def indexes(tmp_path, monkeypatch):
+	monkeypatch.setattr(buildindex, "BUILD_INDEX_PATH", str(tmp_path / "builds"))
+	monkeypatch.setattr(rawindex, "RAW_INDEX_PATH", str(tmp_path / "rawindex"))
+	build_index = buildindex.BuildIndex("Series")
+	raw_index = rawindex.RawIndex("Series")
+	for (ch, lines) in CHAPTERS.items():
+		raw_index.addChapter(ch, lines)
+	raw_index.commit()
+	yield (build_index, raw_index)
+	build_index.close()
+	raw_index.close()
+
+
+def matcher(entries, names=(), suffixes=()):
+	return DictMatcher([DictLayer(entries, names, suffixes)])
+
+
+def build(build_index, dictionary):
+	# Record every chapter as if rendered with the dictionary
+	for (ch, lines) in CHAPTERS.items():
+		terms = [raw for raw in dictionary if any(raw in line for (n, line) in lines)]
+		build_index.record(ch, dictionary, terms, buildindex.hashOutput(str(ch)))
+	build_index.save()
+
+
+BASE = [(u"陈平安", u"Chen Ping'an"), (u"宁姚", u"Ning Yao"), (u"小镇", u"town")]
+
+
+def test_unchanged_dictionary_affects_nothing(indexes):
+	(build_index, raw_index) = indexes
+	build(build_index, matcher(BASE))
+	assert build_index.affectedChapters(matcher(BASE), raw_index) == []
+	assert build_index.getNumChapters() == 3
+	assert build_index.getOutputHash(2) == buildindex.hashOutput("2")
+
+
+def test_changed_and_removed_entries_affect_their_chapters(indexes):
+	(build_index, raw_index) = indexes
+	build(build_index, matcher(BASE))
+	changed = matcher([(u"陈平安", u"Chen Ping'an"), (u"宁姚", u"Ning Yao"),
+		(u"小镇", u"village")])
+	assert build_index.affectedChapters(changed, raw_index) == [1, 3]
+	removed = matcher(BASE[:2])
+	assert build_index.affectedChapters(removed, raw_index) == [1, 3]
+
+
+def test_added_entries_affect_chapters_containing_them(indexes):
+	(build_index, raw_index) = indexes
+	build(build_index, matcher(BASE))
+	added = matcher(BASE + [(u"拔剑", u"draws the sword")])
+	assert build_index.affectedChapters(added, raw_index) == [2]
+
+
+def test_added_entries_scan_chapter_text_past_query_limit(indexes, monkeypatch):
+	(build_index, raw_index) = indexes
+	build(build_index, matcher(BASE))
+	monkeypatch.setattr(buildindex, "MAX_ADDED_QUERIES", 0)
+	added = matcher(BASE + [(u"下雨", u"rains"), (u"不在", u"absent")])
+	assert build_index.affectedChapters(added, raw_index) == [3]
+
+
+def test_added_honorifics_expand_against_names_only(indexes):
+	(build_index, raw_index) = indexes
+	names = [(u"宁姚", u"Ning Yao")]
+	build(build_index, matcher(BASE, names, [(u"来", u"comes")]))
+	assert raw_index.getText(1) == u"陈平安走进小镇\n宁姚来了"
+	added = matcher(BASE, names, [(u"来", u"comes"), (u"拔", u"pulls")])
+	assert buildindex.addedEntries(buildindex.snapshotLayers(matcher(BASE,
+		names, [(u"来", u"comes")])), buildindex.snapshotLayers(added)) == \
+		{u"宁姚拔"}
+	assert build_index.affectedChapters(added, raw_index) == [2]
+
+
+def test_index_persists_and_drops_unused_snapshots(indexes, tmp_path):
+	(build_index, raw_index) = indexes
+	build(build_index, matcher(BASE))
+	build(build_index, matcher(BASE[:2]))
+
+	reopened = buildindex.BuildIndex("Series")
+	assert reopened.getNumChapters() == 3
+	assert reopened.affectedChapters(matcher(BASE[:2]), raw_index) == []
+	assert reopened.affectedChapters(matcher(BASE), raw_index) == [1, 3]
+	reopened.close()
+	db = sqlite3.connect(str(tmp_path / "builds" / "series.db"))
+	assert db.execute("SELECT COUNT(*) FROM dicts").fetchone()[0] == 1
+	db.close()
+
+
+def test_reordered_entries_affect_chapters_matching_both(indexes):
+	(build_index, raw_index) = indexes
+	build(build_index, matcher(BASE))
+	reordered = matcher([BASE[2], BASE[1], BASE[0]])
+	# Only chapter 1 matches two entries of the same length
+	assert build_index.affectedChapters(reordered, raw_index) == [1]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[test_cacheutils.py]
+  Description:	Tests of the catalog import of the legacy cache files
+"""
+import cacheutils
+import sqlite3
+import pytest
+import os
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+	tables = tmp_path / "tables"
+	tables.mkdir()
+	monkeypatch.setattr(cacheutils, "CATALOG_PATH", str(tmp_path / "cache" / "catalog.db"))
+	monkeypatch.setattr(cacheutils, "LEGACY_CACHE_PATH", str(tmp_path / "cmd_cache.txt"))
+	monkeypatch.setattr(cacheutils, "LEGACY_TABLES_PATH", str(tables))
+	return tmp_path
+
+
+def writeLegacy(path, text, mtime):
+	with open(str(path), 'w', encoding='utf8') as legacy_file:
+		legacy_file.write(text)
+	os.utime(str(path), ns=(mtime, mtime))
+
+
+def test_imports_legacy_files(catalog):
+	writeLegacy(catalog / "cmd_cache.txt", "GOG:CURR=3:MAX=10\nGOG:CURR=9:MAX=9\n", 10**18)
+	writeLegacy(catalog / "tables" / "GOG.table", "a\nb\n\nc\n", 10**18)
+	assert cacheutils.readCacheData() == {'GOG': (3, 10)}
+	assert cacheutils.readPageTable("GOG") == ["a", "b", "c"]
+
+
+def test_unchanged_legacy_files_import_once(catalog):
+	writeLegacy(catalog / "tables" / "GOG.table", "a\nb\n", 10**18)
+	assert cacheutils.readPageTable("GOG") == ["a", "b"]
+	cacheutils.writePageTable("GOG", ["x", "y", "z"])
+	assert cacheutils.readPageTable("GOG") == ["x", "y", "z"]
+
+
+def test_changed_legacy_files_import_again(catalog):
+	writeLegacy(catalog / "cmd_cache.txt", "GOG:CURR=3:MAX=10\n", 10**18)
+	writeLegacy(catalog / "tables" / "GOG.table", "a\nb\n", 10**18)
+	assert cacheutils.readPageTable("GOG") == ["a", "b"]
+	cacheutils.writeCacheData([("GOG", 5, 0)])
+
+	writeLegacy(catalog / "cmd_cache.txt", "GOG:CURR=4:MAX=12\n", 10**18 + 1)
+	writeLegacy(catalog / "tables" / "GOG.table", "a\nb\nc\n", 10**18 + 1)
+	writeLegacy(catalog / "tables" / "Other.table", "q\n", 10**18)
+	# Chapters never move backwards, tables are replaced
+	assert cacheutils.readCacheData() == {'GOG': (5, 12)}
+	assert cacheutils.readPageTable("GOG") == ["a", "b", "c"]
+	assert cacheutils.readPageTable("Other") == ["q"]
+
+
+def test_catalog_imported_before_stamps_is_not_reimported(catalog):
+	writeLegacy(catalog / "tables" / "GOG.table", "a\nb\n", 10**18)
+	os.makedirs(str(catalog / "cache"))
+	db = sqlite3.connect(cacheutils.CATALOG_PATH)
+	db.executescript("""
+		CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+		INSERT INTO meta VALUES ('imported', '0');
+	""")
+	db.close()
+	cacheutils.writePageTable("GOG", ["x"])
+	assert cacheutils.readPageTable("GOG") == ["x"]
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[test_dictmatcher.py]
+  Description:	Tests of the compiled dictionary matcher
+"""
+from dictmatcher import DictLayer, DictMatcher
+
+
+def matcher(*layers):
+	return DictMatcher([DictLayer(*layer) for layer in layers])
+
+
+def test_version_follows_entry_order():
+	forward = matcher(([(u"高月", u"Takatsuki"), (u"ノア", u"Noah")],))
+	reordered = matcher(([(u"ノア", u"Noah"), (u"高月", u"Takatsuki")],))
+	# Same entries, but they are numbered in a different order
+	assert forward.rank(u"高月") < forward.rank(u"ノア")
+	assert reordered.rank(u"高月") > reordered.rank(u"ノア")
+	assert forward.version() != reordered.version()
+	assert forward.version() == matcher(([(u"高月", u"Takatsuki"),
+		(u"ノア", u"Noah")],)).version()
+
+
+def test_version_follows_translations():
+	assert matcher(([(u"高月", u"Takatsuki")],)).version() != \
+		matcher(([(u"高月", u"Makoto")],)).version()
+
+
+def matches(dictionary, line):
+	return [(line[start:end], trans) for (start, end, trans)
+		in dictionary.match(line)]
+
+
+def test_leftmost_longest_without_overlaps():
+	dictionary = matcher(([(u"ab", u"AB"), (u"abc", u"ABC"), (u"bcd", u"BCD"),
+		(u"d", u"D"), (u"cde", u"CDE")],))
+	# abc starts first and is longest there, bcd and cde overlap it
+	assert matches(dictionary, u"xabcdey") == [(u"abc", u"ABC"), (u"d", u"D")]
+	assert matches(dictionary, u"abd") == [(u"ab", u"AB"), (u"d", u"D")]
+	assert matches(dictionary, u"xyz") == []
+
+
+def test_later_layers_win_ties():
+	dictionary = matcher(([(u"ノア", u"Noa"), (u"高月", u"Takatsuki")],),
+		([(u"ノア", u"Noah")],))
+	assert matches(dictionary, u"高月とノア") == [(u"高月", u"Takatsuki"),
+		(u"ノア", u"Noah")]
+	# A longer entry of an earlier layer still wins
+	dictionary = matcher(([(u"ノア様", u"Lady Noah")],), ([(u"ノア", u"Noah")],))
+	assert matches(dictionary, u"ノア様") == [(u"ノア様", u"Lady Noah")]
+
+
+def test_entries_beat_name_and_suffix_of_equal_length():
+	names = [(u"ノア", u"Noah")]
+	suffixes = [(u"様", u"sama")]
+	dictionary = matcher((names + [(u"ノア様", u"Goddess")], names, suffixes))
+	assert matches(dictionary, u"ノア様は") == [(u"ノア様", u"Goddess")]
+	dictionary = matcher((names, names, suffixes))
+	assert matches(dictionary, u"ノア様は") == [(u"ノア様", u"Noah-sama")]
+
+
+def test_longest_suffix_wins():
+	names = [(u"高月", u"Takatsuki")]
+	dictionary = matcher((names, names, [(u"さ", u"sa"), (u"さん", u"san")]))
+	assert matches(dictionary, u"高月さんだ") == [(u"高月さん", u"Takatsuki-san")]
+	assert matches(dictionary, u"高月さだ") == [(u"高月さ", u"Takatsuki-sa")]
+
+
+def test_matches_at_end_of_line():
+	names = [(u"高月", u"Takatsuki")]
+	dictionary = matcher((names + [(u"ノア", u"Noah")], names,
+		[(u"くん", u"kun")]))
+	assert matches(dictionary, u"はノア") == [(u"ノア", u"Noah")]
+	assert matches(dictionary, u"は高月") == [(u"高月", u"Takatsuki")]
+	assert matches(dictionary, u"は高月くん") == [(u"高月くん", u"Takatsuki-kun")]
+	# A suffix cut short by the end of the line leaves the name
+	assert matches(dictionary, u"は高月く") == [(u"高月", u"Takatsuki")]
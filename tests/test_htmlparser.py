@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[test_htmlparser.py]
+  Description:	Tests of the charset handling of the parsing helpers
+"""
+import htmlparser
+import pytest
+
+TEXT = u"日本語の本文"
+PAGE = u"<html><head>%s</head><body><p>" + TEXT + u"</p></body></html>"
+
+
+@pytest.mark.parametrize("declared, expected", [
+	("utf-8", "utf-8"),
+	("UTF8", "utf-8"),
+	("Shift_JIS", "shift_jis"),
+	("EUC-JP", "euc_jp"),
+	("gbk", "gb18030"),
+	("GB2312", "gb18030"),
+	("nonsense", "utf-8")
+])
+def test_detect_charset_from_header(declared, expected):
+	content_type = "text/html; charset=%s" % declared
+	assert htmlparser.detectCharset(b"", content_type) == expected
+
+
+def test_detect_charset_from_meta():
+	page = (PAGE % u'<meta charset="EUC-JP">').encode('euc_jp')
+	assert htmlparser.detectCharset(page) == "euc_jp"
+	page = (PAGE % (u'<meta http-equiv="Content-Type" ' +
+		u'content="text/html; charset=Shift_JIS">')).encode('shift_jis')
+	assert htmlparser.detectCharset(page) == "shift_jis"
+
+
+def test_detect_charset_default():
+	assert htmlparser.detectCharset(b"<html></html>", None, 'gbk') == "gb18030"
+
+
+@pytest.mark.parametrize("declared", [
+	"utf-8", "Shift_JIS", "EUC-JP", "gbk", "GB18030", "ISO-2022-JP",
+	# Not known to libxml2, decoded by Python instead
+	"EUC-JIS-2004", "utf-8-sig"
+])
+def test_parse_tree_accepts_detected_charset(declared):
+	page = (PAGE % (u'<meta charset="%s">' % declared)).encode(declared)
+	charset = htmlparser.detectCharset(page)
+	tree = htmlparser.parseTree(page, charset)
+	assert htmlparser.getXPath('text')(tree).endswith(TEXT)
+
+
+def test_syosetu_title_kept_as_marked_up():
+	page = (u'<html><body><p class="novel_subtitle">第一話 <ruby><rb>始</rb>' +
+		u'<rt>はじ</rt></ruby>まり &amp; 終わり</p><div id="novel_honbun" ' +
+		u'class="novel_view"><p>本文</p></div></body></html>').encode('utf8')
+	title = htmlparser.SyosetuParser().parse(page, 'utf-8').title
+	assert title == u'第一話 <ruby><rb>始</rb><rt>はじ</rt></ruby>まり &amp; 終わり'
+
+
+def test_shu69_title_entities_decoded():
+	page = (u'<html><body><div class="h1title">\n<h1>第五章 剑 &amp; 心 ' +
+		u'&lt;上&gt;</h1>\n</div></body></html>').encode('gb18030')
+	title = htmlparser.Shu69Parser().parse(page, 'gb18030').title
+	assert title == u'第五章 剑 & 心 <上>'
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[test_httpclient.py]
+  Description:	Tests of the pooled HTTP client against a local stand-in
+  				server
+"""
+from conftest import StandInHandler
+import httpclient
+import pytest
+import gzip
+import zlib
+
+PAGE = u"こんにちは世界\n".encode('utf8') * 200
+
+
+class PageHandler(StandInHandler):
+	ports = set()
+
+	def do_GET(self):
+		PageHandler.ports.add(self.client_address[1])
+		if self.path == "/moved":
+			self.reply(302, headers={'Location': "/page"})
+		elif self.path.startswith("/loop"):
+			self.reply(301, headers={'Location': "/loop%d" % (len(self.path) + 1)})
+		elif self.path == "/missing":
+			self.reply(404)
+		elif self.path == "/gzip":
+			self.reply(200, gzip.compress(PAGE), {'Content-Encoding': "gzip"})
+		elif self.path == "/deflate":
+			self.reply(200, zlib.compress(PAGE), {'Content-Encoding': "deflate"})
+		elif self.path == "/rawdeflate":
+			compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+			body = compressor.compress(PAGE) + compressor.flush()
+			self.reply(200, body, {'Content-Encoding': "deflate"})
+		elif self.path == "/etag":
+			if self.headers.get('If-None-Match') == '"v1"':
+				self.reply(304, headers={'ETag': '"v1"'})
+			else:
+				self.reply(200, PAGE, {'ETag': '"v1"'})
+		else:
+			self.reply(200, PAGE)
+
+
+@pytest.fixture
+def base(standin):
+	PageHandler.ports.clear()
+	return standin(PageHandler)
+
+
+def test_keep_alive_reuses_connection(base):
+	client = httpclient.HttpClient()
+	for i in range(10):
+		assert client.get(base + "/page%d" % i).body == PAGE
+	assert len(PageHandler.ports) == 1
+	client.close()
+
+
+def test_follows_redirects(base):
+	response = httpclient.HttpClient().get(base + "/moved")
+	assert response.status == 200
+	assert response.url == base + "/page"
+	assert response.body == PAGE
+
+
+def test_too_many_redirects_raises(base):
+	with pytest.raises(httpclient.RedirectError) as error:
+		httpclient.HttpClient().get(base + "/loop")
+	assert error.value.code == 301
+	assert isinstance(error.value, httpclient.HttpError)
+
+
+def test_error_status_raises(base):
+	with pytest.raises(httpclient.HttpError) as error:
+		httpclient.HttpClient().get(base + "/missing")
+	assert error.value.code == 404
+
+
+@pytest.mark.parametrize("path", ["/gzip", "/deflate", "/rawdeflate"])
+def test_decodes_compressed_bodies(base, path):
+	response = httpclient.HttpClient().get(base + path)
+	assert response.body == PAGE
+
+
+def test_not_modified(base):
+	client = httpclient.HttpClient()
+	response = client.get(base + "/etag")
+	assert response.status == 200
+	response = client.get(base + "/etag", {'If-None-Match': response.headers['ETag']})
+	assert response.status == 304
+	assert response.body == b""
+	# The connection stays usable after a bodiless response
+	assert client.get(base + "/page").body == PAGE
+	assert len(PageHandler.ports) == 1
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[test_pagecache.py]
+  Description:	Tests of the page cache size accounting and eviction
+"""
+import pagecache
+import pytest
+import os
+
+PAGE = b"x" * 1024
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+	root = str(tmp_path / "pages")
+	monkeypatch.setattr(pagecache, "PAGE_CACHE_PATH", root)
+	for (name, sub) in (("OBJECTS_PATH", "objects"), ("INDEX_PATH", "index"),
+		("PARSED_PATH", "parsed"), ("SIZE_PATH", "size")):
+		monkeypatch.setattr(pagecache, name, os.path.join(root, sub))
+	monkeypatch.setattr(pagecache, "_stored_bytes", 0)
+	pagecache.configure(False, 0, 1)
+	return root
+
+
+def store(n):
+	for i in range(n):
+		pagecache.store("http://host/%d" % i, PAGE + str(i).encode('ascii'), {})
+
+
+def scans(monkeypatch):
+	calls = []
+	scan = pagecache._allObjects
+	monkeypatch.setattr(pagecache, "_allObjects",
+		lambda: calls.append(1) or scan())
+	return calls
+
+
+def test_first_run_scans_and_records_size(cache, monkeypatch):
+	calls = scans(monkeypatch)
+	store(3)
+	assert pagecache.evictIfNeeded() == 0
+	assert len(calls) == 1
+	assert pagecache._readSize() == 3 * len(PAGE) + 3
+
+
+def test_under_limit_does_not_scan(cache, monkeypatch):
+	store(3)
+	pagecache.evictIfNeeded()
+	calls = scans(monkeypatch)
+
+	# Cached pages only, then new ones still under the limit
+	assert pagecache.evictIfNeeded() == 0
+	pagecache.store("http://host/new", PAGE, {})
+	assert pagecache.evictIfNeeded() == 0
+	assert calls == []
+	assert pagecache._readSize() == 4 * len(PAGE) + 3
+
+
+def test_over_limit_evicts_oldest(cache, monkeypatch):
+	store(3)
+	pagecache.evictIfNeeded()
+	pagecache.configure(False, 0, 2.5 * len(PAGE) / 2**20)
+	pagecache.store("http://host/new", PAGE, {})
+	assert pagecache.evictIfNeeded() == 2
+	assert pagecache.lookup("http://host/0") is None
+	assert pagecache.lookup("http://host/new") is not None
+	assert pagecache._readSize() == 2 * len(PAGE) + 1
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[test_parsers.py]
+  Description:	Fixture tests of the host parsers. Each saved page in
+  				fixtures/ comes with the title and (LType, line) list the
+  				original BeautifulSoup based parsers made of it
+"""
+from htmlparser import LType
+import htmlparser
+import pytest
+import json
+import os
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Fixture name, host, charset default of the series language
+CHAPTERS = [
+	("syosetu_utf8", "Syosetu", "utf-8"),
+	("syosetu_eucjp", "Syosetu", "utf-8"),
+	("biquyun_gbk", "Biquyun", "gbk"),
+	("biquyun_utf8", "Biquyun", "gbk"),
+	("shu69_gbk", "69shu", "gbk"),
+	("shu69_utf8", "69shu", "gbk")
+]
+
+
+def loadFixture(name):
+	with open(os.path.join(FIXTURES_PATH, name + ".html"), 'rb') as page_file:
+		page = page_file.read()
+	with open(os.path.join(FIXTURES_PATH, name + ".json"), 'r',
+		encoding='utf8') as expected_file:
+		expected = json.load(expected_file)
+	return (page, expected)
+
+
+def asLists(content):
+	return [[ltype.name, line] for (ltype, line) in content]
+
+
+@pytest.mark.parametrize("name, host, default", CHAPTERS)
+def test_parse_bytes_matches_baseline(name, host, default):
+	(page, expected) = loadFixture(name)
+	charset = htmlparser.detectCharset(page, None, default)
+	parsed = htmlparser.createParser(host).parse(page, charset)
+	assert parsed.title == expected['title']
+	assert asLists(parsed.content) == expected['content']
+
+
+@pytest.mark.parametrize("name, host, default", CHAPTERS)
+def test_parse_str_matches_baseline(name, host, default):
+	(page, expected) = loadFixture(name)
+	html = page.decode(htmlparser.detectCharset(page, None, default))
+	parsed = htmlparser.createParser(host).parse(html)
+	assert parsed.title == expected['title']
+	assert asLists(parsed.content) == expected['content']
+
+
+@pytest.mark.parametrize("name, host, default", CHAPTERS)
+def test_packed_page_round_trip(name, host, default):
+	(page, expected) = loadFixture(name)
+	charset = htmlparser.detectCharset(page, None, default)
+	parsed = htmlparser.createParser(host).parse(page, charset)
+	unpacked = htmlparser.unpackPage(htmlparser.packPage(parsed))
+	assert unpacked.title == parsed.title
+	assert unpacked.content == parsed.content
+	assert unpacked.images == parsed.images
+
+
+def test_syosetu_images():
+	(page, expected) = loadFixture("syosetu_utf8")
+	parsed = htmlparser.SyosetuParser().parse(page, 'utf-8')
+	img_types = (LType.REG_IMG.name, LType.POST_IMG.name)
+	assert parsed.images == [line for (ltype, line) in expected['content']
+		if ltype in img_types]
+
+
+def test_shu69_page_table_matches_baseline():
+	(page, expected) = loadFixture("shu69_toc_gbk")
+	html = page.decode(htmlparser.detectCharset(page, None, 'gbk'))
+	parser = htmlparser.Shu69Parser()
+	assert parser.parsePageTableFromWeb(html) == expected['page_table']
+	assert parser.getLatestChapter(html) == len(expected['page_table'])
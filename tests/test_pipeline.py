@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[test_pipeline.py]
+  Description:	Batch runs of the script against a local stand-in for
+  				Syosetu serving a saved chapter page
+"""
+from conftest import ChapterHandler, makeRepo, runScript, batchStatuses
+import os
+
+
+def test_missing_chapter_fails_without_stopping_batch(tmp_path, standin):
+	ChapterHandler.missing = {3}
+	cwd = makeRepo(tmp_path, standin(ChapterHandler))
+	run = runScript(cwd, ["-B", "WeakMage", "1", "4", "-j", "2"])
+
+	assert run.returncode == 0, run.stdout
+	assert "URL not found" in run.stdout
+	assert batchStatuses(run.stdout) == {1: "Success", 2: "Success",
+		3: "Failure", 4: "Success"}
+	written = sorted(os.listdir(str(tmp_path / "trans" / "WeakMage")))
+	assert written == ["tWeakMage_1.html", "tWeakMage_2.html",
+		"tWeakMage_4.html"]
+
+
+def test_workers_load_dictionary_from_compiled_files(tmp_path, monkeypatch):
+	import wn_downtrans
+	import pickle
+	monkeypatch.chdir(makeRepo(tmp_path))
+	wn_downtrans.initConfig()
+	globals_pkg = wn_downtrans.initSeries("WeakMage")
+	series_dict = globals_pkg.series_dict
+	assert len(globals_pkg.dict_artifacts) == 3
+
+	# As sent to a process that is not forked from this one
+	data = pickle.dumps({"WeakMage": globals_pkg})
+	assert len(data) < len(pickle.dumps(series_dict)) / 4
+	wn_downtrans.initWorker(pickle.loads(data), [])
+	loaded = wn_downtrans.worker_contexts["WeakMage"].series_dict
+	assert loaded.version() == series_dict.version()
+	assert loaded.items() == series_dict.items()
+	globals_pkg.build_index.close()
+	globals_pkg.raw_index.close()
+	globals_pkg.render_memo.close()
+
+
+def test_retry_wait_is_traced_with_its_chapter(tmp_path, standin, monkeypatch):
+	import json
+	monkeypatch.setattr(ChapterHandler, "missing", set())
+	monkeypatch.setattr(ChapterHandler, "flaky", {2})
+	cwd = makeRepo(tmp_path, standin(ChapterHandler))
+	trace_path = str(tmp_path / "trace.json")
+	run = runScript(cwd, ["-B", "WeakMage", "1", "2", "--trace", trace_path])
+	assert run.returncode == 0, run.stdout
+	assert batchStatuses(run.stdout) == {1: "Success", 2: "Success"}
+
+	with open(trace_path, 'r', encoding='utf8') as trace_file:
+		events = json.load(trace_file)['traceEvents']
+	waits = [event['args'] for event in events if event['name'] == 'retry_wait']
+	assert waits == [{'series': "WeakMage", 'ch': 2}]
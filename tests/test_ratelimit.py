@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[test_ratelimit.py]
+  Description:	Tests of the per host request scheduler against a local
+  				stand-in server that throttles its clients
+"""
+from timeit import default_timer as clock
+from concurrent.futures import ThreadPoolExecutor
+from conftest import StandInHandler
+import httpclient
+import ratelimit
+import threading
+import pytest
+import time
+
+
+# Answers 429 with a Retry-After to every request beyond max_inflight
+# concurrent ones and to the first request of paths starting with /once
+class ThrottlingHandler(StandInHandler):
+	max_inflight = 2
+	retry_after = "0.2"
+	lock = threading.Lock()
+	inflight = 0
+	sent = []
+	throttled = []
+	seen = set()
+
+	def do_GET(self):
+		cls = ThrottlingHandler
+		with cls.lock:
+			cls.inflight += 1
+			cls.sent.append(clock())
+			throttle = cls.inflight > cls.max_inflight or \
+				(self.path.startswith("/once") and self.path not in cls.seen)
+			cls.seen.add(self.path)
+		try:
+			if throttle:
+				with cls.lock:
+					cls.throttled.append(clock())
+				self.reply(429, headers={'Retry-After': cls.retry_after})
+			else:
+				time.sleep(0.02)
+				self.reply(200, b"ok " + self.path.encode('ascii'))
+		finally:
+			with cls.lock:
+				cls.inflight -= 1
+
+
+@pytest.fixture
+def base(standin):
+	ThrottlingHandler.inflight = 0
+	ThrottlingHandler.sent = []
+	ThrottlingHandler.throttled = []
+	ThrottlingHandler.seen = set()
+	url = standin(ThrottlingHandler)
+	yield url
+	ratelimit.configure({})
+
+
+def fetch(url):
+	# Retry loop of fetchPage, minus the page cache
+	client = httpclient.getClient()
+	for throttles in range(ratelimit.MAX_THROTTLES):
+		try:
+			with ratelimit.request(url):
+				return client.get(url).body
+		except httpclient.HttpError as e:
+			if not ratelimit.isThrottle(e):
+				raise
+	return None
+
+
+def test_unconfigured_host_is_unlimited(base):
+	ratelimit.configure({})
+	start = clock()
+	for i in range(50):
+		limiter = ratelimit.getLimiter(base + "/%d" % i)
+		limiter.release(limiter.acquire())
+	assert clock() - start < 0.1
+
+
+def test_configured_rate(base):
+	ratelimit.configure({base + "/": {'rate': 20, 'burst': 1}})
+	for i in range(6):
+		assert fetch(base + "/page%d" % i) == b"ok /page%d" % i
+	# One request let through at once, then one every 1/20 s
+	assert clock() - ThrottlingHandler.sent[0] >= 5 / 20.0 - 0.01
+
+
+def test_retry_after_is_honored(base):
+	ratelimit.configure({base + "/": {'rate': None}})
+	assert fetch(base + "/once") == b"ok /once"
+	assert len(ThrottlingHandler.throttled) == 1
+	(throttled, retried) = ThrottlingHandler.sent
+	assert retried - throttled >= float(ThrottlingHandler.retry_after)
+
+
+def test_concurrency_adapts_to_throttling(base):
+	ratelimit.configure({base + "/": {'rate': None, 'max_connections': 8}})
+	with ThreadPoolExecutor(16) as pool:
+		bodies = list(pool.map(lambda i: fetch(base + "/page%d" % i), range(60)))
+	assert bodies == [b"ok /page%d" % i for i in range(60)]
+	assert len(ThrottlingHandler.throttled) > 0
+	# The cap backed off from 8 and the host stopped throttling well before
+	# every request went through
+	assert ratelimit.getLimiter(base).getLimit() < 8
+	assert len(ThrottlingHandler.throttled) < 30
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[test_rawindex.py]
+  Description:	Tests of term lookups in the raw index
+"""
+import rawindex
+import pytest
+
+LONG_TERM = u"陈平安走进了骊珠洞天小镇"
+
+CHAPTERS = {
+	1: [(0, u"陈平安走进小镇"), (1, u"宁姚来了"), (2, u"镇")],
+	2: [(0, u"宁姚拔剑"), (1, LONG_TERM + u"。")],
+	# Every gram of LONG_TERM, but never the whole term
+	3: [(0, LONG_TERM[:7]), (1, LONG_TERM[6:])],
+}
+
+
+@pytest.fixture
+def raw_index(tmp_path, monkeypatch):
+	monkeypatch.setattr(rawindex, "RAW_INDEX_PATH", str(tmp_path / "rawindex"))
+	raw_index = rawindex.RawIndex("Series")
+	for (ch, lines) in CHAPTERS.items():
+		raw_index.addChapter(ch, lines)
+	raw_index.commit()
+	yield raw_index
+	raw_index.close()
+
+
+def test_single_character_term_scans_lines(raw_index):
+	assert raw_index.query(u"镇") == [(1, 0, u"陈平安走进小镇"), (1, 2, u"镇"),
+		(2, 1, LONG_TERM + u"。"), (3, 1, LONG_TERM[6:])]
+	assert raw_index.query(u"剑") == [(2, 0, u"宁姚拔剑")]
+	assert raw_index.query(u"雨") == []
+
+
+def test_long_term_uses_rarest_grams(raw_index):
+	grams = sorted(rawindex.toGrams(LONG_TERM))
+	assert len(grams) > rawindex.MAX_QUERY_GRAMS
+	rarest = raw_index.rarestGrams(grams)
+	assert len(rarest) == rawindex.MAX_QUERY_GRAMS
+	# The grams of 进了骊珠洞天小 are in chapters 2 and 3 only, the rest in all 3
+	assert set(rawindex.toGrams(u"进了骊珠洞天小")) < set(rarest)
+	assert rarest[:6] == sorted(rarest[:6])
+
+	assert raw_index.query(LONG_TERM) == [(2, 1, LONG_TERM + u"。")]
+
+
+def test_gram_in_no_chapter_finds_nothing(raw_index):
+	assert raw_index.rarestGrams([u"宁姚", u"下雨"]) is None
+	assert raw_index.query(u"宁姚下雨") == []
+	assert raw_index.query(u"宁姚") == [(1, 1, u"宁姚来了"), (2, 0, u"宁姚拔剑")]
+
+
+def test_readding_chapter_replaces_its_lines(raw_index):
+	raw_index.addChapter(1, [(0, u"小镇下雨了")])
+	raw_index.commit()
+	assert raw_index.query(u"宁姚") == [(2, 0, u"宁姚拔剑")]
+	assert raw_index.query(u"下雨") == [(1, 0, u"小镇下雨了")]
+	assert raw_index.rarestGrams([u"来了"]) is None
+	assert raw_index.getText(1) == u"小镇下雨了"
+	assert raw_index.getNumChapters() == 3
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+  Author:		Tahmid Khan
+  File:			[test_startup.py]
+  Description:	Cold start budgets of the command line modes. Each mode is
+  				run in a fresh interpreter under -X importtime against a
+  				copy of the repo config, and must stay under its time
+  				budget without loading the dependencies it does not use
+"""
+from timeit import default_timer as clock
+import subprocess
+import pytest
+import sys
+
+from conftest import SCRIPT_PATH, makeRepo
+
+# Runs of each mode, the fastest counts
+RUNS = 3
+
+# Modules only the fetch, parse, render and batch paths need
+HEAVY_MODULES = ['lxml', 'bs4', 'pykakasi', 'tqdm', 'multiprocessing',
+	'webbrowser', 'pdb', 'http.client', 'ssl', 'concurrent.futures']
+
+# Mode arguments, seconds allowed on top of a bare interpreter start and
+# modules the mode must not load
+MODES = [
+	(["-I"], 0.4, HEAVY_MODULES + ['hashlib', 'pickle']),
+	(["-C"], 0.25, HEAVY_MODULES + ['tabulate', 'hashlib', 'pickle']),
+	(["--stats"], 0.25, HEAVY_MODULES + ['tabulate', 'hashlib', 'pickle']),
+	# Up to the first page fetch, which --offline fails on an empty cache
+	(["-O", "--next", "WeakMage", "--offline"], 0.4, HEAVY_MODULES)
+]
+
+
+@pytest.fixture(scope="module")
+def workdir(tmp_path_factory):
+	# The script resolves everything relative to a src/ working directory
+	cwd = makeRepo(tmp_path_factory.mktemp("repo"))
+
+	# Warm the compiled dictionaries and the catalog, as on any second run
+	run(["-O", "--next", "WeakMage", "--offline"], cwd)
+	return cwd
+
+
+def run(args, cwd):
+	"""-------------------------------------------------------------------
+		Function:		[run]
+		Description:	Runs the script once under -X importtime
+		Input:
+		  [args]		Command line arguments of the script, None to only
+		  				start the interpreter
+		  [cwd]			Working directory
+		Return:			(wall seconds, dict of module to cumulative import
+						microseconds)
+		------------------------------------------------------------------
+	"""
+	cmd = [sys.executable, "-X", "importtime"]
+	cmd += [SCRIPT_PATH] + args if args is not None else ["-c", "pass"]
+	start = clock()
+	proc = subprocess.run(cmd, cwd=cwd, stdout=subprocess.DEVNULL,
+		stderr=subprocess.PIPE, universal_newlines=True)
+	elapsed = clock() - start
+
+	imports = {}
+	for line in proc.stderr.splitlines():
+		if not line.startswith("import time:") or "|" not in line:
+			continue
+		(_, cumulative, name) = line[len("import time:"):].split("|")
+		if cumulative.strip().isdigit():
+			imports[name.strip()] = int(cumulative)
+	return (elapsed, imports)
+
+
+def coldStart(args, cwd):
+	runs = [run(args, cwd) for i in range(RUNS)]
+	return min(runs, key=lambda r: r[0])
+
+
+@pytest.mark.parametrize("args, budget, lazy", MODES,
+	ids=[" ".join(mode[0]) for mode in MODES])
+def test_cold_start_budget(workdir, args, budget, lazy):
+	(bare, bare_imports) = coldStart(None, workdir)
+	(elapsed, imports) = coldStart(args, workdir)
+
+	loaded = [name for name in lazy if name in imports]
+	assert loaded == [], "%s loaded by %s" % (loaded, " ".join(args))
+
+	slowest = sorted(((us, name) for (name, us) in imports.items()
+		if name not in bare_imports), reverse=True)[:10]
+	report = "\n".join("%8.1f ms  %s" % (us / 1000.0, name) for (us, name) in slowest)
+	assert elapsed - bare <= budget, "%s took %.0f ms over a bare start, " % (
+		" ".join(args), (elapsed - bare) * 1000) + "slowest imports:\n" + report